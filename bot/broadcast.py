@@ -0,0 +1,174 @@
+import asyncio
+import time
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Iterable, List, Optional, Tuple
+
+import httpx
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+from config.config import (
+    BROADCAST_WORKERS, BROADCAST_RATE_PER_SECOND, BROADCAST_BURST, BROADCAST_MAX_RETRIES, BROADCAST_PROGRESS_EVERY
+)
+from logger_config import logger
+
+# Сообщение рассылки: (ключ для отчёта, chat_id, текст)
+BroadcastMessage = Tuple[Any, int, str]
+
+
+class TokenBucket:
+    """
+    Глобальный token bucket на все воркеры рассылки: не больше rate сообщений в секунду.
+    После RetryAfter от Telegram ставится на паузу целиком — ждать должны все отправители.
+    burst держим маленьким: иначе накопленный запас уходит разом и первая секунда превышает rate.
+    """
+
+    def __init__(self, rate: float, burst: float = 1.0):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+        # время паузы не должно превратиться в накопленные токены
+        self.updated = self.paused_until
+
+    async def take(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class BroadcastStats:
+    """Прогресс и итог рассылки."""
+
+    def __init__(self, name: str, total: int):
+        self.name = name
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.sent_keys: List[Any] = []
+        self.failed_keys: List[Any] = []
+        self.started = time.monotonic()
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    @property
+    def throughput(self) -> float:
+        return self.sent / self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"{self.name}: {self.sent + self.failed}/{self.total} done, sent={self.sent}, "
+            f"failed={self.failed}, retried={self.retried}, "
+            f"elapsed={self.elapsed:.1f}s, {self.throughput:.1f} msg/s"
+        )
+
+
+def _retry_after_seconds(error: RetryAfter) -> float:
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+def _not_sent(error: TimedOut) -> bool:
+    """Таймаут до отправки запроса (ждали соединение из пула или connect) — сообщение точно не ушло"""
+    return isinstance(error.__cause__, (httpx.PoolTimeout, httpx.ConnectTimeout))
+
+
+async def broadcast(bot, messages: Iterable[BroadcastMessage], name: str = "broadcast",
+                    workers: int = BROADCAST_WORKERS,
+                    rate_per_second: float = BROADCAST_RATE_PER_SECOND,
+                    on_result: Optional[Callable[[Any, bool], Awaitable[Any]]] = None) -> BroadcastStats:
+    """
+    Рассылает сообщения пулом из workers отправителей под общим лимитом скорости.
+    on_result(key, ok) вызывается сразу после окончательного результата каждого сообщения.
+    RetryAfter -> пауза всей рассылки и повтор сообщения; сетевые ошибки -> до BROADCAST_MAX_RETRIES повторов;
+    TimedOut на чтении ответа не повторяется: Telegram мог уже доставить сообщение, повтор дал бы дубль.
+    Forbidden (бот заблокирован), BadRequest и прочие ошибки -> сообщение считается неотправленным.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    for message in messages:
+        queue.put_nowait((message, 0))
+
+    stats = BroadcastStats(name, queue.qsize())
+    if not stats.total:
+        return stats
+
+    bucket = TokenBucket(rate_per_second, BROADCAST_BURST)
+
+    async def _done(key, ok: bool):
+        if ok:
+            stats.sent += 1
+            stats.sent_keys.append(key)
+        else:
+            stats.failed += 1
+            stats.failed_keys.append(key)
+        if (stats.sent + stats.failed) % BROADCAST_PROGRESS_EVERY == 0:
+            logger.info(f"Broadcast progress — {stats.summary()}")
+        if on_result is not None:
+            await on_result(key, ok)
+
+    async def worker():
+        while True:
+            try:
+                (key, chat_id, text), attempt = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+
+            await bucket.take()
+            try:
+                await bot.send_message(chat_id=chat_id, text=text)
+            except RetryAfter as e:
+                delay = _retry_after_seconds(e)
+                logger.warning(f"{name}: RetryAfter {delay}s from Telegram, pausing broadcast")
+                bucket.pause(delay)
+                stats.retried += 1
+                queue.put_nowait(((key, chat_id, text), attempt))
+            except Forbidden as e:
+                logger.info(f"{name}: user {chat_id} blocked the bot: {e}")
+                await _done(key, False)
+            except BadRequest as e:
+                # BadRequest наследуется от NetworkError, но повторять его бессмысленно (чат не найден и т.п.)
+                logger.error(f"{name}: bad request for {chat_id}: {e}")
+                await _done(key, False)
+            except TimedOut as e:
+                if _not_sent(e) and attempt < BROADCAST_MAX_RETRIES:
+                    stats.retried += 1
+                    queue.put_nowait(((key, chat_id, text), attempt + 1))
+                else:
+                    # запрос ушёл, ответа не дождались: доставка неизвестна, лучше пропуск, чем дубль
+                    logger.error(f"{name}: timed out sending to {chat_id}, not retrying: {e}")
+                    await _done(key, False)
+            except NetworkError as e:
+                if attempt < BROADCAST_MAX_RETRIES:
+                    stats.retried += 1
+                    queue.put_nowait(((key, chat_id, text), attempt + 1))
+                else:
+                    logger.error(f"{name}: giving up on {chat_id} after {attempt + 1} attempts: {e}")
+                    await _done(key, False)
+            except Exception as e:
+                logger.error(f"{name}: error sending to {chat_id}: {e}")
+                await _done(key, False)
+            else:
+                await _done(key, True)
+
+    await asyncio.gather(*(worker() for _ in range(max(1, min(workers, stats.total)))))
+    logger.info(f"Broadcast finished — {stats.summary()}")
+    return stats
@@ -0,0 +1,78 @@
+"""Маршрутизация inline-кнопок по callback_data вида "ns:action[:arg]".
+
+Вместо десятков CallbackQueryHandler с регулярками (PTB проверяет их по
+очереди для каждого апдейта) — один обработчик и поиск в словаре.
+Старые callback_data (кнопки в уже отправленных сообщениях) переводятся
+в новую схему через таблицу алиасов.
+"""
+from telegram import Update
+from telegram.ext import CallbackQueryHandler, ContextTypes
+from logger_config import logger
+
+
+def make_callback_data(ns: str, action: str, arg: str = "") -> str:
+    """callback_data для кнопки; Telegram ограничивает её 64 байтами"""
+    data = f"{ns}:{action}:{arg}" if arg else f"{ns}:{action}"
+    if len(data.encode()) > 64:
+        raise ValueError(f"callback_data too long: {data!r}")
+    return data
+
+
+class CallbackRouter:
+    def __init__(self):
+        self._routes = {}          # (ns, action) -> (callback, takes_arg)
+        self._aliases = {}         # старая callback_data -> новая
+        self._prefix_aliases = []  # (старый префикс, "ns:action") — хвост становится arg
+
+    def add(self, ns: str, action: str, callback, takes_arg: bool = False):
+        """callback(update, context) или, при takes_arg, callback(update, context, arg)"""
+        key = (ns, action)
+        if key in self._routes:
+            raise ValueError(f"Route {ns}:{action} already registered")
+        self._routes[key] = (callback, takes_arg)
+
+    def wrap_callbacks(self, wrapper):
+        """Заменяет каждый callback на wrapper(callback) — например, для замера времени"""
+        self._routes = {key: (wrapper(callback), takes_arg) for key, (callback, takes_arg) in self._routes.items()}
+
+    def alias(self, legacy: str, data: str):
+        self._aliases[legacy] = data
+
+    def alias_prefix(self, legacy_prefix: str, ns_action: str):
+        self._prefix_aliases.append((legacy_prefix, ns_action))
+
+    def _normalize(self, data: str) -> str:
+        new = self._aliases.get(data)
+        if new is not None:
+            return new
+        for prefix, ns_action in self._prefix_aliases:
+            if data.startswith(prefix):
+                return f"{ns_action}:{data[len(prefix):]}"
+        return data
+
+    def resolve(self, data):
+        """(callback, takes_arg, arg) для callback_data или None"""
+        if not isinstance(data, str):
+            return None
+        ns, _, rest = self._normalize(data).partition(":")
+        action, _, arg = rest.partition(":")
+        route = self._routes.get((ns, action))
+        if route is None:
+            return None
+        callback, takes_arg = route
+        return callback, takes_arg, arg
+
+    def _matches(self, data) -> bool:
+        return self.resolve(data) is not None
+
+    async def _dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        data = update.callback_query.data
+        callback, takes_arg, arg = self.resolve(data)
+        logger.debug(f"Callback {data!r} -> {callback.__name__}({arg!r})")
+        if takes_arg:
+            return await callback(update, context, arg)
+        return await callback(update, context)
+
+    def handler(self) -> CallbackQueryHandler:
+        """Единый CallbackQueryHandler для всех зарегистрированных маршрутов"""
+        return CallbackQueryHandler(self._dispatch, pattern=self._matches)
@@ -0,0 +1,114 @@
+"""Кэш графиков по содержимому.
+
+Ключ — хэш функции отрисовки и ровно тех данных, что попадают на график
+(в них уже есть даты, поэтому на следующий день ключ меняется сам).
+Значение — PNG в LRU с ограничением по байтам и, по желанию, на диске.
+Дополнительно запоминаем file_id, который Telegram вернул на первую
+отправку: повторно картинку можно отправить без загрузки.
+"""
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from config.config import CHART_CACHE_MAX_BYTES, CHART_CACHE_DIR, CHART_CACHE_DISK_DAYS
+from logger_config import logger
+
+_png_cache = OrderedDict()   # key -> bytes, в порядке последнего обращения
+_png_cache_bytes = 0
+_file_ids = OrderedDict()    # key -> Telegram file_id
+_FILE_IDS_MAX = 10000
+
+
+def chart_key(func_name: str, *args) -> str:
+    """Ключ графика: sha1 от имени функции и repr данных"""
+    raw = repr((func_name,) + args).encode()
+    return hashlib.sha1(raw).hexdigest()
+
+
+def _disk_path(key: str) -> str:
+    return os.path.join(CHART_CACHE_DIR, f"{key}.png")
+
+
+def get_png(key: str):
+    """PNG из памяти или с диска; None, если графика нет"""
+    png = _png_cache.get(key)
+    if png is not None:
+        _png_cache.move_to_end(key)
+        return png
+
+    if CHART_CACHE_DIR:
+        try:
+            with open(_disk_path(key), "rb") as f:
+                png = f.read()
+        except FileNotFoundError:
+            return None
+        _put_memory(key, png)
+        return png
+    return None
+
+
+def _put_memory(key: str, png: bytes):
+    global _png_cache_bytes
+    if key in _png_cache:
+        return
+    _png_cache[key] = png
+    _png_cache_bytes += len(png)
+    while _png_cache_bytes > CHART_CACHE_MAX_BYTES and _png_cache:
+        _, old = _png_cache.popitem(last=False)
+        _png_cache_bytes -= len(old)
+
+
+def put_png(key: str, png: bytes):
+    _put_memory(key, png)
+    if CHART_CACHE_DIR:
+        try:
+            os.makedirs(CHART_CACHE_DIR, exist_ok=True)
+            tmp_path = _disk_path(key) + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(png)
+            os.replace(tmp_path, _disk_path(key))
+        except OSError as e:
+            logger.warning(f"Failed to write chart {key} to disk cache: {e}")
+
+
+def get_file_id(key: str):
+    file_id = _file_ids.get(key)
+    if file_id is not None:
+        _file_ids.move_to_end(key)
+    return file_id
+
+
+def remember_file_id(key: str, message):
+    """Запоминает file_id самой большой версии фото из ответа reply_photo"""
+    if not key or message is None or not message.photo:
+        return
+    _file_ids[key] = message.photo[-1].file_id
+    _file_ids.move_to_end(key)
+    while len(_file_ids) > _FILE_IDS_MAX:
+        _file_ids.popitem(last=False)
+
+
+def forget_file_id(key: str):
+    _file_ids.pop(key, None)
+
+
+def trim_disk_cache():
+    """Удаляет с диска графики старше CHART_CACHE_DISK_DAYS"""
+    if not CHART_CACHE_DIR or not os.path.isdir(CHART_CACHE_DIR):
+        return
+    cutoff = time.time() - CHART_CACHE_DISK_DAYS * 86400
+    removed = 0
+    for name in os.listdir(CHART_CACHE_DIR):
+        path = os.path.join(CHART_CACHE_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            continue
+    if removed:
+        logger.info(f"Chart disk cache: removed {removed} stale files")
+
+
+def get_chart_cache_metrics() -> dict:
+    return {"entries": len(_png_cache), "bytes": _png_cache_bytes, "file_ids": len(_file_ids)}
@@ -0,0 +1,140 @@
+"""Отрисовка графиков вне event loop.
+
+Функции здесь чистые: принимают готовые данные (списки дат и чисел) и
+возвращают PNG в байтах. Модуль не трогает БД и event loop, поэтому
+его можно выполнять в пуле процессов или потоков (см. bot/charts.py).
+Глобальное состояние pyplot не используется: каждая отрисовка создаёт
+свой Figure с FigureCanvasAgg, поэтому графики можно строить параллельно
+в потоках, а фигура освобождается сборщиком мусора даже при исключении.
+"""
+import io
+
+import matplotlib
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+
+# Настройка matplotlib для русского языка — при импорте: модуль может загрузиться
+# в воркере не сразу, а при первом графике (см. bot/chart_worker.py)
+matplotlib.rcParams['font.family'] = 'DejaVu Sans'
+matplotlib.rcParams['axes.unicode_minus'] = False
+
+
+def _new_figure(figsize):
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig, fig.add_subplot()
+
+
+def _to_png(fig) -> bytes:
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', dpi=150, bbox_inches='tight')
+    return buf.getvalue()
+
+
+def render_monthly_chart(dates: list, calories: list) -> bytes:
+    """График калорий за месяц: dates — список date, calories — калории по дням"""
+    fig, ax = _new_figure((12, 6))
+
+    # Строим линейный график
+    ax.plot(range(len(dates)), calories, color='#2196F3', linewidth=2, marker='o', markersize=4)
+
+    # Настраиваем оси
+    ax.set_xlabel('Дни месяца', fontsize=12)
+    ax.set_ylabel('Калории', fontsize=12)
+    ax.set_title('Калории за месяц', fontsize=14, fontweight='bold')
+
+    # Настраиваем подписи на оси X (каждые 5 дней)
+    step = 5
+    ax.set_xticks(range(0, len(dates), step))
+    ax.set_xticklabels([dates[i].strftime('%d.%m') for i in range(0, len(dates), step)], rotation=45)
+
+    # Настраиваем сетку
+    ax.grid(True, alpha=0.3)
+    ax.set_axisbelow(True)
+
+    fig.tight_layout()
+    return _to_png(fig)
+
+
+def render_goal_progress_chart(dates: list, weights: list, current_weight: float,
+                               target_weight: float, goal_type: str) -> bytes:
+    """План достижения цели: вес по неделям от стартовой даты до целевой"""
+    fig, ax = _new_figure((12, 8))
+
+    # Строим линию прогресса
+    ax.plot(dates, weights, color='#4CAF50', linewidth=3, marker='o', markersize=6, label='План')
+
+    # Текущий вес (красная точка) и целевая точка (зеленая точка)
+    ax.scatter([dates[0]], [current_weight], color='red', s=100, zorder=5, label='Текущий вес')
+    ax.scatter([dates[-1]], [target_weight], color='green', s=100, zorder=5, label='Целевой вес')
+
+    # Настраиваем оси
+    ax.set_xlabel('Дата', fontsize=12)
+    ax.set_ylabel('Вес (кг)', fontsize=12)
+    ax.set_title(f'Прогресс достижения цели: {goal_type}', fontsize=14, fontweight='bold')
+
+    # Настраиваем подписи на оси X (каждые 2 недели)
+    step = max(1, len(dates) // 8)
+    ax.set_xticks(dates[::step])
+    ax.set_xticklabels([date.strftime('%d.%m') for date in dates[::step]], rotation=45)
+
+    # Сетка и легенда
+    ax.grid(True, alpha=0.3)
+    ax.set_axisbelow(True)
+    ax.legend()
+
+    # Аннотации
+    ax.annotate(f'Начало: {current_weight} кг',
+                xy=(dates[0], current_weight), xytext=(10, 10),
+                textcoords='offset points', fontsize=10, color='red')
+
+    ax.annotate(f'Цель: {target_weight} кг\n{dates[-1].strftime("%d.%m.%Y")}',
+                xy=(dates[-1], target_weight), xytext=(10, -20),
+                textcoords='offset points', fontsize=10, color='green')
+
+    fig.tight_layout()
+    return _to_png(fig)
+
+
+def render_current_progress_chart(weeks_data: list, expected_weights: list, current_date,
+                                  current_weight: float, expected_weight: float,
+                                  start_date) -> bytes:
+    """Текущий прогресс: ожидаемая линия и отметка, где должен быть вес сегодня"""
+    fig, ax = _new_figure((12, 6))
+
+    # Линия ожидаемого прогресса
+    ax.plot(weeks_data, expected_weights, color='#4CAF50', linewidth=2,
+            linestyle='--', alpha=0.7, label='Ожидаемый прогресс')
+
+    # Текущая дата и отметки
+    ax.axvline(x=current_date, color='red', linestyle='-', alpha=0.7, label='Сегодня')
+    ax.scatter([current_date], [current_weight], color='red', s=100, zorder=5, label='Изначальный вес')
+    ax.scatter([current_date], [expected_weight], color='blue', s=100, zorder=5, label='Ожидаемый вес')
+
+    # Настройка осей
+    ax.set_xlabel('Дата', fontsize=12)
+    ax.set_ylabel('Вес (кг)', fontsize=12)
+    ax.set_title('Текущий прогресс', fontsize=14, fontweight='bold')
+
+    # Подписи на оси X (равномерно распределяем)
+    step = max(1, len(weeks_data) // 10)
+    ax.set_xticks(weeks_data[::step])
+    ax.set_xticklabels([date.strftime('%d.%m') for date in weeks_data[::step]], rotation=45)
+
+    # Сетка и легенда
+    ax.grid(True, alpha=0.3)
+    ax.set_axisbelow(True)
+    ax.legend()
+
+    # Информация о прогрессе
+    progress_info = f"Изначальный вес: {current_weight:.1f} кг\nОжидаемый: {expected_weight:.1f} кг"
+    ax.text(0.02, 0.98, progress_info, transform=ax.transAxes, fontsize=10,
+            verticalalignment='top', bbox=dict(boxstyle='round', facecolor='wheat', alpha=0.8))
+
+    # Дата начала
+    ax.text(0.02, 0.02, f"Начало: {start_date.strftime('%d.%m.%Y')}", transform=ax.transAxes,
+            fontsize=8, alpha=0.7, bbox=dict(boxstyle='round', facecolor='lightgray', alpha=0.5))
+
+    fig.tight_layout()
+    return _to_png(fig)
@@ -0,0 +1,27 @@
+"""Задачи пула отрисовки графиков.
+
+Модуль лёгкий: в пул передаётся имя функции отрисовки ("bot.chart_render.render_monthly_chart"),
+а сам модуль с matplotlib/Pillow импортируется уже в воркере. Основному процессу не нужно
+тратить время на импорт matplotlib при старте.
+"""
+import importlib
+
+
+def init_worker(renderer: str):
+    """Инициализатор воркера: заранее импортирует модуль основного рендерера.
+
+    При CHART_MONTHLY_RENDERER=pillow это только Pillow; matplotlib (графики цели)
+    подгрузится в воркере при первом таком графике.
+    """
+    importlib.import_module(renderer.rpartition(".")[0])
+
+
+def ping() -> bool:
+    """Пустая задача — чтобы заранее поднять воркеры пула"""
+    return True
+
+
+def render(path: str, *args) -> bytes:
+    """Вызывает функцию отрисовки по полному имени "модуль.функция\""""
+    module, _, name = path.rpartition(".")
+    return getattr(importlib.import_module(module), name)(*args)
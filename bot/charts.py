@@ -1,173 +1,221 @@
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
+import asyncio
+import multiprocessing
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timedelta
-from bot.database import get_meals_last_30_days
-import io
-import base64
-import logging
+from telegram.error import BadRequest
+from bot.database import get_daily_calorie_columns
+from bot import chart_worker
+from bot.chart_cache import chart_key, get_png, put_png, get_file_id, remember_file_id, forget_file_id, trim_disk_cache
+from config.config import CHART_WORKERS, CHART_MAX_PENDING, CHART_EXECUTOR, CHART_MONTHLY_RENDERER
+from logger_config import logger, log_event
 
-logger = logging.getLogger(__name__)
 
-# Настройка matplotlib для русского языка
-plt.rcParams['font.family'] = 'DejaVu Sans'
-plt.rcParams['axes.unicode_minus'] = False
+# Функции отрисовки передаются в пул по имени — matplotlib и Pillow импортируются только в воркерах
+MONTHLY_CHART = "bot.chart_render.render_monthly_chart"
+MONTHLY_CHART_PIL = "bot.chart_render_pil.render_monthly_chart"
+GOAL_PROGRESS_CHART = "bot.chart_render.render_goal_progress_chart"
+CURRENT_PROGRESS_CHART = "bot.chart_render.render_current_progress_chart"
+
+
+class ChartRendererBusy(Exception):
+    """Очередь отрисовки переполнена — график сейчас не строим"""
+
+
+# Пул для matplotlib (процессы или потоки): отрисовка не блокирует event loop
+_pool = None
+_pending = 0
+# key -> (renderer, args) для графиков, отданных как file_id: если Telegram его отвергнет,
+# а PNG уже вытеснен из кэша, reply_chart перерисует график
+_file_id_sources = OrderedDict()
+_FILE_ID_SOURCES_MAX = 256
+
+
+def _monthly_renderer() -> str:
+    return MONTHLY_CHART_PIL if CHART_MONTHLY_RENDERER == "pillow" else MONTHLY_CHART
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        # воркер импортирует только выбранный рендерер месячного графика
+        initargs = (_monthly_renderer(),)
+        if CHART_EXECUTOR == "thread":
+            _pool = ThreadPoolExecutor(
+                max_workers=CHART_WORKERS,
+                thread_name_prefix="chart",
+                initializer=chart_worker.init_worker,
+                initargs=initargs,
+            )
+        else:
+            _pool = ProcessPoolExecutor(
+                max_workers=CHART_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=chart_worker.init_worker,
+                initargs=initargs,
+            )
+        logger.info(f"Chart render pool started: {CHART_WORKERS} {CHART_EXECUTOR} workers")
+    return _pool
+
+
+def warm_chart_pool():
+    """Поднимает воркеры заранее, чтобы первый график не ждал импорт matplotlib"""
+    trim_disk_cache()
+    pool = _get_pool()
+    for _ in range(CHART_WORKERS):
+        pool.submit(chart_worker.ping)
+
+
+def shutdown_chart_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+async def _render(renderer: str, *args):
+    """Возвращает (photo, key): file_id или PNG из кэша, иначе рисует в пуле.
+
+    При переполнении очереди отрисовки — ChartRendererBusy.
+    """
+    global _pending, _pool
+    key = chart_key(renderer, *args)
+    chart = renderer.rpartition(".")[2]
+    file_id = get_file_id(key)
+    if file_id is not None:
+        log_event("chart", chart=chart, cache_hit="file_id")
+        _file_id_sources[key] = (renderer, args)
+        _file_id_sources.move_to_end(key)
+        while len(_file_id_sources) > _FILE_ID_SOURCES_MAX:
+            _file_id_sources.popitem(last=False)
+        return file_id, key
+    png = get_png(key)
+    if png is not None:
+        log_event("chart", chart=chart, cache_hit="png")
+        return png, key
+
+    if _pending >= CHART_MAX_PENDING:
+        raise ChartRendererBusy(f"{_pending} charts already queued")
+
+    _pending += 1
+    started = time.perf_counter()
+    try:
+        loop = asyncio.get_running_loop()
+        png = await loop.run_in_executor(_get_pool(), chart_worker.render, renderer, *args)
+    except BrokenProcessPool:
+        # воркер упал (например, OOM) — пересоздадим пул при следующем запросе
+        logger.error("Chart render pool is broken, recreating")
+        _pool = None
+        raise
+    finally:
+        _pending -= 1
+
+    log_event("chart", chart=chart, cache_hit=False,
+              latency_ms=round((time.perf_counter() - started) * 1000, 1), bytes=len(png))
+    put_png(key, png)
+    return png, key
+
+
+async def reply_chart(message, photo, key: str, **kwargs):
+    """reply_photo с запоминанием file_id; протухший file_id заменяем на PNG (из кэша или перерисованный)"""
+    source = _file_id_sources.pop(key, None)
+    try:
+        sent = await message.reply_photo(photo=photo, **kwargs)
+    except BadRequest:
+        if not isinstance(photo, str):
+            raise
+        logger.warning(f"Cached file_id for chart {key} rejected, re-uploading")
+        forget_file_id(key)
+        png = get_png(key)
+        if png is None:
+            if source is None:
+                raise
+            # file_id уже забыт — _render возьмёт PNG из кэша или нарисует заново
+            png, _ = await _render(source[0], *source[1])
+        sent = await message.reply_photo(photo=png, **kwargs)
+    remember_file_id(key, sent)
+    return sent
+
+
+def daily_calories(user_id: int, start_date, days: int = 30) -> list:
+    """Суммы калорий по дням начиная с start_date: bincount по номеру дня"""
+    import numpy as np  # импорт при первом графике, а не при старте бота
+    day_offsets, meal_calories = get_daily_calorie_columns(user_id, start_date.isoformat())
+    offsets = np.asarray(day_offsets, dtype=np.int64)
+    in_range = (offsets >= 0) & (offsets < days)
+    return np.bincount(offsets[in_range],
+                       weights=np.asarray(meal_calories, dtype=np.float64)[in_range],
+                       minlength=days).tolist()
+
 
 async def create_monthly_chart(user_id: int):
-    """Создает график калорий за месяц"""
-    meals = get_meals_last_30_days(user_id)
-    
-    # Группируем по дням
-    daily_calories = {}
-    for meal in meals:
-        date_str = meal['timestamp'].split()[0]
-        date = datetime.strptime(date_str, "%Y-%m-%d").date()
-        if date not in daily_calories:
-            daily_calories[date] = 0
-        daily_calories[date] += meal['calories']
-    
-    # Создаем список дат за последние 30 дней
+    """Создает график калорий за месяц. Возвращает (photo, key) для reply_chart"""
+    # Последние 30 дней, включая сегодня
     end_date = datetime.now().date()
     start_date = end_date - timedelta(days=29)
     dates = [start_date + timedelta(days=i) for i in range(30)]
-    
-    # Создаем список калорий для каждого дня
-    calories = [daily_calories.get(date, 0) for date in dates]
-    
-    # Создаем график
-    fig, ax = plt.subplots(figsize=(12, 6))
-    
-    # Строим линейный график
-    ax.plot(range(len(dates)), calories, color='#2196F3', linewidth=2, marker='o', markersize=4)
-    
-    # Настраиваем оси
-    ax.set_xlabel('Дни месяца', fontsize=12)
-    ax.set_ylabel('Калории', fontsize=12)
-    ax.set_title('Калории за месяц', fontsize=14, fontweight='bold')
-    
-    # Настраиваем подписи на оси X (каждые 5 дней)
-    step = 5
-    ax.set_xticks(range(0, len(dates), step))
-    ax.set_xticklabels([dates[i].strftime('%d.%m') for i in range(0, len(dates), step)], rotation=45)
-    
-    # Настраиваем сетку
-    ax.grid(True, alpha=0.3)
-    ax.set_axisbelow(True)
-    
-    # Настраиваем отступы
-    plt.tight_layout()
-    
-    # Сохраняем в байты
-    img_buffer = io.BytesIO()
-    plt.savefig(img_buffer, format='png', dpi=150, bbox_inches='tight')
-    img_buffer.seek(0)
-    plt.close()
-    
-    return img_buffer
-
-
-async def create_goal_progress_chart(user_id: int, current_weight: float, target_weight: float, 
+    calories = daily_calories(user_id, start_date)
+
+    return await _render(_monthly_renderer(), dates, calories)
+
+
+async def create_goal_progress_chart(user_id: int, current_weight: float, target_weight: float,
                                    goal_type: str, goal_rate: str, start_date: datetime = None):
     """Создает график прогресса достижения цели"""
-    
+    import numpy as np
+
     # Парсим темп (например, "0.5кг/нед")
     kg_per_week = float(goal_rate.replace('кг/нед', ''))
-    
+
     # Если дата начала не указана, берем текущую дату
     if start_date is None:
         start_date = datetime.now().date()
     else:
         start_date = start_date.date()
-    
+
     # Рассчитываем количество недель до достижения цели
     weight_difference = abs(target_weight - current_weight)
     weeks_to_goal = int(weight_difference / kg_per_week)
-    
+
     # Создаем список дат (каждую неделю)
     dates = [start_date + timedelta(weeks=i) for i in range(weeks_to_goal + 1)]
-    
-    # Рассчитываем вес для каждой недели
-    weights = []
-    for i in range(len(dates)):
-        if goal_type == "lose":
-            weight = current_weight - (kg_per_week * i)
-        else:  # gain
-            weight = current_weight + (kg_per_week * i)
-        weights.append(weight)
-    
-    # Создаем график
-    fig, ax = plt.subplots(figsize=(12, 8))
-    
-    # Строим линию прогресса
-    ax.plot(dates, weights, color='#4CAF50', linewidth=3, marker='o', markersize=6, label='План')
-    
-    # Добавляем текущий вес (красная точка)
-    ax.scatter([start_date], [current_weight], color='red', s=100, zorder=5, label='Текущий вес')
-    
-    # Добавляем целевую точку (зеленая точка)
-    ax.scatter([dates[-1]], [target_weight], color='green', s=100, zorder=5, label='Целевой вес')
-    
-    # Настраиваем оси
-    ax.set_xlabel('Дата', fontsize=12)
-    ax.set_ylabel('Вес (кг)', fontsize=12)
-    ax.set_title(f'Прогресс достижения цели: {goal_type}', fontsize=14, fontweight='bold')
-    
-    # Настраиваем подписи на оси X (каждые 2 недели)
-    step = max(1, len(dates) // 8)
-    ax.set_xticks(dates[::step])
-    ax.set_xticklabels([date.strftime('%d.%m') for date in dates[::step]], rotation=45)
-    
-    # Добавляем сетку
-    ax.grid(True, alpha=0.3)
-    ax.set_axisbelow(True)
-    
-    # Добавляем легенду
-    ax.legend()
-    
-    # Добавляем аннотации
-    ax.annotate(f'Начало: {current_weight} кг', 
-                xy=(start_date, current_weight), xytext=(10, 10),
-                textcoords='offset points', fontsize=10, color='red')
-    
-    ax.annotate(f'Цель: {target_weight} кг\n{dates[-1].strftime("%d.%m.%Y")}', 
-                xy=(dates[-1], target_weight), xytext=(10, -20),
-                textcoords='offset points', fontsize=10, color='green')
-    
-    # Настраиваем отступы
-    plt.tight_layout()
-    
-    # Сохраняем в байты
-    img_buffer = io.BytesIO()
-    plt.savefig(img_buffer, format='png', dpi=150, bbox_inches='tight')
-    img_buffer.seek(0)
-    plt.close()
-    
-    return img_buffer, dates[-1]  # Возвращаем также дату достижения цели
-
-async def create_current_progress_chart(user_id: int, current_weight: float, target_weight: float, 
+
+    # Вес для каждой недели
+    direction = -1 if goal_type == "lose" else 1
+    weights = (current_weight + direction * kg_per_week * np.arange(len(dates))).tolist()
+
+    photo, key = await _render(GOAL_PROGRESS_CHART,
+                               dates, weights, current_weight, target_weight, goal_type)
+    return photo, dates[-1], key  # Возвращаем также дату достижения цели
+
+async def create_current_progress_chart(user_id: int, current_weight: float, target_weight: float,
                                         goal_type: str, goal_rate: str, start_date: datetime = None):
     """Создает график текущего прогресса с отметкой где должен быть вес сейчас"""
-    
+    import numpy as np
+
     logger.info(f"Creating current progress chart for user {user_id}")
     logger.info(f"Params: current_weight={current_weight}, target_weight={target_weight}, goal_type={goal_type}, goal_rate={goal_rate}, start_date={start_date}")
-    
+
     # Парсим темп
     try:
         kg_per_week = float(goal_rate.replace('кг/нед', ''))
     except ValueError:
         logger.error(f"Invalid goal_rate format: {goal_rate}")
         kg_per_week = 0.5  # fallback
-    
+
     # Если дата начала не указана, используем текущую дату
     if start_date is None:
         start_date = datetime.now()
         logger.warning(f"No start date provided for user {user_id}, using current date: {start_date}")
-    
+
     # Рассчитываем сколько недель прошло
     days_passed = (datetime.now().date() - start_date.date()).days
     weeks_passed = days_passed / 7.0
-    
+
     logger.info(f"Days passed: {days_passed}, Weeks passed: {weeks_passed:.2f}")
-    
+
     # Рассчитываем какой вес должен быть сейчас
     if goal_type == "lose":
         expected_weight = current_weight - (kg_per_week * weeks_passed)
@@ -175,81 +223,30 @@ async def create_current_progress_chart(user_id: int, current_weight: float, tar
     else:  # gain
         expected_weight = current_weight + (kg_per_week * weeks_passed)
         expected_weight = min(expected_weight, target_weight)
-    
+
     logger.info(f"Expected weight: {expected_weight:.2f} kg")
-    
+
     # Рассчитываем дату достижения цели
     if goal_type == "lose":
         weeks_to_goal = (current_weight - target_weight) / kg_per_week if kg_per_week > 0 else 0
     else:  # gain
         weeks_to_goal = (target_weight - current_weight) / kg_per_week if kg_per_week > 0 else 0
-    
+
     goal_date = start_date + timedelta(weeks=weeks_to_goal)
-    
+
     # Генерируем данные для графика (всегда до даты цели, минимум 8 недель)
     num_weeks = max(8, int(weeks_to_goal) + 1)
-    weeks_data = []
-    expected_weights = []
-    weights_data = []
-    
-    for i in range(num_weeks):
-        week_date = start_date.date() + timedelta(weeks=i)
-        if goal_type == "lose":
-            expected = current_weight - (kg_per_week * i)
-            expected = max(expected, target_weight)
-        else:
-            expected = current_weight + (kg_per_week * i)
-            expected = min(expected, target_weight)
-        
-        weeks_data.append(week_date)
-        expected_weights.append(expected)
-        weights_data.append(None)
-    
-    # Создаем график
-    fig, ax = plt.subplots(figsize=(12, 6))
-    
-    # Линия ожидаемого прогресса
-    ax.plot(weeks_data, expected_weights, color='#4CAF50', linewidth=2, 
-            linestyle='--', alpha=0.7, label='Ожидаемый прогресс')
-    
-    # Текущая дата и отметки
-    current_date = datetime.now().date()
-    ax.axvline(x=current_date, color='red', linestyle='-', alpha=0.7, label='Сегодня')
-    ax.scatter([current_date], [current_weight], color='red', s=100, zorder=5, label='Изначальный вес')
-    ax.scatter([current_date], [expected_weight], color='blue', s=100, zorder=5, label='Ожидаемый вес')
-    
-    # Настройка осей
-    ax.set_xlabel('Дата', fontsize=12)
-    ax.set_ylabel('Вес (кг)', fontsize=12)
-    ax.set_title('Текущий прогресс', fontsize=14, fontweight='bold')
-    
-    # Подписи на оси X (равномерно распределяем)
-    step = max(1, len(weeks_data)//10)
-    ax.set_xticks(weeks_data[::step])
-    ax.set_xticklabels([date.strftime('%d.%m') for date in weeks_data[::step]], rotation=45)
-    
-    # Сетка и легенда
-    ax.grid(True, alpha=0.3)
-    ax.set_axisbelow(True)
-    ax.legend()
-    
-    # Информация о прогрессе
-    progress_info = f"Изначальный вес: {current_weight:.1f} кг\nОжидаемый: {expected_weight:.1f} кг"
-    ax.text(0.02, 0.98, progress_info, transform=ax.transAxes, fontsize=10,
-            verticalalignment='top', bbox=dict(boxstyle='round', facecolor='wheat', alpha=0.8))
-    
-    # Дата начала
-    ax.text(0.02, 0.02, f"Начало: {start_date.strftime('%d.%m.%Y')}", transform=ax.transAxes, 
-            fontsize=8, alpha=0.7, bbox=dict(boxstyle='round', facecolor='lightgray', alpha=0.5))
-    
-    plt.tight_layout()
-    
-    # Сохраняем в байты
-    img_buffer = io.BytesIO()
-    plt.savefig(img_buffer, format='png', dpi=150, bbox_inches='tight')
-    img_buffer.seek(0)
-    plt.close()
-    
-    logger.info(f"Progress chart created successfully for user {user_id}")
-    return img_buffer, goal_date
+    weeks_data = [start_date.date() + timedelta(weeks=i) for i in range(num_weeks)]
+    trajectory = current_weight + (-1 if goal_type == "lose" else 1) * kg_per_week * np.arange(num_weeks)
+    if goal_type == "lose":
+        trajectory = np.maximum(trajectory, target_weight)
+    else:
+        trajectory = np.minimum(trajectory, target_weight)
+    expected_weights = trajectory.tolist()
+
+    photo, key = await _render(CURRENT_PROGRESS_CHART,
+                               weeks_data, expected_weights, datetime.now().date(),
+                               current_weight, expected_weight, start_date.date())
 
+    logger.info(f"Progress chart created successfully for user {user_id}")
+    return photo, goal_date, key
@@ -1,7 +1,8 @@
 import sqlite3
 import os
-from config.config import DATABASE_PATH
+from config.config import DATABASE_PATH, DEFAULT_TIMEZONE
 from datetime import datetime, timedelta
+from bot.sharding import user_bucket
 from logger_config import logger
 
 
@@ -31,7 +32,9 @@ def init_db():
             goal_rate TEXT,
             goal_start_date TEXT,
             notifications_enabled INTEGER DEFAULT 1,
-            last_menu_request DATETIME        
+            last_menu_request DATETIME,
+            last_meal_at TEXT NOT NULL DEFAULT '',
+            timezone TEXT NOT NULL DEFAULT 'Europe/Moscow'
         )
         ''')
 
@@ -60,8 +63,61 @@ def init_db():
             )
         ''')
 
+        # Все выборки по приёмам пищи идут по пользователю и времени
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_meals_user_ts ON meals (user_id, timestamp)")
+
+        # Планировщик перечитывает напоминания по пользователю; выборка по времени больше не нужна
+        cursor.execute("DROP INDEX IF EXISTS idx_meal_reminders_time")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_meal_reminders_user ON meal_reminders (user_id)")
+
+        # Outbox уведомлений: dedup_key не даёт поставить одно и то же уведомление дважды
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS notification_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                dedup_key TEXT NOT NULL UNIQUE,
+                user_id INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                claimed_by TEXT,
+                claimed_at REAL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                processed_at DATETIME
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_outbox_status_id ON notification_outbox (status, id)")
+
+        # Окна per-user лимитов GPT (общие для всех процессов бота, см. RATE_LIMIT_BACKEND)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS rate_limit_events (
+                user_id INTEGER NOT NULL,
+                ts REAL NOT NULL
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_rate_limit_events_user_ts ON rate_limit_events (user_id, ts)")
+
+        # Состояние диалогов и context.user_data (см. bot/persistence.py), значения — pickle
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS persistence_user_data (
+                user_id INTEGER PRIMARY KEY,
+                data BLOB NOT NULL,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS persistence_conversations (
+                name TEXT NOT NULL,
+                conv_key TEXT NOT NULL,
+                user_id INTEGER,
+                state BLOB NOT NULL,
+                PRIMARY KEY (name, conv_key)
+            )
+        ''')
+
         conn.commit()
 
+        # WAL позволяет нескольким процессам читать, пока один пишет
+        cursor.execute("PRAGMA journal_mode=WAL")
+
         # Миграция: если таблица users была старой — добавим колонки (без потери данных)
         existing = [r["name"] for r in cursor.execute("PRAGMA table_info(users)").fetchall()]
         if 'goal_type' not in existing:
@@ -70,6 +126,19 @@ def init_db():
             cursor.execute("ALTER TABLE users ADD COLUMN target_weight REAL")
         if 'goal_rate' not in existing:
             cursor.execute("ALTER TABLE users ADD COLUMN goal_rate TEXT")
+        if 'last_meal_at' not in existing:
+            # Денормализованное время последнего приёма пищи ('' — ещё не ел), заполняем из истории
+            cursor.execute("ALTER TABLE users ADD COLUMN last_meal_at TEXT NOT NULL DEFAULT ''")
+            cursor.execute('''
+                UPDATE users SET last_meal_at = COALESCE(
+                    (SELECT MAX(timestamp) FROM meals WHERE meals.user_id = users.user_id), ''
+                )
+            ''')
+        if 'timezone' not in existing:
+            cursor.execute("ALTER TABLE users ADD COLUMN timezone TEXT NOT NULL DEFAULT 'Europe/Moscow'")
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_users_notifications_last_meal ON users (notifications_enabled, last_meal_at)"
+        )
         conn.commit()
 
         conn.close()
@@ -84,6 +153,45 @@ def get_db_connection():
     conn.row_factory = sqlite3.Row
     return conn
 
+
+def reserve_rate_limit_slot(user_id: int, now: float, window_seconds: int, max_requests: int, timeout: float = 5):
+    """
+    Атомарно (одна транзакция BEGIN IMMEDIATE) чистит старые записи окна, считает оставшиеся
+    и резервирует новую. Возвращает None при успехе или ts самой старой записи окна, если лимит исчерпан.
+    Если за timeout секунд не удалось взять запись — sqlite3.OperationalError.
+    """
+    conn = sqlite3.connect(DATABASE_PATH, timeout=timeout, isolation_level=None)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            "DELETE FROM rate_limit_events WHERE user_id = ? AND ts <= ?",
+            (user_id, now - window_seconds)
+        )
+        count, oldest = conn.execute(
+            "SELECT COUNT(*), MIN(ts) FROM rate_limit_events WHERE user_id = ?",
+            (user_id,)
+        ).fetchone()
+        if count >= max_requests:
+            conn.execute("ROLLBACK")
+            return oldest
+        conn.execute("INSERT INTO rate_limit_events (user_id, ts) VALUES (?, ?)", (user_id, now))
+        conn.execute("COMMIT")
+        return None
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def release_rate_limit_slot(user_id: int, ts: float, timeout: float = 5):
+    """Удаляет ранее зарезервированную запись окна (откат при ошибке вызова GPT)."""
+    conn = sqlite3.connect(DATABASE_PATH, timeout=timeout)
+    conn.execute("DELETE FROM rate_limit_events WHERE user_id = ? AND ts = ?", (user_id, ts))
+    conn.commit()
+    conn.close()
+
 # --- Макросы: добавлены параметры факторности (по умолчанию старые значения) ---
 def calculate_macros(weight: float, daily_calories: float, protein_factor: float = 1.8, fat_factor: float = 1.0):
     protein_g = weight * protein_factor
@@ -158,10 +266,15 @@ def get_user(user_id):
 
 def add_meal(user_id, food_text, calories, protein=0, fat=0, carbs=0):
     conn = get_db_connection()
-    conn.execute(
+    cursor = conn.execute(
         "INSERT INTO meals (user_id, food_text, calories, protein, fat, carbs) VALUES (?, ?, ?, ?, ?, ?)",
         (user_id, food_text, calories, protein, fat, carbs)
     )
+    # держим users.last_meal_at в той же транзакции, что и сам приём пищи
+    conn.execute(
+        "UPDATE users SET last_meal_at = (SELECT timestamp FROM meals WHERE id = ?) WHERE user_id = ?",
+        (cursor.lastrowid, user_id)
+    )
     conn.commit()
     conn.close()
 
@@ -217,6 +330,23 @@ def get_stats(user_id):
     return {"day": day, "week": week, "month": month}
 
 
+def get_day_progress(user_id: int):
+    """(дневная норма, калорий за сегодня) одним запросом; None — профиля нет"""
+    conn = get_db_connection()
+    row = conn.execute("""
+        SELECT
+            u.daily_calories,
+            (SELECT SUM(calories) FROM meals
+             WHERE user_id = u.user_id AND date(timestamp) = date('now')) AS eaten
+        FROM users u
+        WHERE u.user_id = ?
+    """, (user_id,)).fetchone()
+    conn.close()
+    if not row:
+        return None
+    return row["daily_calories"] or 0, row["eaten"] or 0
+
+
 def get_meals_last_7_days(user_id):
     """Возвращает приёмы пищи за последние 7 дней"""
     conn = get_db_connection()
@@ -240,10 +370,38 @@ def delete_meals_for_day(user_id: int) -> bool:
         (user_id,)
     )
     deleted_count = cursor.rowcount
+    if deleted_count:
+        cursor.execute(
+            "UPDATE users SET last_meal_at = COALESCE((SELECT MAX(timestamp) FROM meals WHERE user_id = ?), '') "
+            "WHERE user_id = ?",
+            (user_id, user_id)
+        )
     conn.commit()
     conn.close()
     return deleted_count > 0
 
+def get_daily_calorie_columns(user_id: int, start_date: str):
+    """Калории по приёмам пищи начиная с start_date (YYYY-MM-DD) в виде колонок.
+
+    Возвращает (day_offsets, calories): номер дня от start_date и калории,
+    без построчных словарей — дальше агрегируется через numpy.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT CAST(julianday(date(timestamp)) - julianday(?) AS INTEGER), calories
+        FROM meals
+        WHERE user_id = ? AND timestamp >= ?
+    """, (start_date, user_id, start_date))
+    rows = cursor.fetchall()
+    conn.close()
+
+    if not rows:
+        return (), ()
+    day_offsets, calories = zip(*rows)
+    return day_offsets, calories
+
+
 def get_meals_last_30_days(user_id: int):
     """Получает приёмы пищи за последние 30 дней"""
     conn = get_db_connection()
@@ -363,6 +521,18 @@ def set_notifications(user_id: int, enabled: bool):
     conn.commit()
     conn.close()
 
+def get_user_timezone(user_id: int) -> str:
+    conn = get_db_connection()
+    row = conn.execute("SELECT timezone FROM users WHERE user_id = ?", (user_id,)).fetchone()
+    conn.close()
+    return row[0] if row and row[0] else DEFAULT_TIMEZONE
+
+def set_user_timezone(user_id: int, tz_name: str):
+    conn = get_db_connection()
+    conn.execute("UPDATE users SET timezone = ? WHERE user_id = ?", (tz_name, user_id))
+    conn.commit()
+    conn.close()
+
 def get_notifications_status(user_id: int) -> bool:
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -401,4 +571,217 @@ def add_meal_reminder(user_id: int, meal_index: int, name: str, time_str: str):
         (user_id, meal_index, name, time_str)
     )
     conn.commit()
-    conn.close()
\ No newline at end of file
+    conn.close()
+
+
+# Все напоминания вместе с часовым поясом пользователя (для планировщика напоминаний).
+# shard/shards — только пользователи своего шарда (см. bot.sharding.user_bucket).
+def get_all_meal_reminders(shard: int = None, shards: int = 1):
+    conn = get_db_connection()
+    params = []
+    shard_filter = ""
+    if shard is not None and shards > 1:
+        conn.create_function("user_bucket", 2, user_bucket, deterministic=True)
+        shard_filter = "WHERE user_bucket(m.user_id, ?) = ?"
+        params += [shards, shard]
+    rows = conn.execute(f"""
+        SELECT m.user_id, m.meal_index, m.name, m.time, u.timezone
+        FROM meal_reminders m
+        JOIN users u ON u.user_id = m.user_id
+        {shard_filter}
+    """, params).fetchall()
+    conn.close()
+    return [
+        (r["user_id"], r["meal_index"], r["name"], r["time"], r["timezone"] or DEFAULT_TIMEZONE)
+        for r in rows
+    ]
+
+# Оставляет из списка только пользователей с включёнными уведомлениями (поиск по первичному ключу)
+def filter_notifications_enabled(user_ids):
+    user_ids = list(set(user_ids))
+    enabled = set()
+    if not user_ids:
+        return enabled
+    conn = get_db_connection()
+    chunk = 500  # держимся ниже лимита SQLite на число параметров
+    for i in range(0, len(user_ids), chunk):
+        part = user_ids[i:i + chunk]
+        placeholders = ",".join("?" * len(part))
+        rows = conn.execute(
+            f"SELECT user_id FROM users WHERE notifications_enabled = 1 AND user_id IN ({placeholders})",
+            part
+        ).fetchall()
+        enabled.update(r[0] for r in rows)
+    conn.close()
+    return enabled
+
+# Пользователи с включёнными уведомлениями, которые не ели с cutoff (UTC).
+# last_meal_at = '' у тех, кто ещё ничего не вносил, поэтому это один диапазон по индексу
+# (notifications_enabled, last_meal_at) без сканирования meals.
+# slot/slots — пользователи слотов рассылки 0..slot (см. bot.sharding.user_bucket): свой слот и те,
+# кто не поместился в предыдущие или пропущен простоем. dedup_prefix — пропустить пользователей,
+# у которых в outbox уже есть уведомление с ключом dedup_prefix + user_id.
+# limit — не больше стольких пользователей, сначала из более ранних слотов.
+def get_users_to_remind(cutoff: datetime, slot: int = None, slots: int = 1,
+                        dedup_prefix: str = None, limit: int = None):
+    conn = get_db_connection()
+    params = [cutoff.strftime("%Y-%m-%d %H:%M:%S")]
+    filters = ""
+    order = ""
+    if slot is not None and slots > 1:
+        conn.create_function("user_bucket", 2, user_bucket, deterministic=True)
+        filters += " AND user_bucket(user_id, ?) <= ?"
+        params += [slots, slot]
+        order = "ORDER BY user_bucket(user_id, ?), user_id"
+    if dedup_prefix is not None:
+        filters += " AND NOT EXISTS (SELECT 1 FROM notification_outbox o WHERE o.dedup_key = ? || users.user_id)"
+        params.append(dedup_prefix)
+    if order:
+        params.append(slots)
+    limit_clause = ""
+    if limit:
+        limit_clause = "LIMIT ?"
+        params.append(limit)
+    rows = conn.execute(f"""
+        SELECT user_id FROM users
+        WHERE notifications_enabled = 1 AND last_meal_at < ? {filters}
+        {order} {limit_clause}
+    """, params).fetchall()
+    conn.close()
+    return [r[0] for r in rows]
+
+
+# --- Outbox уведомлений ---
+# Статусы: pending -> sending (забрано воркером) -> sent | failed
+
+def enqueue_notifications(notifications, timeout: float = 5):
+    """
+    Ставит уведомления в outbox одной транзакцией.
+    notifications — список (dedup_key, user_id, text); уже поставленные ключи пропускаются.
+    Возвращает число реально добавленных строк.
+    """
+    conn = sqlite3.connect(DATABASE_PATH, timeout=timeout)
+    before = conn.total_changes
+    conn.executemany(
+        "INSERT OR IGNORE INTO notification_outbox (dedup_key, user_id, text) VALUES (?, ?, ?)",
+        notifications
+    )
+    conn.commit()
+    added = conn.total_changes - before
+    conn.close()
+    return added
+
+
+def claim_outbox_batch(worker_id: str, limit: int, claim_timeout: int, timeout: float = 5):
+    """
+    Атомарно забирает до limit строк для отправки: новые и те, чей прошлый захват истёк
+    (воркер упал посреди батча). Несколько процессов могут разбирать очередь параллельно.
+    Если за timeout секунд не удалось взять запись — sqlite3.OperationalError.
+    """
+    now = datetime.now().timestamp()
+    conn = sqlite3.connect(DATABASE_PATH, timeout=timeout, isolation_level=None)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        rows = conn.execute("""
+            SELECT id, user_id, text FROM notification_outbox
+            WHERE status = 'pending' OR (status = 'sending' AND claimed_at < ?)
+            ORDER BY id
+            LIMIT ?
+        """, (now - claim_timeout, limit)).fetchall()
+        if rows:
+            placeholders = ",".join("?" * len(rows))
+            conn.execute(
+                f"UPDATE notification_outbox SET status = 'sending', claimed_by = ?, claimed_at = ? "
+                f"WHERE id IN ({placeholders})",
+                [worker_id, now] + [r[0] for r in rows]
+            )
+        conn.execute("COMMIT")
+        return rows
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def mark_outbox_processed(sent_ids, failed_ids, timeout: float = 5):
+    """Отмечает результат отправки строк outbox (одной строки или остатка батча)."""
+    conn = sqlite3.connect(DATABASE_PATH, timeout=timeout)
+    conn.executemany(
+        "UPDATE notification_outbox SET status = 'sent', processed_at = CURRENT_TIMESTAMP WHERE id = ?",
+        [(i,) for i in sent_ids]
+    )
+    conn.executemany(
+        "UPDATE notification_outbox SET status = 'failed', processed_at = CURRENT_TIMESTAMP WHERE id = ?",
+        [(i,) for i in failed_ids]
+    )
+    conn.commit()
+    conn.close()
+
+
+def purge_notification_outbox(keep_days: int, timeout: float = 5):
+    """Удаляет обработанные строки старше keep_days (ключи дедупликации нужны только на время рассылки)."""
+    conn = sqlite3.connect(DATABASE_PATH, timeout=timeout)
+    cursor = conn.execute(
+        "DELETE FROM notification_outbox WHERE status IN ('sent', 'failed') AND created_at < datetime('now', ?)",
+        (f"-{int(keep_days)} days",)
+    )
+    deleted = cursor.rowcount
+    conn.commit()
+    conn.close()
+    return deleted
+
+
+# --- Persistence для PTB (bot/persistence.py) ---
+# shard/shards — загрузить только пользователей своего шарда (см. bot.sharding.user_bucket).
+
+def _shard_filter(conn, column: str, shard: int, shards: int):
+    if shard is None or shards <= 1:
+        return "", []
+    conn.create_function("user_bucket", 2, user_bucket, deterministic=True)
+    return f"WHERE user_bucket({column}, ?) = ?", [shards, shard]
+
+
+def load_persisted_user_data(shard: int = None, shards: int = 1):
+    """[(user_id, pickle)] сохранённых context.user_data"""
+    conn = get_db_connection()
+    where, params = _shard_filter(conn, "user_id", shard, shards)
+    rows = conn.execute(f"SELECT user_id, data FROM persistence_user_data {where}", params).fetchall()
+    conn.close()
+    return [(r["user_id"], r["data"]) for r in rows]
+
+
+def load_persisted_conversations(name: str, shard: int = None, shards: int = 1):
+    """[(conv_key, pickle состояния)] диалогов ConversationHandler'а name"""
+    conn = get_db_connection()
+    where, params = _shard_filter(conn, "user_id", shard, shards)
+    where = f"{where} AND name = ?" if where else "WHERE name = ?"
+    rows = conn.execute(
+        f"SELECT conv_key, state FROM persistence_conversations {where}", params + [name]
+    ).fetchall()
+    conn.close()
+    return [(r["conv_key"], r["state"]) for r in rows]
+
+
+def save_persistence_batch(user_rows, dropped_users, conversation_rows, dropped_conversations):
+    """
+    Пишет накопленные изменения одной транзакцией.
+    user_rows — [(user_id, pickle)], conversation_rows — [(name, conv_key, user_id, pickle)],
+    dropped_users — [user_id], dropped_conversations — [(name, conv_key)].
+    """
+    conn = get_db_connection()
+    conn.executemany(
+        "INSERT OR REPLACE INTO persistence_user_data (user_id, data, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)",
+        user_rows
+    )
+    conn.executemany("DELETE FROM persistence_user_data WHERE user_id = ?", [(u,) for u in dropped_users])
+    conn.executemany(
+        "INSERT OR REPLACE INTO persistence_conversations (name, conv_key, user_id, state) VALUES (?, ?, ?, ?)",
+        conversation_rows
+    )
+    conn.executemany(
+        "DELETE FROM persistence_conversations WHERE name = ? AND conv_key = ?", dropped_conversations
+    )
+    conn.commit()
+    conn.close()
@@ -1,9 +1,11 @@
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.error import TelegramError
 from telegram.ext import (
     CommandHandler, MessageHandler, CallbackQueryHandler,
     ConversationHandler, ContextTypes, filters, CallbackContext
 )
 from bot.database import get_db_connection, add_user, get_user, add_meal, get_stats, get_meals_last_7_days, set_notifications, get_notifications_status
+from bot.database import get_user_timezone, set_user_timezone, get_day_progress
 from bot.utils import calculate_daily_calories, get_main_menu, render_progress_bar, render_menu_to_image
 from bot.database import calculate_macros, delete_meals_for_day, get_user_goal_info, update_goal_start_date, get_goal_start_date, add_meal_reminder, clear_meal_reminders, get_meal_reminders
 from bot.yandex_gpt import analyze_food_with_gpt, analyze_menu_with_gpt
@@ -11,15 +13,25 @@ from bot.rate_limiter import call_gpt_with_limits, RateLimitExceeded, check_menu
 from config.config import YANDEX_GPT_API_KEY, YANDEX_GPT_FOLDER_ID
 from datetime import datetime
 from collections import defaultdict
-from bot.charts import create_monthly_chart
+from bot.charts import create_monthly_chart, reply_chart, ChartRendererBusy
 from bot.yandex_speechkit import YandexSpeechToText
+import asyncio
 import os
 from logger_config import logger
 import random
-from bot.reminder_scheduler import send_meal_reminders
+from bot.reminder_scheduler import reindex_user_reminders
+from bot.callback_router import CallbackRouter, make_callback_data
 
 
-stt = YandexSpeechToText()
+_stt = None
+
+
+def _get_stt() -> YandexSpeechToText:
+    """Клиент SpeechKit создаётся при первом голосовом сообщении"""
+    global _stt
+    if _stt is None:
+        _stt = YandexSpeechToText()
+    return _stt
 
 # --- Состояния ---
 # Регистрация
@@ -46,6 +58,24 @@ ACTIVITY_LABELS = {
     'high': 'Высокая'
 }
 
+# Часовые пояса для напоминаний: tz-имя -> (город, смещение относительно МСК)
+TIMEZONES = {
+    "Europe/Kaliningrad": ("Калининград", "МСК-1"),
+    "Europe/Moscow": ("Москва", "МСК"),
+    "Europe/Samara": ("Самара", "МСК+1"),
+    "Asia/Yekaterinburg": ("Екатеринбург", "МСК+2"),
+    "Asia/Omsk": ("Омск", "МСК+3"),
+    "Asia/Novosibirsk": ("Новосибирск", "МСК+4"),
+    "Asia/Irkutsk": ("Иркутск", "МСК+5"),
+    "Asia/Yakutsk": ("Якутск", "МСК+6"),
+    "Asia/Vladivostok": ("Владивосток", "МСК+7"),
+    "Asia/Magadan": ("Магадан", "МСК+8"),
+    "Asia/Kamchatka": ("Камчатка", "МСК+9"),
+}
+
+def _tz_label(tz_name: str) -> str:
+    return TIMEZONES.get(tz_name, (tz_name, tz_name))[1]
+
 disclaimer_text = (
         "\n\nℹ️ Я не врач, все расчеты примерные. "
         "Используй бота как ориентир и прислушивайся к своему организму. "
@@ -248,7 +278,7 @@ async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     gender_str = "Мужской" if gender == "male" else "Женский"
 
-    keyboard = [[InlineKeyboardButton("✏️ Редактировать профиль", callback_data="edit_profile")],
+    keyboard = [[InlineKeyboardButton("✏️ Редактировать профиль", callback_data=make_callback_data("profile", "edit"))],
                 [InlineKeyboardButton("⏰ Расписание уведомлений", callback_data="meal_reminders")]]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
@@ -279,51 +309,38 @@ async def edit_profile_start(update: Update, context: ContextTypes.DEFAULT_TYPE)
     logger.info(f"User {user_id} started editing profile")
 
     keyboard = [
-        [InlineKeyboardButton("👤 Имя", callback_data="edit_name"),
-        InlineKeyboardButton("⚖️ Вес", callback_data="edit_weight")],
-        [InlineKeyboardButton("📏 Рост", callback_data="edit_height"),
-        InlineKeyboardButton("🎂 Возраст", callback_data="edit_age")],
-        [InlineKeyboardButton("🚻 Пол", callback_data="edit_gender"),
-        InlineKeyboardButton("🏃 Активность", callback_data="edit_activity")],
-        [InlineKeyboardButton("🎯 Цель", callback_data="edit_goal")]
+        [InlineKeyboardButton("👤 Имя", callback_data=make_callback_data("profile", "field", "name")),
+        InlineKeyboardButton("⚖️ Вес", callback_data=make_callback_data("profile", "field", "weight"))],
+        [InlineKeyboardButton("📏 Рост", callback_data=make_callback_data("profile", "field", "height")),
+        InlineKeyboardButton("🎂 Возраст", callback_data=make_callback_data("profile", "field", "age"))],
+        [InlineKeyboardButton("🚻 Пол", callback_data=make_callback_data("profile", "gender")),
+        InlineKeyboardButton("🏃 Активность", callback_data=make_callback_data("profile", "activity"))],
+        [InlineKeyboardButton("🎯 Цель", callback_data=make_callback_data("profile", "goal"))]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     await query.message.edit_text("Выбери параметр профиля, который нужно изменить 👇", reply_markup=reply_markup)
     logger.debug(f"User {user_id} edit profile menu sent")
 
-# Обработчики для каждого поля
-async def edit_name_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    query = update.callback_query
-    await query.answer()
-    context.user_data['editing_field'] = 'name'
-    await query.message.edit_text("Введи новое имя:", reply_markup=None)
-    logger.info(f"User {user_id} editing field: name")
-
-async def edit_weight_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    query = update.callback_query
-    await query.answer()
-    context.user_data['editing_field'] = 'weight'
-    await query.message.edit_text("Введи новый вес (кг):", reply_markup=None)
-    logger.info(f"User {user_id} editing field: weight")
-
-async def edit_height_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    query = update.callback_query
-    await query.answer()
-    context.user_data['editing_field'] = 'height'
-    await query.message.edit_text("Введи новый рост (см):", reply_markup=None)
-    logger.info(f"User {user_id} editing field: height")
+# Обработчик для текстовых полей профиля (callback "profile:field:<поле>")
+EDIT_FIELD_PROMPTS = {
+    'name': "Введи новое имя:",
+    'weight': "Введи новый вес (кг):",
+    'height': "Введи новый рост (см):",
+    'age': "Введи новый возраст:",
+}
 
-async def edit_age_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def edit_field_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, field: str):
     user_id = update.effective_user.id
     query = update.callback_query
     await query.answer()
-    context.user_data['editing_field'] = 'age'
-    await query.message.edit_text("Введи новый возраст:", reply_markup=None)
-    logger.info(f"User {user_id} editing field: age")
+    prompt = EDIT_FIELD_PROMPTS.get(field)
+    if prompt is None:
+        logger.warning(f"User {user_id} sent unknown profile field {field!r}")
+        return
+    context.user_data['editing_field'] = field
+    await query.message.edit_text(prompt, reply_markup=None)
+    logger.info(f"User {user_id} editing field: {field}")
 
 async def edit_gender_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
@@ -331,8 +348,8 @@ async def edit_gender_callback(update: Update, context: ContextTypes.DEFAULT_TYP
     await query.answer()
     
     keyboard = [
-        [InlineKeyboardButton("🚹Мужской", callback_data="set_gender_male"),
-         InlineKeyboardButton("🚺Женский", callback_data="set_gender_female")]
+        [InlineKeyboardButton("🚹Мужской", callback_data=make_callback_data("profile", "set_gender", "male")),
+         InlineKeyboardButton("🚺Женский", callback_data=make_callback_data("profile", "set_gender", "female"))]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
@@ -352,10 +369,10 @@ async def edit_activity_callback(update: Update, context: ContextTypes.DEFAULT_T
     await query.answer()
     
     keyboard = [
-        [InlineKeyboardButton("Нет активности", callback_data="set_activity_none")],
-        [InlineKeyboardButton("Минимальная", callback_data="set_activity_low")],
-        [InlineKeyboardButton("Средняя", callback_data="set_activity_medium")],
-        [InlineKeyboardButton("Высокая", callback_data="set_activity_high")]
+        [InlineKeyboardButton("Нет активности", callback_data=make_callback_data("profile", "set_activity", "none"))],
+        [InlineKeyboardButton("Минимальная", callback_data=make_callback_data("profile", "set_activity", "low"))],
+        [InlineKeyboardButton("Средняя", callback_data=make_callback_data("profile", "set_activity", "medium"))],
+        [InlineKeyboardButton("Высокая", callback_data=make_callback_data("profile", "set_activity", "high"))]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
@@ -374,9 +391,9 @@ async def edit_goal_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
     await query.answer()
     
     keyboard = [
-        [InlineKeyboardButton("Похудеть", callback_data="set_goal_lose")],
-        [InlineKeyboardButton("Набрать", callback_data="set_goal_gain")],
-        [InlineKeyboardButton("Поддерживать", callback_data="set_goal_maintain")]
+        [InlineKeyboardButton("Похудеть", callback_data=make_callback_data("profile", "set_goal", "lose"))],
+        [InlineKeyboardButton("Набрать", callback_data=make_callback_data("profile", "set_goal", "gain"))],
+        [InlineKeyboardButton("Поддерживать", callback_data=make_callback_data("profile", "set_goal", "maintain"))]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
@@ -391,14 +408,12 @@ async def edit_goal_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 # Обработчик текстовых сообщений для редактирования
 async def handle_all_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    logger.info(f"handle_all_text_input вызван для пользователя {update.effective_user.id}")
-    logger.info(f"editing_field: {context.user_data.get('editing_field')}")
-    logger.info(f"editing_goal: {context.user_data.get('editing_goal')}")
-
     # Проверяем, что пользователь в процессе редактирования
+    # (вызывается на каждый свободный текст — не логируем, время и user_id попадут в событие "handler")
     if 'editing_field' not in context.user_data and 'editing_goal' not in context.user_data:
-        logger.info("Пользователь не в процессе редактирования, пропускаем")
         return
+    logger.debug(f"User {update.effective_user.id} text input: editing_field={context.user_data.get('editing_field')}, "
+                 f"editing_goal={context.user_data.get('editing_goal')}")
 
     text = update.message.text
     user_id = update.effective_user.id
@@ -565,301 +580,154 @@ async def handle_all_text_input(update: Update, context: ContextTypes.DEFAULT_TY
         # Предлагаем темп
         if goal_type == "lose":
             keyboard = [
-                [InlineKeyboardButton("Долго и легко — 0.25 кг/нед", callback_data="set_rate_lose_slow")],
-                [InlineKeyboardButton("Сбалансированно — 0.5 кг/нед", callback_data="set_rate_lose_medium")],
-                [InlineKeyboardButton("Быстро — 1.0 кг/нед", callback_data="set_rate_lose_fast")]
+                [InlineKeyboardButton("Долго и легко — 0.25 кг/нед", callback_data=make_callback_data("profile", "set_rate", "lose_slow"))],
+                [InlineKeyboardButton("Сбалансированно — 0.5 кг/нед", callback_data=make_callback_data("profile", "set_rate", "lose_medium"))],
+                [InlineKeyboardButton("Быстро — 1.0 кг/нед", callback_data=make_callback_data("profile", "set_rate", "lose_fast"))]
             ]
         else:  # gain
             keyboard = [
-                [InlineKeyboardButton("Медленно — 0.25 кг/нед", callback_data="set_rate_gain_slow")],
-                [InlineKeyboardButton("Сбалансированно — 0.5 кг/нед", callback_data="set_rate_gain_medium")],
-                [InlineKeyboardButton("Быстро — 0.75 кг/нед", callback_data="set_rate_gain_fast")]
+                [InlineKeyboardButton("Медленно — 0.25 кг/нед", callback_data=make_callback_data("profile", "set_rate", "gain_slow"))],
+                [InlineKeyboardButton("Сбалансированно — 0.5 кг/нед", callback_data=make_callback_data("profile", "set_rate", "gain_medium"))],
+                [InlineKeyboardButton("Быстро — 0.75 кг/нед", callback_data=make_callback_data("profile", "set_rate", "gain_fast"))]
             ]
 
         await update.message.reply_text("Выбери темп достижения цели:", reply_markup=InlineKeyboardMarkup(keyboard))
         logger.info(f"User {user_id} получил варианты темпа достижения цели для {goal_type}")
 
-# Обработчики для кнопок выбора пола
-async def set_gender_male(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    
-    user_id = update.effective_user.id
-    user = get_user(user_id)
-    logger.info(f"User {user_id} clicked 'Male' gender button")
-    if not user:
-        try:
-            await query.message.delete()
-        except Exception as e:
-            logger.warning(f"User {user_id} profile not found when trying to set gender to Male")
-            pass
-        await query.message.chat.send_message("Ошибка: профиль не найден.", reply_markup=get_main_menu())
-        return
-    
-    activity_code = [k for k, v in ACTIVITY_LABELS.items() if v == user["activity_level"]][0]
-    new_calories = calculate_daily_calories(user["weight"], user["height"], user["age"], "male", activity_code)
-    protein_norm, fat_norm, carbs_norm = calculate_macros(user["weight"], new_calories)
-    
-    add_user(user_id, user["name"], user["weight"], user["height"], user["age"], "male", 
-            user["activity_level"], new_calories,
-            goal_type=user.get("goal_type"), target_weight=user.get("target_weight"), 
-            goal_rate=user.get("goal_rate"))
-    
-    logger.info(
-    f"User {user_id} updated gender to Male; "
-    f"new_calories={new_calories}, protein={protein_norm}, fat={fat_norm}, carbs={carbs_norm}"
-    )
-    
+async def _reply_profile_not_found(query, user_id: int, what: str):
+    logger.warning(f"User {user_id} profile not found when trying to set {what}")
     try:
         await query.message.delete()
     except Exception:
         pass
-    
-    await query.message.chat.send_message(
-        f"✅ <b>Пол обновлён!</b>\n\n🎯 Новая норма калорий: {new_calories} ккал\n\n"
-        f"🥩Б: {protein_norm} г, 🥑Ж: {fat_norm} г, 🍞У: {carbs_norm} г" + disclaimer_text,
-        parse_mode="HTML", reply_markup=get_main_menu()
-    )
+    await query.message.chat.send_message("Ошибка: профиль не найден.", reply_markup=get_main_menu())
 
-async def set_gender_female(update: Update, context: ContextTypes.DEFAULT_TYPE):
+# Обработчик кнопок выбора пола (callback "profile:set_gender:<male|female>")
+async def set_gender(update: Update, context: ContextTypes.DEFAULT_TYPE, gender: str):
     query = update.callback_query
     await query.answer()
-    
+
     user_id = update.effective_user.id
+    if gender not in ("male", "female"):
+        logger.warning(f"User {user_id} sent unknown gender {gender!r}")
+        return
     user = get_user(user_id)
-    logger.info(f"User {user_id} clicked 'Female' gender button")
-    
+    logger.info(f"User {user_id} clicked '{gender}' gender button")
     if not user:
-        try:
-            await query.message.delete()
-        except Exception:
-            logger.warning(f"User {user_id} profile not found when trying to set gender to Female")
-            pass
-        await query.message.chat.send_message("Ошибка: профиль не найден.", reply_markup=get_main_menu())
+        await _reply_profile_not_found(query, user_id, f"gender to {gender}")
         return
-    
+
     activity_code = [k for k, v in ACTIVITY_LABELS.items() if v == user["activity_level"]][0]
-    new_calories = calculate_daily_calories(user["weight"], user["height"], user["age"], "female", activity_code)
+    new_calories = calculate_daily_calories(user["weight"], user["height"], user["age"], gender, activity_code)
     protein_norm, fat_norm, carbs_norm = calculate_macros(user["weight"], new_calories)
-    
-    add_user(user_id, user["name"], user["weight"], user["height"], user["age"], "female", 
+
+    add_user(user_id, user["name"], user["weight"], user["height"], user["age"], gender,
             user["activity_level"], new_calories,
-            goal_type=user.get("goal_type"), target_weight=user.get("target_weight"), 
+            goal_type=user.get("goal_type"), target_weight=user.get("target_weight"),
             goal_rate=user.get("goal_rate"))
-    
+
     logger.info(
-    f"User {user_id} updated gender to Female; "
+    f"User {user_id} updated gender to {gender}; "
     f"new_calories={new_calories}, protein={protein_norm}, fat={fat_norm}, carbs={carbs_norm}"
     )
-    
+
     try:
         await query.message.delete()
     except Exception:
         pass
-    
+
     await query.message.chat.send_message(
         f"✅ <b>Пол обновлён!</b>\n\n🎯 Новая норма калорий: {new_calories} ккал\n\n"
         f"🥩Б: {protein_norm} г, 🥑Ж: {fat_norm} г, 🍞У: {carbs_norm} г" + disclaimer_text,
         parse_mode="HTML", reply_markup=get_main_menu()
     )
 
-# Обработчики для кнопок выбора активности
-async def set_activity_none(update: Update, context: ContextTypes.DEFAULT_TYPE):
+# Обработчик кнопок выбора активности (callback "profile:set_activity:<none|low|medium|high>")
+async def set_activity(update: Update, context: ContextTypes.DEFAULT_TYPE, activity_code: str):
     query = update.callback_query
     await query.answer()
-    
-    user_id = update.effective_user.id
-    user = get_user(user_id)
-    logger.info(f"User {user_id} clicked activity level 'None'")
-    
-    if not user:
-        try:
-            await query.message.delete()
-        except Exception:
-            logger.warning(f"User {user_id} profile not found when trying to set activity level 'None'")
-            pass
-        await query.message.chat.send_message("Ошибка: профиль не найден.", reply_markup=get_main_menu())
-        return
-    
-    new_calories = calculate_daily_calories(user["weight"], user["height"], user["age"], user["gender"], "none")
-    protein_norm, fat_norm, carbs_norm = calculate_macros(user["weight"], new_calories)
-    
-    add_user(user_id, user["name"], user["weight"], user["height"], user["age"], user["gender"], 
-            "Нет активности", new_calories,
-            goal_type=user.get("goal_type"), target_weight=user.get("target_weight"), 
-            goal_rate=user.get("goal_rate"))
-    logger.info(
-    f"User {user_id} updated activity to 'None'; "
-    f"new_calories={new_calories}, protein={protein_norm}, fat={fat_norm}, carbs={carbs_norm}"
-    )
-    
-    try:
-        await query.message.delete()
-    except Exception:
-        pass
-    
-    await query.message.chat.send_message(
-        f"✅ <b>Активность обновлена!</b>\n\n🎯 Новая норма калорий: {new_calories} ккал\n\n"
-        f"🥩Б: {protein_norm} г, 🥑Ж: {fat_norm} г, 🍞У: {carbs_norm} г" + disclaimer_text,
-        parse_mode="HTML", reply_markup=get_main_menu()
-    )
 
-async def set_activity_low(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    
     user_id = update.effective_user.id
-    user = get_user(user_id)
-    logger.info(f"User {user_id} clicked activity level 'Low'")
-    
-    if not user:
-        try:
-            await query.message.delete()
-        except Exception:
-            logger.warning(f"User {user_id} profile not found when trying to set activity level 'Low'")
-            pass
-        await query.message.chat.send_message("Ошибка: профиль не найден.", reply_markup=get_main_menu())
+    activity_label = ACTIVITY_LABELS.get(activity_code)
+    if activity_label is None:
+        logger.warning(f"User {user_id} sent unknown activity level {activity_code!r}")
         return
-    
-    new_calories = calculate_daily_calories(user["weight"], user["height"], user["age"], user["gender"], "low")
-    protein_norm, fat_norm, carbs_norm = calculate_macros(user["weight"], new_calories)
-    
-    add_user(user_id, user["name"], user["weight"], user["height"], user["age"], user["gender"], 
-            "Минимальная", new_calories,
-            goal_type=user.get("goal_type"), target_weight=user.get("target_weight"), 
-            goal_rate=user.get("goal_rate"))
-    logger.info(
-    f"User {user_id} updated activity to 'None'; "
-    f"new_calories={new_calories}, protein={protein_norm}, fat={fat_norm}, carbs={carbs_norm}"
-    )
-    
-    try:
-        await query.message.delete()
-    except Exception:
-        pass
-    
-    await query.message.chat.send_message(
-        f"✅ <b>Активность обновлена!</b>\n\n🎯 Новая норма калорий: {new_calories} ккал\n\n"
-        f"🥩Б: {protein_norm} г, 🥑Ж: {fat_norm} г, 🍞У: {carbs_norm} г" + disclaimer_text,
-        parse_mode="HTML", reply_markup=get_main_menu()
-    )
-
-async def set_activity_medium(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    
-    user_id = update.effective_user.id
     user = get_user(user_id)
-    logger.info(f"User {user_id} clicked activity level 'Medium'")
-    
+    logger.info(f"User {user_id} clicked activity level '{activity_code}'")
+
     if not user:
-        try:
-            await query.message.delete()
-        except Exception:
-            logger.warning(f"User {user_id} profile not found when trying to set activity level 'Medium'")
-            pass
-        await query.message.chat.send_message("Ошибка: профиль не найден.", reply_markup=get_main_menu())
+        await _reply_profile_not_found(query, user_id, f"activity level '{activity_code}'")
         return
-    
-    new_calories = calculate_daily_calories(user["weight"], user["height"], user["age"], user["gender"], "medium")
+
+    new_calories = calculate_daily_calories(user["weight"], user["height"], user["age"], user["gender"], activity_code)
     protein_norm, fat_norm, carbs_norm = calculate_macros(user["weight"], new_calories)
-    
-    add_user(user_id, user["name"], user["weight"], user["height"], user["age"], user["gender"], 
-            "Средняя", new_calories,
-            goal_type=user.get("goal_type"), target_weight=user.get("target_weight"), 
+
+    add_user(user_id, user["name"], user["weight"], user["height"], user["age"], user["gender"],
+            activity_label, new_calories,
+            goal_type=user.get("goal_type"), target_weight=user.get("target_weight"),
             goal_rate=user.get("goal_rate"))
     logger.info(
-    f"User {user_id} updated activity to 'None'; "
+    f"User {user_id} updated activity to '{activity_code}'; "
     f"new_calories={new_calories}, protein={protein_norm}, fat={fat_norm}, carbs={carbs_norm}"
     )
-    
+
     try:
         await query.message.delete()
     except Exception:
         pass
-    
+
     await query.message.chat.send_message(
         f"✅ <b>Активность обновлена!</b>\n\n🎯 Новая норма калорий: {new_calories} ккал\n\n"
         f"🥩Б: {protein_norm} г, 🥑Ж: {fat_norm} г, 🍞У: {carbs_norm} г" + disclaimer_text,
         parse_mode="HTML", reply_markup=get_main_menu()
     )
 
-async def set_activity_high(update: Update, context: ContextTypes.DEFAULT_TYPE):
+# Обработчик кнопок выбора цели (callback "profile:set_goal:<maintain|lose|gain>")
+async def set_goal(update: Update, context: ContextTypes.DEFAULT_TYPE, goal: str):
     query = update.callback_query
     await query.answer()
-    
     user_id = update.effective_user.id
-    user = get_user(user_id)
-    logger.info(f"User {user_id} clicked activity level 'High'")
+    logger.info(f"User {user_id} clicked '{goal}' goal button")
+
+    if goal in ("lose", "gain"):
+        # дальше ждём целевой вес текстом (handle_all_text_input)
+        context.user_data['editing_goal'] = goal
+        logger.info(f"User {user_id} entering target weight input for goal '{goal}'")
 
-    if not user:
         try:
             await query.message.delete()
-        except Exception:
-            logger.warning(f"User {user_id} profile not found when trying to set activity level 'High'")
+        except Exception as e:
+            logger.warning(f"Failed to delete message when entering target weight for user {user_id}: {e}")
             pass
-        await query.message.chat.send_message("Ошибка: профиль не найден.", reply_markup=get_main_menu())
+
+        await query.message.chat.send_message("Введи целевой вес (в кг):", reply_markup=None)
+        return
+
+    if goal != "maintain":
+        logger.warning(f"User {user_id} sent unknown goal {goal!r}")
         return
-    
-    new_calories = calculate_daily_calories(user["weight"], user["height"], user["age"], user["gender"], "high")
-    protein_norm, fat_norm, carbs_norm = calculate_macros(user["weight"], new_calories)
-    
-    add_user(user_id, user["name"], user["weight"], user["height"], user["age"], user["gender"], 
-            "Высокая", new_calories,
-            goal_type=user.get("goal_type"), target_weight=user.get("target_weight"), 
-            goal_rate=user.get("goal_rate"))
-    
-    logger.info(
-    f"User {user_id} updated activity to 'None'; "
-    f"new_calories={new_calories}, protein={protein_norm}, fat={fat_norm}, carbs={carbs_norm}"
-    )
-    
-    try:
-        await query.message.delete()
-    except Exception:
-        pass
-    
-    await query.message.chat.send_message(
-        f"✅ <b>Активность обновлена!</b>\n\n🎯 Новая норма калорий: {new_calories} ккал\n\n"
-        f"🥩Б: {protein_norm} г, 🥑Ж: {fat_norm} г, 🍞У: {carbs_norm} г" + disclaimer_text,
-        parse_mode="HTML", reply_markup=get_main_menu()
-    )
 
-# Обработчики для кнопок выбора цели
-async def set_goal_maintain(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    
-    user_id = update.effective_user.id
     user = get_user(user_id)
-    logger.info(f"User {user_id} clicked 'Maintain goal' button")
-    
     if not user:
-        logger.warning(f"User {user_id} profile not found when selecting 'maintain' goal")
-        try:
-            await query.message.delete()
-        except Exception as e:
-            logger.warning(f"Failed to delete message for user {user_id}: {e}")
-            pass
-        await query.message.chat.send_message("Ошибка: профиль не найден.", reply_markup=get_main_menu())
+        await _reply_profile_not_found(query, user_id, "'maintain' goal")
         return
-    
+
     activity_code = [k for k, v in ACTIVITY_LABELS.items() if v == user["activity_level"]][0]
     daily_calories = calculate_daily_calories(user["weight"], user["height"], user["age"], user["gender"], activity_code)
     protein_norm, fat_norm, carbs_norm = calculate_macros(user["weight"], daily_calories)
-    
+
     add_user(user_id, user["name"], user["weight"], user["height"], user["age"], user["gender"],
              user["activity_level"], daily_calories, goal_type='maintain', target_weight=None, goal_rate=None)
     logger.info(
         f"User {user_id} set goal to 'maintain'; "
         f"daily_calories={daily_calories}, protein={protein_norm}, fat={fat_norm}, carbs={carbs_norm}"
     )
-    
+
     try:
         await query.message.delete()
     except Exception:
         pass
-    
+
     await query.message.chat.send_message(
         f"✅ <b>Цель обновлена на «Поддерживать»!</b>\n\n"
         f"🎯 Новая норма калорий: {daily_calories} ккал\n\n"
@@ -868,65 +736,27 @@ async def set_goal_maintain(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=get_main_menu()
     )
 
-async def set_goal_lose(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    user_id = update.effective_user.id
-    logger.info(f"User {user_id} clicked 'Lose weight' goal button")
-    
-    context.user_data['editing_goal'] = 'lose'
-    logger.info(f"User {user_id} entering target weight input for goal 'lose'")
-    
-    try:
-        await query.message.delete()
-    except Exception as e:
-        logger.warning(f"Failed to delete message when entering target weight for user {user_id}: {e}")
-        pass
-    
-    await query.message.chat.send_message("Введи целевой вес (в кг):", reply_markup=None)
-
-async def set_goal_gain(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    user_id = update.effective_user.id
-    logger.info(f"User {user_id} clicked 'Gain weight' goal button")
-
-    context.user_data['editing_goal'] = 'gain'
-    logger.info(f"User {user_id} entering target weight input for goal 'gain'")
-    
-    try:
-        await query.message.delete()
-    except Exception as e:
-        logger.warning(f"Failed to delete message when entering target weight for user {user_id}: {e}")
-        pass
-    
-    await query.message.chat.send_message("Введи целевой вес (в кг):", reply_markup=None)
-
-
-# Обработчики для выбора темпа
-async def set_rate_lose_slow(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    logger.info(f"User {update.effective_user.id} clicked rate_lose_slow (0.25 kg/week)")
-    await set_goal_with_rate(update, context, "lose", 0.25)
-
-async def set_rate_lose_medium(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    logger.info(f"User {update.effective_user.id} clicked rate_lose_medium (0.5 kg/week)")
-    await set_goal_with_rate(update, context, "lose", 0.5)
-
-async def set_rate_lose_fast(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    logger.info(f"User {update.effective_user.id} clicked rate_lose_fast (1.0 kg/week)")
-    await set_goal_with_rate(update, context, "lose", 1.0)
 
-async def set_rate_gain_slow(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    logger.info(f"User {update.effective_user.id} clicked rate_gain_slow (0.25 kg/week)")
-    await set_goal_with_rate(update, context, "gain", 0.25)
-
-async def set_rate_gain_medium(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    logger.info(f"User {update.effective_user.id} clicked rate_gain_medium (0.5 kg/week)")
-    await set_goal_with_rate(update, context, "gain", 0.5)
+# Темпы достижения цели: ключ кнопки -> (тип цели, кг в неделю)
+GOAL_RATES = {
+    'lose_slow': ("lose", 0.25),
+    'lose_medium': ("lose", 0.5),
+    'lose_fast': ("lose", 1.0),
+    'gain_slow': ("gain", 0.25),
+    'gain_medium': ("gain", 0.5),
+    'gain_fast': ("gain", 0.75),
+}
 
-async def set_rate_gain_fast(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    logger.info(f"User {update.effective_user.id} clicked rate_gain_fast (0.75 kg/week)")
-    await set_goal_with_rate(update, context, "gain", 0.75)
+# Обработчик выбора темпа (callback "profile:set_rate:<ключ GOAL_RATES>")
+async def set_rate(update: Update, context: ContextTypes.DEFAULT_TYPE, rate_key: str):
+    rate = GOAL_RATES.get(rate_key)
+    if rate is None:
+        logger.warning(f"User {update.effective_user.id} sent unknown goal rate {rate_key!r}")
+        await update.callback_query.answer()
+        return
+    goal_type, kg_per_week = rate
+    logger.info(f"User {update.effective_user.id} clicked rate_{rate_key} ({kg_per_week} kg/week)")
+    await set_goal_with_rate(update, context, goal_type, kg_per_week)
 
 async def set_goal_with_rate(update: Update, context: ContextTypes.DEFAULT_TYPE, goal_type: str, kg_per_week: float):
     query = update.callback_query
@@ -1006,6 +836,37 @@ async def add_meal_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     return ADD_MEAL
 
+def _format_meal_summary(items, totals_clean, already_eaten, daily_norm) -> str:
+    """Текст с распознанными продуктами и прогрессом по норме после добавления"""
+    projected = already_eaten + totals_clean['calories']
+    progress_after = render_progress_bar(projected, daily_norm)
+
+    warning_text = ""
+    if daily_norm > 0 and projected > daily_norm:
+        excess = projected - daily_norm
+        warning_text = f"\n⚠️ <b>Внимание:</b> После добавления норма будет превышена на <b>{excess:.0f} ккал</b>!\n"
+
+    product_list = "\n".join(
+        [f"▸ {i['product']} - {i['quantity']} - {i.get('calories') or 0} ккал, "
+         f"(Б: {i.get('protein') or 0}г, Ж: {i.get('fat') or 0}г, У: {i.get('carbs') or 0}г)" for i in items]
+    )
+
+    summary = f"""
+<b>Распознано:</b>
+
+{product_list}
+
+<b>⚡️ Итого калорий:</b> {totals_clean['calories']} ккал  
+
+🥩Б: {totals_clean['protein']} г, 🥑Ж: {totals_clean['fat']} г, 🍞У: {totals_clean['carbs']} г
+
+<b>📊 Норма после добавления:</b>
+{progress_after}
+{warning_text}
+    """
+    return summary.strip()
+
+
 async def process_food_text(update, context, food_text: str):
     user_id = update.effective_user.id
 
@@ -1029,6 +890,10 @@ async def process_food_text(update, context, food_text: str):
         )
         return ADD_MEAL
 
+    # Норму и съеденное за сегодня читаем из БД, пока идёт запрос к GPT:
+    # после ответа остаётся только сформировать текст и отправить его
+    progress_future = asyncio.get_running_loop().run_in_executor(None, get_day_progress, user_id)
+
     try:
         result = await call_gpt_with_limits(
             update.effective_user.id,
@@ -1038,12 +903,14 @@ async def process_food_text(update, context, food_text: str):
             YANDEX_GPT_FOLDER_ID
         )
     except RateLimitExceeded as e:
+        progress_future.cancel()
         await update.message.reply_text(
             f"⏳ Слишком много запросов — попробуйте через {e.retry_after} секунд.",
             reply_markup=get_main_menu()
         )
         return ADD_MEAL
     except Exception as e:
+        progress_future.cancel()
         logger.error(f"GPT error: {e}")
         await update.message.reply_text(
             "⚠️ Не удалось распознать. Попробуй позже.",
@@ -1070,49 +937,24 @@ async def process_food_text(update, context, food_text: str):
         'items': items
     }
 
-    # Удаляем сообщение "обрабатываем"
-    try:
-        await processing_msg.delete()
-    except Exception:
-        pass
-
-    # Формируем текст с продуктами и прогрессом
-    stats_data = get_stats(user_id)
-    daily_norm = get_user(user_id)["daily_calories"]
-    already_eaten = stats_data['day']['calories'] or 0
-    projected = already_eaten + totals_clean['calories']
-    progress_after = render_progress_bar(projected, daily_norm)
-
-    warning_text = ""
-    if daily_norm > 0 and projected > daily_norm:
-        excess = projected - daily_norm
-        warning_text = f"\n⚠️ <b>Внимание:</b> После добавления норма будет превышена на <b>{excess:.0f} ккал</b>!\n"
-
-    product_list = "\n".join(
-        [f"▸ {i['product']} - {i['quantity']} - {i.get('calories') or 0} ккал, "
-         f"(Б: {i.get('protein') or 0}г, Ж: {i.get('fat') or 0}г, У: {i.get('carbs') or 0}г)" for i in items]
-    )
-
-    summary = f"""
-<b>Распознано:</b>
-
-{product_list}
-
-<b>⚡️ Итого калорий:</b> {totals_clean['calories']} ккал  
-
-🥩Б: {totals_clean['protein']} г, 🥑Ж: {totals_clean['fat']} г, 🍞У: {totals_clean['carbs']} г
-
-<b>📊 Норма после добавления:</b>
-{progress_after}
-{warning_text}
-    """
+    progress = await progress_future
+    if progress is None:
+        await processing_msg.edit_text("Нет профиля. /start")
+        return ConversationHandler.END
+    daily_norm, already_eaten = progress
+    summary = _format_meal_summary(items, totals_clean, already_eaten, daily_norm)
 
     keyboard = [
         [InlineKeyboardButton("✅ Ввод", callback_data="confirm_meal"), InlineKeyboardButton("🔁 Повтор", callback_data="retry_meal"), InlineKeyboardButton("↩️ Отмена", callback_data="cancel_meal")]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    msg = await update.message.reply_text(summary.strip(), reply_markup=reply_markup, parse_mode="HTML")
+    # Один запрос к Telegram: сообщение "обрабатываем" превращается в результат
+    try:
+        msg = await processing_msg.edit_text(summary, reply_markup=reply_markup, parse_mode="HTML")
+    except TelegramError as e:
+        logger.warning(f"User {user_id} failed to edit processing message: {e}")
+        msg = await update.message.reply_text(summary, reply_markup=reply_markup, parse_mode="HTML")
     context.user_data['last_meal_message_id'] = msg.message_id
 
     return AWAIT_CONFIRM
@@ -1136,7 +978,7 @@ async def add_food_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     try:
         # 🎤 Транскрибируем
-        text = stt.recognize(file_path)
+        text = _get_stt().recognize(file_path)
         logger.info(f"User {user_id} voice STT result: {text}")
 
         # 🔄 Используем ту же логику, что и для текста
@@ -1250,9 +1092,13 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     day_calories = day_stats.get('calories') or 0
 
-    img_buffer = None
+    img_buffer, chart_key = None, None
     try:
-        img_buffer = await create_monthly_chart(user_id)
+        img_buffer, chart_key = await create_monthly_chart(user_id)
+    except ChartRendererBusy as e:
+        # отрисовка перегружена — отвечаем статистикой без графика
+        logger.warning(f"Monthly chart skipped for user {user_id}: {e}")
+        img_buffer = None
     except Exception as e:
         logger.error(f"Error generating monthly chart for user {user_id}: {e}")
         img_buffer = None
@@ -1267,13 +1113,13 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     goal_info = get_user_goal_info(user_id)
     
     keyboard = [
-        [InlineKeyboardButton("📅 Список блюд за неделю", callback_data="last_7_days")],
-        [InlineKeyboardButton("🗑 Очистить еду за сегодня", callback_data="clear_today")]
+        [InlineKeyboardButton("📅 Список блюд за неделю", callback_data=make_callback_data("stats", "week"))],
+        [InlineKeyboardButton("🗑 Очистить еду за сегодня", callback_data=make_callback_data("stats", "clear_today"))]
     ]
     
     # Добавляем кнопки для целей если они есть
     if goal_info:
-        keyboard.append([InlineKeyboardButton("📈 График достижения цели", callback_data="current_progress")])
+        keyboard.append([InlineKeyboardButton("📈 График достижения цели", callback_data=make_callback_data("stats", "progress"))])
 
     reply_markup = InlineKeyboardMarkup(keyboard)
 
@@ -1287,8 +1133,8 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
     if img_buffer:
-        await update.message.reply_photo(
-            photo=img_buffer,
+        await reply_chart(
+            update.message, img_buffer, chart_key,
             caption=caption_text,
             parse_mode="HTML",
             reply_markup=reply_markup
@@ -1395,7 +1241,7 @@ async def show_goal_chart(update: Update, context: ContextTypes.DEFAULT_TYPE):
         from bot.database import get_goal_start_date
         
         start_date = get_goal_start_date(user_id)
-        img_buffer, goal_date = await create_goal_progress_chart(
+        img_buffer, goal_date, chart_key = await create_goal_progress_chart(
             user_id, 
             goal_info['current_weight'], 
             goal_info['target_weight'], 
@@ -1406,8 +1252,8 @@ async def show_goal_chart(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         goal_date_str = goal_date.strftime("%d.%m.%Y")
         
-        await query.message.reply_photo(
-            photo=img_buffer,
+        await reply_chart(
+            query.message, img_buffer, chart_key,
             caption=f"📉 График достижения цели\n\n"
                    f"Цель: {'Похудеть' if goal_info['goal_type']=='lose' else 'Набрать'}\n"
                    f"Текущий вес: {goal_info['current_weight']} кг\n"
@@ -1417,6 +1263,12 @@ async def show_goal_chart(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup=get_main_menu()
         )
         
+    except ChartRendererBusy as e:
+        logger.warning(f"Chart skipped for user {user_id}: {e}")
+        await query.message.reply_text(
+            "⏳ Сейчас много запросов графиков. Попробуйте через минуту.",
+            reply_markup=get_main_menu()
+        )
     except Exception as e:
         logger.error(f"Error generating for user {user_id}: {e}")
         await query.message.reply_text(
@@ -1443,7 +1295,7 @@ async def show_current_progress(update: Update, context: ContextTypes.DEFAULT_TY
         from bot.database import get_goal_start_date
         
         start_date = get_goal_start_date(user_id)
-        img_buffer, goal_date = await create_current_progress_chart(
+        img_buffer, goal_date, chart_key = await create_current_progress_chart(
             user_id, 
             goal_info['current_weight'], 
             goal_info['target_weight'], 
@@ -1453,8 +1305,8 @@ async def show_current_progress(update: Update, context: ContextTypes.DEFAULT_TY
         )
         goal_date_str = goal_date.strftime("%d.%m.%Y")
         
-        await query.message.reply_photo(
-            photo=img_buffer,
+        await reply_chart(
+            query.message, img_buffer, chart_key,
             caption=f"📈 График достижения цели\n\n"
                    f"Цель: {'Похудеть' if goal_info['goal_type']=='lose' else 'Набрать'}\n"
                    f"Текущий вес: {goal_info['current_weight']} кг\n"
@@ -1464,6 +1316,12 @@ async def show_current_progress(update: Update, context: ContextTypes.DEFAULT_TY
             reply_markup=get_main_menu()
         )
         
+    except ChartRendererBusy as e:
+        logger.warning(f"Chart skipped for user {user_id}: {e}")
+        await query.message.reply_text(
+            "⏳ Сейчас много запросов графиков. Попробуйте через минуту.",
+            reply_markup=get_main_menu()
+        )
     except Exception as e:
         logger.error(f"Error generating for user {user_id}: {e}")
         await query.message.reply_text(
@@ -1636,14 +1494,14 @@ async def goal_rate_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Создаем график цели
     try:
         from bot.charts import create_goal_progress_chart
-        img_buffer, goal_date = await create_goal_progress_chart(
+        img_buffer, goal_date, chart_key = await create_goal_progress_chart(
             user_id, weight, target_weight, goal_type, f"{kg_per_week}кг/нед"
         )
         
         goal_date_str = goal_date.strftime("%d.%m.%Y")
         
-        await query.message.reply_photo(
-            photo=img_buffer,
+        await reply_chart(
+            query.message, img_buffer, chart_key,
             caption=f"✅ Профиль создан!\n\n"
                    f"🎯 Цель: {'Похудеть' if goal_type=='lose' else 'Набрать'} ({kg_per_week} кг/нед)\n"
                    f"🎯 Целевой вес: {target_weight} кг\n"
@@ -1673,9 +1531,11 @@ async def settings_menu(update: Update, context: CallbackContext):
     logger.info(f"Open setting menu {user_id}")
 
     notif_text = "🔔 Уведомления: [Включены]" if status else "🔕 Уведомления: [Выключены]"
+    city, offset = TIMEZONES.get(get_user_timezone(user_id), ("?", "?"))
 
     keyboard = [
-        [InlineKeyboardButton(notif_text, callback_data="toggle_notifications")],
+        [InlineKeyboardButton(notif_text, callback_data=make_callback_data("settings", "notifications"))],
+        [InlineKeyboardButton(f"🌍 Часовой пояс: {city} ({offset})", callback_data=make_callback_data("settings", "tz_menu"))],
     ]
 
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -1706,10 +1566,41 @@ async def toggle_notifications(update: Update, context: CallbackContext):
     await query.edit_message_text(
         text=f"{status_text}\n\nМожно вернуться и поменять в любой момент.",
         reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("🔔 Переключить снова", callback_data="toggle_notifications")]
+            [InlineKeyboardButton("🔔 Переключить снова", callback_data=make_callback_data("settings", "notifications"))]
         ])
     )
 
+# Часовой пояс (для напоминаний о приёмах пищи)
+async def timezone_menu(update: Update, context: CallbackContext):
+    query = update.callback_query
+    await query.answer()
+    logger.info(f"User {query.from_user.id} opened timezone menu")
+
+    keyboard = [
+        [InlineKeyboardButton(f"{city} ({offset})", callback_data=make_callback_data("settings", "tz", tz_name))]
+        for tz_name, (city, offset) in TIMEZONES.items()
+    ]
+    await query.edit_message_text(
+        "🌍 Выберите часовой пояс — по нему будут приходить напоминания о приёмах пищи:",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+async def set_timezone(update: Update, context: CallbackContext, tz_name: str):
+    query = update.callback_query
+    await query.answer()
+    user_id = query.from_user.id
+
+    if tz_name not in TIMEZONES:
+        logger.warning(f"User {user_id} sent unknown timezone {tz_name!r}")
+        return
+
+    set_user_timezone(user_id, tz_name)
+    reindex_user_reminders(user_id)
+    logger.info(f"User {user_id} set timezone {tz_name}")
+
+    city, offset = TIMEZONES[tz_name]
+    await query.edit_message_text(f"✅ Часовой пояс: {city} ({offset})\n\nНапоминания будут приходить по этому времени.")
+
 # Генерация меню
 
 async def start_generate_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1814,13 +1705,13 @@ async def typing_prefs(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         update_menu_request_time(user_id)
 
-        image_path = render_menu_to_image(menu_data, user_id)
-        logger.info(f"User {user_id}: menu image rendered at {image_path}")
-        
+        # Pillow рисует синхронно — уводим с event loop
+        loop = asyncio.get_running_loop()
+        image_bytes = await loop.run_in_executor(None, render_menu_to_image, menu_data, user_id)
+
         today_tag = f"\n\n#Меню_за_{datetime.now():%Y%m%d}"
 
-        with open(image_path, "rb") as img:
-            await update.effective_message.reply_photo(img, caption=disclaimer_text + today_tag)
+        await update.effective_message.reply_photo(image_bytes, caption=disclaimer_text + today_tag)
         logger.info(f"User {user_id}: menu image sent")
 
     except RateLimitExceededMenu as e:
@@ -1895,13 +1786,14 @@ async def meal_reminders_menu(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     # если уведомления включены — показываем расписание
     reminders = get_meal_reminders(user_id)
+    tz_label = _tz_label(get_user_timezone(user_id))
     if not reminders:
         text = "У вас пока нет расписания уведомлений о приёме пищи."
         keyboard = [[InlineKeyboardButton("➕ Добавить расписание", callback_data="add_reminders")]]
     else:
         text = "<b>Ваше расписание уведомлений:</b>\n\n"
         for r in reminders:
-            text += f"🔹 {r['name']} — {r['time']} по МСК\n"
+            text += f"🔹 {r['name']} — {r['time']} ({tz_label})\n"
         keyboard = [[InlineKeyboardButton("✏️ Изменить расписание", callback_data="add_reminders")]]
 
     sent = await query.message.reply_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="HTML")
@@ -1951,6 +1843,7 @@ async def set_reminders_count(update: Update, context: ContextTypes.DEFAULT_TYPE
     # очистим старые напоминания и удалим меню выбора
     try:
         clear_meal_reminders(user_id)
+        reindex_user_reminders(user_id)
         logger.debug(f"Cleared existing reminders for user {user_id}")
     except Exception as e:
         logger.error(f"Error clearing reminders for user {user_id}: {e}")
@@ -1993,7 +1886,8 @@ async def set_meal_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Просим ввести время для этого приема
     chat_id = update.effective_chat.id
-    sent = await context.bot.send_message(chat_id=chat_id, text=f"Введите время для '{text}' в формате ЧЧ:ММ по МСК:")
+    tz_label = _tz_label(get_user_timezone(user_id))
+    sent = await context.bot.send_message(chat_id=chat_id, text=f"Введите время для '{text}' в формате ЧЧ:ММ ({tz_label}):")
     _store_last_msg_id(context, sent)
     logger.info(f"User {user_id} prompted to enter time for meal '{text}'")
     return SET_MEAL_TIME
@@ -2010,13 +1904,16 @@ async def set_meal_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
         datetime.strptime(time_text, "%H:%M")
     except ValueError:
         logger.info(f"User {user_id} provided invalid time format: {time_text}")
-        await update.message.reply_text("❌ Неверный формат времени. Введите ЧЧ:ММ по МСК:")
+        await update.message.reply_text("❌ Неверный формат времени. Введите ЧЧ:ММ:")
         return SET_MEAL_TIME
+    # храним в едином виде ЧЧ:ММ (strptime пропускает и "9:5")
+    time_text = datetime.strptime(time_text, "%H:%M").strftime("%H:%M")
 
     idx = context.user_data.get('current_meal_index', 1)
     name = context.user_data.get('meal_names', [])[idx - 1]
     try:
         add_meal_reminder(user_id, idx, name, time_text)
+        reindex_user_reminders(user_id)
         logger.info(f"Saved reminder for user {user_id}: #{idx} '{name}' @ {time_text}")
     except Exception as e:
         logger.error(f"Error saving reminder for user {user_id}: {e}")
@@ -2043,9 +1940,10 @@ async def set_meal_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         # все введено — показываем сохранённое расписание
         reminders = get_meal_reminders(user_id)
+        tz_label = _tz_label(get_user_timezone(user_id))
         text = "<b>Расписание уведомлений сохранено:</b>\n\n"
         for r in reminders:
-            text += f"🔹 {r['name']} — {r['time']} по МСК\n"
+            text += f"🔹 {r['name']} — {r['time']} ({tz_label})\n"
 
         chat_id = update.effective_chat.id
         sent = await context.bot.send_message(chat_id=chat_id, text=text, parse_mode="HTML")
@@ -2161,7 +2059,9 @@ meal_reminders_conv = ConversationHandler(
         CallbackQueryHandler(cancel_reminders, pattern=".*")
     ],
     per_user=True,
-    per_chat=True
+    per_chat=True,
+    name="meal_reminders",
+    persistent=True
 )
 # Обработчик генерации меню
 
@@ -2184,7 +2084,9 @@ generate_menu_conv = ConversationHandler(
         CommandHandler("cancel", cancel_generate_menu),
     ],
     per_user=True,
-    per_chat=True
+    per_chat=True,
+    name="generate_menu",
+    persistent=True
 )
 
 # Обработчик ввода еды
@@ -2209,37 +2111,11 @@ meal_conv_handler = ConversationHandler(
     },
     fallbacks=[CommandHandler("cancel", cancel_meal)],
     per_user=True,
+    name="add_meal",
+    persistent=True
 )
 
 
-# --- Новые обработчики (заменяют старые ConversationHandler'ы) ---
-edit_profile_handler = CallbackQueryHandler(edit_profile_start, pattern="edit_profile")
-edit_name_handler = CallbackQueryHandler(edit_name_callback, pattern="edit_name")
-edit_weight_handler = CallbackQueryHandler(edit_weight_callback, pattern="edit_weight")
-edit_height_handler = CallbackQueryHandler(edit_height_callback, pattern="edit_height")
-edit_age_handler = CallbackQueryHandler(edit_age_callback, pattern="edit_age")
-edit_gender_handler = CallbackQueryHandler(edit_gender_callback, pattern="edit_gender")
-edit_activity_handler = CallbackQueryHandler(edit_activity_callback, pattern="edit_activity")
-edit_goal_handler = CallbackQueryHandler(edit_goal_callback, pattern="edit_goal")
-
-# Обработчики для кнопок выбора
-set_gender_male_handler = CallbackQueryHandler(set_gender_male, pattern="set_gender_male")
-set_gender_female_handler = CallbackQueryHandler(set_gender_female, pattern="set_gender_female")
-set_activity_none_handler = CallbackQueryHandler(set_activity_none, pattern="set_activity_none")
-set_activity_low_handler = CallbackQueryHandler(set_activity_low, pattern="set_activity_low")
-set_activity_medium_handler = CallbackQueryHandler(set_activity_medium, pattern="set_activity_medium")
-set_activity_high_handler = CallbackQueryHandler(set_activity_high, pattern="set_activity_high")
-set_goal_maintain_handler = CallbackQueryHandler(set_goal_maintain, pattern="set_goal_maintain")
-set_goal_lose_handler = CallbackQueryHandler(set_goal_lose, pattern="set_goal_lose")
-set_goal_gain_handler = CallbackQueryHandler(set_goal_gain, pattern="set_goal_gain")
-set_rate_lose_slow_handler = CallbackQueryHandler(set_rate_lose_slow, pattern="set_rate_lose_slow")
-set_rate_lose_medium_handler = CallbackQueryHandler(set_rate_lose_medium, pattern="set_rate_lose_medium")
-set_rate_lose_fast_handler = CallbackQueryHandler(set_rate_lose_fast, pattern="set_rate_lose_fast")
-set_rate_gain_slow_handler = CallbackQueryHandler(set_rate_gain_slow, pattern="set_rate_gain_slow")
-set_rate_gain_medium_handler = CallbackQueryHandler(set_rate_gain_medium, pattern="set_rate_gain_medium")
-set_rate_gain_fast_handler = CallbackQueryHandler(set_rate_gain_fast, pattern="set_rate_gain_fast")
-
-
 conv_handler = ConversationHandler(
     entry_points=[CommandHandler('start', start)],
     states={
@@ -2254,15 +2130,59 @@ conv_handler = ConversationHandler(
         GOAL_RATE: [CallbackQueryHandler(goal_rate_handler, pattern="^rate_")]
     },
     fallbacks=[CommandHandler('cancel', cancel)],
-    per_user=True
+    per_user=True,
+    name="registration",
+    persistent=True
 )
 
+# --- Inline-кнопки вне диалогов: один роутер "ns:action[:arg]" ---
+callback_router = CallbackRouter()
+
+callback_router.add("profile", "edit", edit_profile_start)
+callback_router.add("profile", "field", edit_field_callback, takes_arg=True)
+callback_router.add("profile", "gender", edit_gender_callback)
+callback_router.add("profile", "activity", edit_activity_callback)
+callback_router.add("profile", "goal", edit_goal_callback)
+callback_router.add("profile", "set_gender", set_gender, takes_arg=True)
+callback_router.add("profile", "set_activity", set_activity, takes_arg=True)
+callback_router.add("profile", "set_goal", set_goal, takes_arg=True)
+callback_router.add("profile", "set_rate", set_rate, takes_arg=True)
+
+callback_router.add("meal", "confirm", confirm_meal)
+callback_router.add("meal", "retry", retry_meal)
+
+callback_router.add("stats", "week", show_last_7_days)
+callback_router.add("stats", "clear_today", clear_today)
+callback_router.add("stats", "goal_chart", show_goal_chart)
+callback_router.add("stats", "progress", show_current_progress)
+
+callback_router.add("settings", "notifications", toggle_notifications)
+callback_router.add("settings", "tz_menu", timezone_menu)
+callback_router.add("settings", "tz", set_timezone, takes_arg=True)
+
+# Старые callback_data: кнопки в уже отправленных сообщениях, а также
+# confirm_meal/retry_meal, которые остаются такими ради meal_conv_handler
+for field in EDIT_FIELD_PROMPTS:
+    callback_router.alias(f"edit_{field}", f"profile:field:{field}")
+callback_router.alias("edit_profile", "profile:edit")
+callback_router.alias("edit_gender", "profile:gender")
+callback_router.alias("edit_activity", "profile:activity")
+callback_router.alias("edit_goal", "profile:goal")
+callback_router.alias_prefix("set_gender_", "profile:set_gender")
+callback_router.alias_prefix("set_activity_", "profile:set_activity")
+callback_router.alias_prefix("set_goal_", "profile:set_goal")
+callback_router.alias_prefix("set_rate_", "profile:set_rate")
+callback_router.alias("confirm_meal", "meal:confirm")
+callback_router.alias("retry_meal", "meal:retry")
+callback_router.alias("last_7_days", "stats:week")
+callback_router.alias("clear_today", "stats:clear_today")
+callback_router.alias("goal_chart", "stats:goal_chart")
+callback_router.alias("current_progress", "stats:progress")
+callback_router.alias("toggle_notifications", "settings:notifications")
+
+callback_router_handler = callback_router.handler()
+
 # Отдельные обработчики
-confirm_handler = CallbackQueryHandler(confirm_meal, pattern="^confirm_meal$")
-clear_today_handler = CallbackQueryHandler(clear_today, pattern="^clear_today$")
-retry_handler = CallbackQueryHandler(retry_meal, pattern="^retry_meal$")
-last_7_days_handler = CallbackQueryHandler(show_last_7_days, pattern="^last_7_days$")
 goal_callback_handler = CallbackQueryHandler(goal_handler, pattern="^goal_")
 goal_rate_callback_handler = CallbackQueryHandler(goal_rate_handler, pattern="^rate_")
 voice_message_handler = MessageHandler(filters.VOICE, add_food_voice)
-toggle_notifications_handler = CallbackQueryHandler(toggle_notifications, pattern="toggle_notifications")
@@ -0,0 +1,174 @@
+"""Хранение context.user_data и состояний ConversationHandler'ов в SQLite.
+
+PTB сам копит изменения: раз в update_interval секунд вызывает update_*
+только для пользователей, у которых были апдейты. Мы дополнительно
+пропускаем тех, чьи данные не изменились (сравниваем хэш pickle), а всё
+изменённое за проход пишем одной транзакцией в фоне. При остановке
+Application вызывает flush() — несохранённого не остаётся.
+"""
+import asyncio
+import hashlib
+import json
+import pickle
+from typing import Dict, Optional, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from bot.database import load_persisted_user_data, load_persisted_conversations, save_persistence_batch
+from config.config import PERSISTENCE_UPDATE_INTERVAL, SHARD_COUNT, SHARD_INDEX
+from logger_config import logger
+
+
+def _digest(blob: bytes) -> bytes:
+    return hashlib.blake2b(blob, digest_size=16).digest()
+
+
+class SQLitePersistence(BasePersistence):
+    """user_data и диалоги в таблицах persistence_* (chat_data, bot_data и callback_data не храним)"""
+
+    def __init__(self, update_interval: float = PERSISTENCE_UPDATE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self._digests: Dict[int, bytes] = {}                                   # user_id -> хэш записанного
+        self._dirty_users: Dict[int, Optional[bytes]] = {}                     # user_id -> pickle | None (удалить)
+        self._dirty_conversations: Dict[Tuple[str, str], Tuple[int, Optional[bytes]]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._written = 0
+        self._skipped = 0
+
+    # --- Загрузка при старте ---
+
+    async def get_user_data(self) -> Dict[int, dict]:
+        data = {}
+        for user_id, blob in load_persisted_user_data(SHARD_INDEX, SHARD_COUNT):
+            try:
+                data[user_id] = pickle.loads(blob)
+            except Exception as e:
+                logger.warning(f"Skip unreadable user_data of user {user_id}: {e}")
+                continue
+            self._digests[user_id] = _digest(blob)
+        logger.info(f"Persistence: loaded user_data for {len(data)} users")
+        return data
+
+    async def get_conversations(self, name: str) -> dict:
+        conversations = {}
+        for conv_key, blob in load_persisted_conversations(name, SHARD_INDEX, SHARD_COUNT):
+            try:
+                conversations[tuple(json.loads(conv_key))] = pickle.loads(blob)
+            except Exception as e:
+                logger.warning(f"Skip unreadable conversation {name}:{conv_key}: {e}")
+        logger.info(f"Persistence: loaded {len(conversations)} active '{name}' conversations")
+        return conversations
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    # --- Изменения (вызывает Application раз в update_interval) ---
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        if not data:
+            # пустой user_data не храним; если раньше что-то было — удаляем
+            if user_id in self._digests:
+                await self.drop_user_data(user_id)
+            return
+        blob = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        digest = _digest(blob)
+        if self._digests.get(user_id) == digest:
+            self._skipped += 1
+            return
+        self._digests[user_id] = digest
+        self._dirty_users[user_id] = blob
+        self._schedule_flush()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._digests.pop(user_id, None)
+        self._dirty_users[user_id] = None
+        self._schedule_flush()
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        user_id = key[-1] if key and isinstance(key[-1], int) else None
+        blob = None if new_state is None else pickle.dumps(new_state, protocol=pickle.HIGHEST_PROTOCOL)
+        self._dirty_conversations[(name, json.dumps(list(key)))] = (user_id, blob)
+        self._schedule_flush()
+
+    async def update_chat_data(self, chat_id: int, data) -> None:
+        pass
+
+    async def update_bot_data(self, data) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    # Каждый пользователь обрабатывается одним процессом (шардом) — перечитывать нечего
+    async def refresh_user_data(self, user_id: int, user_data) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data) -> None:
+        pass
+
+    # --- Запись ---
+
+    def _schedule_flush(self):
+        # Application вызывает update_* пачкой через asyncio.gather; задача стартует
+        # после них, поэтому весь проход попадает в одну транзакцию
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_pending())
+
+    async def _flush_pending(self):
+        loop = asyncio.get_running_loop()
+        while self._dirty_users or self._dirty_conversations:
+            users, self._dirty_users = self._dirty_users, {}
+            conversations, self._dirty_conversations = self._dirty_conversations, {}
+
+            user_rows = [(uid, blob) for uid, blob in users.items() if blob is not None]
+            dropped_users = [uid for uid, blob in users.items() if blob is None]
+            conversation_rows = [
+                (name, conv_key, uid, blob) for (name, conv_key), (uid, blob) in conversations.items()
+                if blob is not None
+            ]
+            dropped_conversations = [key for key, (_, blob) in conversations.items() if blob is None]
+            try:
+                await loop.run_in_executor(
+                    None, save_persistence_batch,
+                    user_rows, dropped_users, conversation_rows, dropped_conversations
+                )
+            except Exception as e:
+                # вернём в очередь (если за это время не появилось более свежих данных), повторим на следующем проходе
+                logger.error(f"Persistence flush failed ({len(users)} users, {len(conversations)} conversations): {e}")
+                for uid, blob in users.items():
+                    self._dirty_users.setdefault(uid, blob)
+                for key, value in conversations.items():
+                    self._dirty_conversations.setdefault(key, value)
+                return
+            self._written += len(users) + len(conversations)
+            logger.debug(f"Persistence flushed {len(users)} users, {len(conversations)} conversations")
+
+    def metrics(self) -> Dict[str, int]:
+        return {
+            "written": self._written,
+            "skipped_unchanged": self._skipped,
+            "pending": len(self._dirty_users) + len(self._dirty_conversations),
+        }
+
+    async def flush(self) -> None:
+        """Вызывается при остановке Application: дописываем всё, что накопилось"""
+        if self._flush_task is not None and not self._flush_task.done():
+            await self._flush_task
+        await self._flush_pending()
+        logger.info(f"Persistence flushed on shutdown ({self._written} rows written, {self._skipped} unchanged skipped)")
+
@@ -1,10 +1,15 @@
 import asyncio
+import sqlite3
 import time
 from collections import deque
+from contextlib import asynccontextmanager
 from typing import Callable, Any, Dict, Deque, Coroutine
-from config.config import MAX_REQUESTS_PER_MINUTE, WINDOW_SECONDS, CONCURRENT_GPT
+from config.config import (
+    MAX_REQUESTS_PER_MINUTE, WINDOW_SECONDS, RATE_LIMIT_BACKEND, RATE_LIMIT_DB_TIMEOUT, CONCURRENT_GPT,
+    CONCURRENT_GPT_MIN, CONCURRENT_GPT_MAX, GPT_LATENCY_TARGET, GPT_LIMIT_BACKOFF
+)
 from datetime import datetime, timedelta
-from bot.database import get_db_connection
+from bot.database import get_db_connection, reserve_rate_limit_slot, release_rate_limit_slot
 
 from logger_config import logger
 
@@ -13,7 +18,82 @@ from logger_config import logger
 _user_requests: Dict[int, Deque[float]] = {}
 _user_locks: Dict[int, asyncio.Lock] = {}
 _global_lock = asyncio.Lock()
-_global_semaphore = asyncio.Semaphore(CONCURRENT_GPT)
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Глобальный лимит одновременных запросов к GPT, который подстраивается под задержку (AIMD).
+    - успешный ответ быстрее latency_target при полной загрузке -> лимит растёт примерно на +1 за "окно" из limit запросов
+    - ошибка или ответ медленнее latency_target -> лимит умножается на backoff, но не чаще
+      раза за "окно перегрузки": запросы, начатые до последнего уменьшения, его уже не снижают
+    """
+
+    def __init__(self, initial: int, min_limit: int, max_limit: int,
+                 latency_target: float, backoff: float = 0.75):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.limit = float(min(max(initial, min_limit), max_limit))
+        self.in_flight = 0
+        self._last_decrease = float("-inf")   # monotonic-время последнего уменьшения лимита
+        self._cond = asyncio.Condition()
+
+    async def acquire(self) -> None:
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self, started: float, ok: bool) -> None:
+        """started — time.monotonic() в момент получения слота"""
+        now = time.monotonic()
+        latency = now - started
+        async with self._cond:
+            # лимит растёт только если мы действительно в него упираемся
+            saturated = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            old_limit = int(self.limit)
+
+            if not ok or latency > self.latency_target:
+                # одна перегрузка отражается на всех запросах, что были в полёте, — снижаем один раз
+                if started >= self._last_decrease:
+                    self.limit = max(float(self.min_limit), self.limit * self.backoff)
+                    self._last_decrease = now
+            elif saturated:
+                self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+
+            if int(self.limit) != old_limit:
+                logger.info(
+                    f"GPT concurrency limit changed {old_limit} -> {int(self.limit)} "
+                    f"(latency={latency:.2f}s, ok={ok}, in_flight={self.in_flight})"
+                )
+            self._cond.notify_all()
+
+    @asynccontextmanager
+    async def slot(self):
+        """Занимает слот на время запроса и по выходу отдаёт замер задержки в регулятор."""
+        await self.acquire()
+        started = time.monotonic()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            await self.release(started, ok)
+
+
+_gpt_limiter = AdaptiveConcurrencyLimiter(
+    initial=CONCURRENT_GPT,
+    min_limit=CONCURRENT_GPT_MIN,
+    max_limit=CONCURRENT_GPT_MAX,
+    latency_target=GPT_LATENCY_TARGET,
+    backoff=GPT_LIMIT_BACKOFF,
+)
+
+
+def get_gpt_concurrency_metrics() -> Dict[str, int]:
+    """Текущее состояние адаптивного лимита GPT (для логов/метрик)."""
+    return {"limit": int(_gpt_limiter.limit), "in_flight": _gpt_limiter.in_flight}
 
 
 class RateLimitExceeded(Exception):
@@ -32,12 +112,8 @@ async def _get_user_lock(user_id: int) -> asyncio.Lock:
         return lock
 
 
-async def _reserve_slot_or_raise(user_id: int) -> None:
-    """
-    Проверяет и резервирует слот для пользователя.
-    При превышении лимита бросает RateLimitExceeded(retry_after).
-    """
-    now = time.time()
+async def _reserve_memory_slot(user_id: int, now: float) -> None:
+    """Окно в памяти процесса (по умолчанию, один процесс бота)."""
     lock = await _get_user_lock(user_id)
 
     async with lock:
@@ -60,16 +136,62 @@ async def _reserve_slot_or_raise(user_id: int) -> None:
         logger.debug(f"Reserved request slot for user {user_id}. Count={len(dq)}")
 
 
-async def _rollback_last_request(user_id: int):
-    """Удаляет последний зарезервированный таймстамп (в случае ошибки вызова GPT)."""
+async def _reserve_shared_slot(user_id: int, now: float) -> None:
+    """Окно в общей SQLite-таблице: один лимит на пользователя для всех процессов бота.
+
+    Запись идёт в executor'е с коротким busy timeout: единственного писателя WAL делят
+    шарды, outbox и persistence, и ожидание замка не должно останавливать event loop.
+    Не дождались замка — пропускаем запрос без лимита (fail open), а не отказываем пользователю.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        oldest = await loop.run_in_executor(
+            None, reserve_rate_limit_slot,
+            user_id, now, WINDOW_SECONDS, MAX_REQUESTS_PER_MINUTE, RATE_LIMIT_DB_TIMEOUT
+        )
+    except sqlite3.OperationalError as e:
+        logger.warning(f"Shared rate limit unavailable for user {user_id}, request allowed: {e}")
+        return
+    if oldest is not None:
+        retry_after = int(WINDOW_SECONDS - (now - oldest)) + 1
+        logger.debug(f"User {user_id} rate-limited (shared). Retry after {retry_after}s")
+        raise RateLimitExceeded(retry_after)
+    logger.debug(f"Reserved shared request slot for user {user_id}")
+
+
+async def _reserve_slot_or_raise(user_id: int) -> float:
+    """
+    Проверяет и резервирует слот для пользователя.
+    Возвращает таймстамп резерва (для отката), при превышении лимита бросает RateLimitExceeded(retry_after).
+    """
+    now = time.time()
+    if RATE_LIMIT_BACKEND == "sqlite":
+        await _reserve_shared_slot(user_id, now)
+    else:
+        await _reserve_memory_slot(user_id, now)
+    return now
+
+
+async def _rollback_request(user_id: int, ts: float):
+    """Удаляет зарезервированный таймстамп (в случае ошибки вызова GPT)."""
+    if RATE_LIMIT_BACKEND == "sqlite":
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, release_rate_limit_slot, user_id, ts, RATE_LIMIT_DB_TIMEOUT)
+            logger.debug(f"Rolled back shared request timestamp for user {user_id}")
+        except sqlite3.OperationalError as e:
+            # запись просто истечёт вместе с окном
+            logger.warning(f"Failed to roll back shared rate limit slot for user {user_id}: {e}")
+        return
+
     lock = await _get_user_lock(user_id)
     async with lock:
         dq = _user_requests.get(user_id)
         if dq:
             try:
-                dq.pop()
-                logger.debug(f"Rolled back last request timestamp for user {user_id}")
-            except IndexError:
+                dq.remove(ts)
+                logger.debug(f"Rolled back request timestamp for user {user_id}")
+            except ValueError:
                 pass
 
 
@@ -83,17 +205,17 @@ async def call_gpt_with_limits(user_id: int, gpt_async_fn: Callable[..., Corouti
     Возвращает результат gpt_async_fn или бросает RateLimitExceeded.
     """
     # 1) зарезервировать слот для пользователя или бросить
-    await _reserve_slot_or_raise(user_id)
+    reserved_ts = await _reserve_slot_or_raise(user_id)
 
-    # 2) выполнить реальный запрос, ограничив одновременные вызовы глобальным семафором
+    # 2) выполнить реальный запрос, ограничив одновременные вызовы адаптивным глобальным лимитом
     try:
-        async with _global_semaphore:
-            logger.debug(f"User {user_id} acquired global GPT semaphore. Running GPT call...")
+        async with _gpt_limiter.slot():
+            logger.debug(f"User {user_id} acquired GPT slot ({get_gpt_concurrency_metrics()}). Running GPT call...")
             result = await gpt_async_fn(*args, **kwargs)
             return result
     except Exception as e:
         # В случае ошибки откатываем резерв (чтобы не "съедать" лимит)
-        await _rollback_last_request(user_id)
+        await _rollback_request(user_id, reserved_ts)
         logger.exception(f"Error during GPT call for user {user_id}: {e}")
         raise
 
@@ -103,19 +225,56 @@ class RateLimitExceededMenu(Exception):
         super().__init__(f"Menu request rate limit exceeded, retry after {retry_after_seconds}s")
 
 
-def check_menu_rate_limit(user_id: int, hours: int = 6):
-    """Проверяет, можно ли сгенерировать меню. Если нельзя — бросает RateLimitExceededMenu"""
+# Кэш кулдауна меню: user_id -> время последнего запроса (прогревается из users при старте)
+_menu_requests: Dict[int, datetime] = {}
+
+
+def warm_menu_rate_limit_cache():
+    """Загружает users.last_menu_request в память, чтобы проверка кулдауна не ходила в БД."""
+    conn = get_db_connection()
+    rows = conn.execute("""
+        SELECT user_id, last_menu_request FROM users WHERE last_menu_request IS NOT NULL
+    """).fetchall()
+    conn.close()
+
+    _menu_requests.clear()
+    for user_id, last_request in rows:
+        try:
+            _menu_requests[user_id] = datetime.fromisoformat(last_request)
+        except (TypeError, ValueError):
+            logger.warning(f"Bad last_menu_request for user {user_id}: {last_request!r}")
+    logger.info(f"Menu rate-limit cache warmed: {len(_menu_requests)} users")
+
+
+def _load_last_menu_request(user_id: int):
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT last_menu_request FROM users WHERE user_id = ?
-    """, (user_id,))
-    row = cursor.fetchone()
+    row = conn.execute("SELECT last_menu_request FROM users WHERE user_id = ?", (user_id,)).fetchone()
     conn.close()
+    return datetime.fromisoformat(row[0]) if row and row[0] else None
+
+
+def _write_menu_request_time(user_id: int, requested_at: datetime):
+    try:
+        conn = get_db_connection()
+        conn.execute("""
+            UPDATE users SET last_menu_request = ? WHERE user_id = ?
+        """, (requested_at.isoformat(), user_id))
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        logger.error(f"Failed to persist last_menu_request for user {user_id}: {e}")
+
+
+def check_menu_rate_limit(user_id: int, hours: int = 6):
+    """Проверяет, можно ли сгенерировать меню. Если нельзя — бросает RateLimitExceededMenu"""
+    # при общем бэкенде лимит должен видеть запросы других процессов — читаем из БД
+    if RATE_LIMIT_BACKEND == "sqlite":
+        last_request = _load_last_menu_request(user_id)
+    else:
+        last_request = _menu_requests.get(user_id)
 
     now = datetime.now()
-    if row and row[0]:
-        last_request = datetime.fromisoformat(row[0])
+    if last_request:
         delta = now - last_request
         if delta < timedelta(hours=hours):
             retry_after = int((timedelta(hours=hours) - delta).total_seconds())
@@ -124,11 +283,13 @@ def check_menu_rate_limit(user_id: int, hours: int = 6):
 
 
 def update_menu_request_time(user_id: int):
-    """Обновляет дату последнего запроса меню на текущий момент"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        UPDATE users SET last_menu_request = ? WHERE user_id = ?
-    """, (datetime.now().isoformat(), user_id))
-    conn.commit()
-    conn.close()
\ No newline at end of file
+    """Обновляет дату последнего запроса меню: сразу в памяти, в БД — фоном в executor'е"""
+    now = datetime.now()
+    _menu_requests[user_id] = now
+
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        _write_menu_request_time(user_id, now)
+        return
+    loop.run_in_executor(None, _write_menu_request_time, user_id, now)
@@ -1,85 +1,368 @@
+import asyncio
+import functools
+import heapq
+import itertools
+import os
+import socket
+import sqlite3
 from datetime import time, timedelta, datetime
+from typing import Dict, List
 import pytz
-from bot.database import get_db_connection
+from bot.database import (
+    get_users_to_remind, get_meal_reminders, get_all_meal_reminders, get_user_timezone,
+    filter_notifications_enabled,
+    enqueue_notifications, claim_outbox_batch, mark_outbox_processed, purge_notification_outbox
+)
+from bot.broadcast import broadcast
+from config.config import (
+    OUTBOX_BATCH_SIZE, OUTBOX_DRAIN_INTERVAL, OUTBOX_CLAIM_TIMEOUT, OUTBOX_KEEP_DAYS, OUTBOX_DB_TIMEOUT,
+    OUTBOX_DB_ATTEMPTS, BROADCAST_RATE_PER_SECOND,
+    DAILY_REMINDER_MODE, DAILY_REMINDER_WINDOW_MINUTES, DAILY_REMINDER_SLOT_MINUTES, DAILY_REMINDER_SLOT_MAX_USERS,
+    REMINDER_CATCHUP_SECONDS, SHARD_COUNT, SHARD_INDEX
+)
 from logger_config import logger
 
+# Идентификатор воркера в outbox (несколько процессов могут разбирать одну очередь)
+_WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+_drain_lock = asyncio.Lock()
+
+
+class ReminderWheel:
+    """
+    Планировщик напоминаний о приёмах пищи: куча (heap) по ближайшему времени срабатывания в UTC.
+    Время напоминания хранится как "ЧЧ:ММ" в часовом поясе пользователя; после срабатывания
+    запись перекладывается на следующее срабатывание. Изменения расписания пользователя
+    инвалидируют его старые записи через номер версии (удаляются лениво при извлечении).
+    """
+
+    def __init__(self):
+        self._heap: List[tuple] = []
+        self._versions: Dict[int, int] = {}
+        self._seq = itertools.count()
+
+    @staticmethod
+    def next_fire(time_str: str, tz_name: str, after: datetime) -> datetime:
+        """Ближайший момент (UTC) строго после after, когда в tz_name наступает time_str."""
+        tz = pytz.timezone(tz_name)
+        fire_time = datetime.strptime(time_str, "%H:%M").time()
+        local_day = after.astimezone(tz).date()
+        for days in range(2):
+            candidate = tz.localize(datetime.combine(local_day + timedelta(days=days), fire_time))
+            candidate = candidate.astimezone(pytz.utc)
+            if candidate > after:
+                return candidate
+        return candidate + timedelta(days=1)
+
+    def _push(self, fire_at: datetime, entry: tuple):
+        heapq.heappush(self._heap, (fire_at, next(self._seq), entry))
+
+    def set_user(self, user_id: int, reminders, now: datetime):
+        """Заменяет расписание пользователя. reminders — [(meal_index, name, "ЧЧ:ММ", tz_name)]."""
+        version = self._versions.get(user_id, 0) + 1
+        self._versions[user_id] = version
+        for meal_index, name, time_str, tz_name in reminders:
+            try:
+                fire_at = self.next_fire(time_str, tz_name, now)
+            except (ValueError, pytz.UnknownTimeZoneError) as e:
+                logger.warning(f"Skip reminder {time_str!r} ({tz_name}) for user {user_id}: {e}")
+                continue
+            self._push(fire_at, (user_id, version, meal_index, name, time_str, tz_name))
+
+    def pop_due(self, now: datetime):
+        """
+        Извлекает всё, что должно было сработать к now, и сразу планирует следующие срабатывания.
+        Опоздавшие не больше чем на REMINDER_CATCHUP_SECONDS (долгий запуск, рестарт) досылаются,
+        более старые — пропускаются.
+        """
+        due = []
+        grace = timedelta(seconds=REMINDER_CATCHUP_SECONDS)
+        while self._heap and self._heap[0][0] <= now:
+            fire_at, _, entry = heapq.heappop(self._heap)
+            user_id, version, meal_index, name, time_str, tz_name = entry
+            if self._versions.get(user_id) != version:
+                continue
+
+            if now - fire_at <= grace:
+                due.append((fire_at, entry))
+            else:
+                logger.warning(f"Skip stale meal reminder for user {user_id} scheduled at {fire_at.isoformat()}")
+            self._push(self.next_fire(time_str, tz_name, max(fire_at, now - grace)), entry)
+        return due
+
+    def next_fire_at(self):
+        # отбрасываем устаревшие версии сверху, чтобы не просыпаться впустую
+        while self._heap:
+            entry = self._heap[0][2]
+            if self._versions.get(entry[0]) == entry[1]:
+                return self._heap[0][0]
+            heapq.heappop(self._heap)
+        return None
+
+    def __len__(self):
+        return len(self._heap)
+
+
+_wheel = ReminderWheel()
+_job_queue = None
+_wheel_job = None
+_wheel_job_at = None
+
+
+def _utcnow() -> datetime:
+    return datetime.now(pytz.utc)
+
+
+def _arm_wheel():
+    """Ставит одноразовую задачу ровно на ближайшее срабатывание (перепланирует, если оно сдвинулось)."""
+    global _wheel_job, _wheel_job_at
+    if _job_queue is None:
+        return
+    fire_at = _wheel.next_fire_at()
+    if fire_at == _wheel_job_at and _wheel_job is not None:
+        return
+    if _wheel_job is not None:
+        _wheel_job.schedule_removal()
+        _wheel_job = None
+    _wheel_job_at = fire_at
+    if fire_at is not None:
+        _wheel_job = _job_queue.run_once(fire_due_meal_reminders, when=fire_at, name="meal_reminder_wheel")
+
+
+def load_meal_reminders():
+    """
+    Строит планировщик из напоминаний пользователей своего шарда (при одном процессе — всех).
+    Стартуем с "now - grace", чтобы дослать пропущенное за простой.
+    """
+    since = _utcnow() - timedelta(seconds=REMINDER_CATCHUP_SECONDS)
+    by_user: Dict[int, list] = {}
+    for user_id, meal_index, name, time_str, tz_name in get_all_meal_reminders(SHARD_INDEX, SHARD_COUNT):
+        by_user.setdefault(user_id, []).append((meal_index, name, time_str, tz_name))
+    for user_id, reminders in by_user.items():
+        _wheel.set_user(user_id, reminders, since)
+    logger.info(f"Meal reminder wheel loaded: {len(_wheel)} reminders for {len(by_user)} users (shard {SHARD_INDEX}/{SHARD_COUNT})")
+
+
+def reindex_user_reminders(user_id: int):
+    """Перечитывает расписание пользователя (после add_meal_reminder/clear_meal_reminders/смены пояса)."""
+    tz_name = get_user_timezone(user_id)
+    reminders = [(r["index"], r["name"], r["time"], tz_name) for r in get_meal_reminders(user_id)]
+    _wheel.set_user(user_id, reminders, _utcnow())
+    _arm_wheel()
+
+
+async def _outbox_db(func, *args, attempts: int = OUTBOX_DB_ATTEMPTS):
+    """
+    Вызов функции outbox из bot.database в executor'е с коротким busy timeout: единственного
+    писателя SQLite делят шарды, лимитер и persistence, и ожидание замка не должно
+    останавливать event loop. После attempts неудачных попыток — sqlite3.OperationalError.
+    """
+    loop = asyncio.get_running_loop()
+    call = functools.partial(func, *args, timeout=OUTBOX_DB_TIMEOUT)
+    for attempt in range(1, attempts + 1):
+        try:
+            return await loop.run_in_executor(None, call)
+        except sqlite3.OperationalError as e:
+            if attempt == attempts:
+                raise
+            logger.warning(f"Outbox {func.__name__} failed (attempt {attempt}/{attempts}): {e}")
+            await asyncio.sleep(OUTBOX_DB_TIMEOUT)
+
+
+async def drain_notification_outbox(context):
+    """
+    Разбирает outbox батчами: забирает строки, рассылает, отмечает результат.
+    Каждая строка отмечается сразу после отправки, поэтому после падения повторно
+    может уйти только сообщение, отправленное, но ещё не отмеченное. Строки, которые
+    не удалось отметить сразу (БД занята), отмечаются одним запросом в конце батча.
+    """
+    if _drain_lock.locked():
+        # в этом процессе уже идёт разбор — он заберёт и новые строки
+        return
+
+    async with _drain_lock:
+        while True:
+            try:
+                batch = await _outbox_db(claim_outbox_batch, _WORKER_ID, OUTBOX_BATCH_SIZE, OUTBOX_CLAIM_TIMEOUT)
+            except sqlite3.OperationalError as e:
+                logger.warning(f"Outbox is busy, will retry on next drain: {e}")
+                return
+            if not batch:
+                return
+
+            unmarked = {True: [], False: []}
+
+            async def mark_row(outbox_id, ok: bool):
+                try:
+                    await _outbox_db(mark_outbox_processed, [outbox_id] if ok else [], [] if ok else [outbox_id],
+                                     attempts=1)
+                except sqlite3.OperationalError:
+                    unmarked[ok].append(outbox_id)
+
+            await broadcast(
+                context.application.bot,
+                [(outbox_id, user_id, text) for outbox_id, user_id, text in batch],
+                name="outbox",
+                # лимит Telegram общий на бота — делим его между шардами
+                rate_per_second=BROADCAST_RATE_PER_SECOND / max(1, SHARD_COUNT),
+                on_result=mark_row
+            )
+            if unmarked[True] or unmarked[False]:
+                try:
+                    await _outbox_db(mark_outbox_processed, unmarked[True], unmarked[False])
+                except sqlite3.OperationalError as e:
+                    # строки останутся в 'sending' и уйдут повторно после OUTBOX_CLAIM_TIMEOUT
+                    logger.error(f"Failed to mark {len(unmarked[True]) + len(unmarked[False])} outbox rows: {e}")
+                    return
+
+
+def _daily_reminder_slots() -> int:
+    if DAILY_REMINDER_MODE != "spread":
+        return 1
+    return max(1, DAILY_REMINDER_WINDOW_MINUTES // max(1, DAILY_REMINDER_SLOT_MINUTES))
+
+
 # Функция для отправки напоминаний
+# В режиме "spread" задача запускается по разу на слот (context.job.data — номер слота)
+# и берёт пользователей своего слота: у каждого пользователя стабильное время напоминания.
+# Не больше DAILY_REMINDER_SLOT_MAX_USERS за слот — остальные уходят со следующим слотом.
 async def send_reminder(context):
-    application = context.application
+    moscow_tz = pytz.timezone("Europe/Moscow")
+    today = datetime.now(moscow_tz).date().isoformat()
+    slots = _daily_reminder_slots()
+    slot = context.job.data if context.job and slots > 1 else None
+    cap = DAILY_REMINDER_SLOT_MAX_USERS if slot is not None else 0
 
     cutoff = datetime.utcnow() - timedelta(hours=12)
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT u.user_id 
-        FROM users u
-        LEFT JOIN (
-            SELECT user_id, MAX(timestamp) as last_meal
-            FROM meals GROUP BY user_id
-        ) m ON u.user_id = m.user_id
-        WHERE u.notifications_enabled = 1
-          AND (m.last_meal IS NULL OR datetime(m.last_meal) < ?)
-    """, (cutoff.isoformat(),))
-    users = [row[0] for row in cursor.fetchall()]
-    conn.close()
-
-    for user_id in users:
+    # ключ "daily:дата:user" — повторный запуск после рестарта не продублирует рассылку,
+    # а следующий слот не возьмёт уже поставленных в очередь
+    dedup_prefix = f"daily:{today}:"
+    users = get_users_to_remind(cutoff, slot=slot, slots=slots, dedup_prefix=dedup_prefix,
+                                limit=cap + 1 if cap else None)
+    if cap and len(users) > cap:
+        users = users[:cap]
+        if slot == slots - 1:
+            logger.warning(f"Daily reminder: last slot is full ({cap} users), the rest are skipped today")
+        else:
+            logger.info(f"Daily reminder slot {slot} is full ({cap} users), the rest move to the next slot")
+
+    text = (
+        "Не забывай вносить приёмы пищи!\n\n"
+        "Если будешь записывать — достигнешь своей цели быстрее 💪\n\n"
+        "Уведомления можно отключить в ⚙ Настройках."
+    )
+    try:
+        added = await _outbox_db(
+            enqueue_notifications, [(f"{dedup_prefix}{user_id}", user_id, text) for user_id in users]
+        )
+    except sqlite3.OperationalError as e:
+        logger.error(f"Daily reminder (slot {slot}/{slots}) not enqueued for {len(users)} users: {e}")
+        return
+    logger.info(f"Daily reminder (slot {slot}/{slots}) enqueued for {added} users ({len(users)} eligible)")
+
+    if not slot:
         try:
-            await application.bot.send_message(
-                chat_id=user_id,
-                text=(
-                    "Не забывай вносить приёмы пищи!\n\n"
-                    "Если будешь записывать — достигнешь своей цели быстрее 💪\n\n"
-                    "Уведомления можно отключить в ⚙ Настройках."
-                )
-            )
-            logger.info(f"Sent reminder to user {user_id}")
-        except Exception as e:
-            logger.error(f"Error sending reminder to user {user_id}: {e}")
+            purged = await _outbox_db(purge_notification_outbox, OUTBOX_KEEP_DAYS, attempts=1)
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Outbox purge skipped: {e}")
+            purged = 0
+        if purged:
+            logger.info(f"Purged {purged} old outbox rows")
 
-# Регистрация задачи
-def setup_scheduler(application):
+    await drain_notification_outbox(context)
+
+def _schedule_daily_catchup(application, window_start: datetime):
+    """
+    Запуск посреди сегодняшнего окна рассылки: досылаем слоты, время которых уже прошло.
+    Слот берёт и пользователей предыдущих слотов, поэтому хватает одного запуска последнего
+    прошедшего слота; уже поставленных в очередь отсекают ключи "daily:дата:user".
+    """
     moscow_tz = pytz.timezone("Europe/Moscow")
-    # Каждый день в 10:00 по Москве
-    application.job_queue.run_daily(
-        send_reminder,
-        time=time(hour=10, minute=00, tzinfo=moscow_tz)
+    now = datetime.now(moscow_tz)
+    start = moscow_tz.localize(datetime.combine(now.date(), window_start.time()))
+    elapsed = now - start
+    if not timedelta(0) <= elapsed < timedelta(minutes=DAILY_REMINDER_WINDOW_MINUTES):
+        return
+    slots = _daily_reminder_slots()
+    slot = min(slots - 1, int(elapsed.total_seconds() // 60) // max(1, DAILY_REMINDER_SLOT_MINUTES))
+    application.job_queue.run_once(
+        send_reminder, when=5, data=slot if slots > 1 else None, name="daily_reminder_catchup"
     )
-    # Каждую минуту проверяем напоминания по расписанию
-    application.job_queue.run_repeating(send_meal_reminders, interval=60, first=0)
-    logger.info("Reminder scheduler started (daily at 10:00 MSK)")
-    logger.info("Notofication scheduler started (every 60 sek)")
+    logger.info(f"Daily reminder catch-up scheduled for slots 0..{slot} "
+                f"({elapsed.total_seconds() // 60:.0f} min into today's window)")
 
-async def send_meal_reminders(context):
-    application = context.application
+def _schedule_daily_reminder(application):
     moscow_tz = pytz.timezone("Europe/Moscow")
-    now = datetime.now(moscow_tz).strftime("%H:%M")
-
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT u.user_id, u.notifications_enabled, m.name
-        FROM users u
-        JOIN meal_reminders m ON u.user_id = m.user_id
-        WHERE m.time = ?
-    """, (now,))
-    reminders = cursor.fetchall()
-    conn.close()
-
-    for r in reminders:
-        user_id, notifications_enabled, meal_name = r
-
-        # защита — проверяем включены ли уведомления
-        if not notifications_enabled:
-            logger.debug(f"Skip reminder for user {user_id}: notifications disabled")
+    slots = _daily_reminder_slots()
+    window_start = datetime(2000, 1, 1, 10, 0)
+    if slots == 1:
+        # Каждый день в 10:00 по Москве
+        application.job_queue.run_daily(
+            send_reminder,
+            time=time(hour=10, minute=00, tzinfo=moscow_tz)
+        )
+    else:
+        # Каждый день с 10:00 по Москве, слотами по DAILY_REMINDER_SLOT_MINUTES минут
+        for slot in range(slots):
+            slot_time = (window_start + timedelta(minutes=slot * DAILY_REMINDER_SLOT_MINUTES)).time()
+            application.job_queue.run_daily(
+                send_reminder,
+                time=slot_time.replace(tzinfo=moscow_tz),
+                data=slot,
+                name=f"daily_reminder_slot_{slot}"
+            )
+        logger.info(f"Daily reminder spread over {slots} slots of {DAILY_REMINDER_SLOT_MINUTES} min")
+    _schedule_daily_catchup(application, window_start)
+    logger.info("Reminder scheduler started (daily at 10:00 MSK)")
+
+
+# Регистрация задачи
+def setup_scheduler(application):
+    # Ежедневную рассылку ставит в outbox только шард 0 (она общая на всех пользователей),
+    # а разбирают outbox все шарды — claim_outbox_batch не отдаст строку двум воркерам
+    if SHARD_INDEX == 0:
+        _schedule_daily_reminder(application)
+    # Напоминания о приёмах пищи: задача ставится точно на ближайшее срабатывание,
+    # плюс редкая страховочная проверка на случай потерянной задачи
+    global _job_queue
+    _job_queue = application.job_queue
+    load_meal_reminders()
+    _arm_wheel()
+    application.job_queue.run_repeating(fire_due_meal_reminders, interval=300, first=300)
+    # Разбор outbox: добирает хвосты рассылок, в том числе прерванных рестартом
+    application.job_queue.run_repeating(drain_notification_outbox, interval=OUTBOX_DRAIN_INTERVAL, first=5)
+    logger.info("Meal reminder scheduler started (per-user time zones)")
+
+async def fire_due_meal_reminders(context):
+    """Срабатывание планировщика: ставит наступившие напоминания в outbox и планирует следующее."""
+    global _wheel_job, _wheel_job_at
+    if context.job is _wheel_job:
+        _wheel_job = None
+        _wheel_job_at = None
+
+    due = _wheel.pop_due(_utcnow())
+    _arm_wheel()
+    if not due:
+        return
+
+    enabled = filter_notifications_enabled([entry[0] for _, entry in due])
+    notifications = []
+    for fire_at, (user_id, _, meal_index, meal_name, _, tz_name) in due:
+        if user_id not in enabled:
             continue
+        local_slot = fire_at.astimezone(pytz.timezone(tz_name)).strftime("%Y-%m-%d %H:%M")
+        notifications.append((
+            f"meal:{local_slot}:{user_id}:{meal_index}",
+            user_id,
+            f"🔔 {meal_name}\n\nНапоминаю о необходимости внести данные о приёме пищи."
+        ))
+    if not notifications:
+        return
 
-        try:
-            await application.bot.send_message(
-                user_id,
-                f"🔔 {meal_name}\n\nНапоминаю о необходимости внести данные о приёме пищи."
-            )
-            logger.info(f"Sent meal reminder to user {user_id} ({meal_name})")
-        except Exception as e:
-            logger.error(f"Error sending meal reminder to {user_id}: {e}")
\ No newline at end of file
+    try:
+        added = await _outbox_db(enqueue_notifications, notifications)
+    except sqlite3.OperationalError as e:
+        logger.error(f"Meal reminders not enqueued ({len(notifications)} due): {e}")
+        return
+    logger.info(f"Meal reminders enqueued: {added} of {len(notifications)} due")
+    await drain_notification_outbox(context)
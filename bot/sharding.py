@@ -0,0 +1,34 @@
+import zlib
+
+
+def user_bucket(user_id: int, buckets: int) -> int:
+    """Стабильный (одинаковый между процессами и рестартами) номер корзины пользователя 0..buckets-1."""
+    if buckets <= 1:
+        return 0
+    return zlib.crc32(str(user_id).encode()) % buckets
+
+
+def update_user_id(data: dict):
+    """user_id из сырого JSON апдейта Telegram (без разбора в telegram.Update).
+
+    Почти у всех типов апдейтов отправитель лежит в поле "from"
+    (poll_answer — "user"); для постов в каналах берём id чата.
+    """
+    for key, value in data.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        sender = value.get("from") or value.get("user")
+        if isinstance(sender, dict) and "id" in sender:
+            return sender["id"]
+        chat = value.get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return chat["id"]
+    return None
+
+
+def shard_for_update(data: dict, shards: int) -> int:
+    """Шард, который обрабатывает апдейт; апдейты без пользователя — в шард 0"""
+    user_id = update_user_id(data)
+    if user_id is None:
+        return 0
+    return user_bucket(user_id, shards)
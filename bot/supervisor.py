@@ -0,0 +1,185 @@
+"""Многопроцессный запуск бота: супервизор + воркеры-шарды (BOT_MODE=sharded).
+
+Супервизор запускает SHARD_COUNT процессов `main.py` в режиме webhook,
+каждый на своём порту 127.0.0.1:SHARD_BASE_PORT+i со своим SHARD_INDEX,
+и сам принимает webhook от Telegram на WEBHOOK_PORT. Апдейт уходит
+воркеру, которому принадлежит пользователь (bot.sharding.user_bucket),
+поэтому состояние диалогов, кэши и лимиты пользователя живут в одном
+процессе, а общее состояние — в SQLite. Упавший воркер перезапускается.
+"""
+import asyncio
+import hmac
+import os
+import signal
+import sys
+
+import aiohttp
+from aiohttp import web
+from telegram import Bot, Update
+from telegram.error import TelegramError
+
+from bot.sharding import shard_for_update
+from bot.webhook import SECRET_HEADER, forward_update
+from config.config import (
+    TELEGRAM_TOKEN, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_URL, WEBHOOK_SECRET,
+    SHARD_COUNT, SHARD_BASE_PORT, SHARD_RESTART_DELAY,
+)
+from logger_config import logger
+
+MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+STOP_TIMEOUT = 15   # сек на корректную остановку воркера, потом kill
+
+
+def _worker_url(index: int) -> str:
+    return f"http://127.0.0.1:{SHARD_BASE_PORT + index}"
+
+
+def _worker_env(index: int) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "BOT_MODE": "webhook",
+        "SHARD_INDEX": str(index),
+        "SHARD_COUNT": str(SHARD_COUNT),
+        "SHARD_PEERS": ",".join(_worker_url(i) for i in range(SHARD_COUNT)),
+        "WEBHOOK_HOST": "127.0.0.1",
+        "WEBHOOK_PORT": str(SHARD_BASE_PORT + index),
+        # webhook у Telegram регистрирует супервизор, а не воркеры
+        "WEBHOOK_URL": "",
+        "BOT_LOG_FILE": f"bot.shard{index}.log",
+    })
+    return env
+
+
+class ShardWorker:
+    """Процесс одного шарда; перезапускается, пока супервизор не остановлен"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process = None
+        self.restarts = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    async def run(self, stop: asyncio.Event):
+        while not stop.is_set():
+            self.process = await asyncio.create_subprocess_exec(
+                sys.executable, MAIN_SCRIPT, env=_worker_env(self.index)
+            )
+            logger.info(f"Shard worker {self.index} started (pid {self.process.pid}, port {SHARD_BASE_PORT + self.index})")
+
+            exited = asyncio.create_task(self.process.wait())
+            stopping = asyncio.create_task(stop.wait())
+            await asyncio.wait({exited, stopping}, return_when=asyncio.FIRST_COMPLETED)
+            if stopping.done():
+                exited.cancel()
+                await self._terminate()
+                return
+            stopping.cancel()
+
+            self.restarts += 1
+            logger.error(f"Shard worker {self.index} exited with code {self.process.returncode}, "
+                         f"restarting in {SHARD_RESTART_DELAY}s")
+            try:
+                await asyncio.wait_for(stop.wait(), SHARD_RESTART_DELAY)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _terminate(self):
+        if not self.alive:
+            return
+        self.process.terminate()
+        try:
+            await asyncio.wait_for(self.process.wait(), STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"Shard worker {self.index} did not stop in {STOP_TIMEOUT}s, killing")
+            self.process.kill()
+            await self.process.wait()
+        logger.info(f"Shard worker {self.index} stopped (code {self.process.returncode})")
+
+
+def create_router_app(workers: list) -> web.Application:
+    """Фронт: проверяет secret token и пересылает апдейт воркеру-владельцу"""
+    web_app = web.Application()
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), WEBHOOK_SECRET):
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+
+        shard = shard_for_update(data, SHARD_COUNT)
+        # 503 — Telegram повторит апдейт позже (например, пока воркер перезапускается)
+        ok = await forward_update(web_app["session"], _worker_url(shard), data)
+        return web.Response(status=200 if ok else 503)
+
+    async def healthz(request: web.Request) -> web.Response:
+        return web.json_response({
+            "shards": SHARD_COUNT,
+            "workers": [
+                {"shard": w.index, "pid": w.process.pid if w.process else None,
+                 "alive": w.alive, "restarts": w.restarts}
+                for w in workers
+            ],
+        }, status=200 if all(w.alive for w in workers) else 503)
+
+    async def on_startup(app: web.Application):
+        app["session"] = aiohttp.ClientSession()
+
+    async def on_cleanup(app: web.Application):
+        await app["session"].close()
+
+    web_app.router.add_post(WEBHOOK_PATH, handle_update)
+    web_app.router.add_get("/healthz", healthz)
+    web_app.on_startup.append(on_startup)
+    web_app.on_cleanup.append(on_cleanup)
+    return web_app
+
+
+async def _register_webhook():
+    if not WEBHOOK_URL:
+        logger.warning("WEBHOOK_URL не задан — webhook нужно зарегистрировать вручную")
+        return
+    url = WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH
+    try:
+        async with Bot(TELEGRAM_TOKEN) as bot:
+            await bot.set_webhook(url=url, secret_token=WEBHOOK_SECRET, allowed_updates=Update.ALL_TYPES)
+    except TelegramError as e:
+        # воркеры уже запущены — не роняем супервизор, старый webhook продолжит работать
+        logger.error(f"Failed to register webhook at {url}: {e}")
+        return
+    logger.info(f"Webhook registered at {url}")
+
+
+async def serve_supervisor():
+    """Запускает воркеры и фронт; работает до SIGINT/SIGTERM"""
+    if not WEBHOOK_SECRET:
+        raise RuntimeError("WEBHOOK_SECRET не установлен")
+    if SHARD_COUNT < 1:
+        raise RuntimeError(f"SHARD_COUNT={SHARD_COUNT} должен быть не меньше 1")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    workers = [ShardWorker(i) for i in range(SHARD_COUNT)]
+    worker_tasks = [asyncio.create_task(w.run(stop)) for w in workers]
+
+    runner = web.AppRunner(create_router_app(workers), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    logger.info(f"Shard router listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH} ({SHARD_COUNT} workers)")
+    await _register_webhook()
+
+    await stop.wait()
+    logger.info("Supervisor stopping...")
+    await runner.cleanup()
+    await asyncio.gather(*worker_tasks)
+
+
+def run_supervisor():
+    asyncio.run(serve_supervisor())
@@ -0,0 +1,131 @@
+"""Параллельная обработка апдейтов с сохранением порядка для каждого пользователя.
+
+Апдейты разных пользователей обрабатываются одновременно (долгий запрос к GPT
+или график одного не задерживает остальных), а апдейты одного пользователя —
+строго по очереди, в порядке поступления. Поэтому состояние ConversationHandler'ов
+(per_user=True) и context.user_data не ломается от гонок.
+"""
+import asyncio
+import functools
+import time
+from typing import Any, Awaitable
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor, ConversationHandler
+from bot.callback_router import CallbackRouter
+from config.config import LOG_SAMPLE_RATE, LOG_SLOW_HANDLER_MS
+from logger_config import logger, log_event, bind_log_context, reset_log_context
+
+
+def _ordering_key(update: object):
+    """Ключ очереди: пользователь, иначе чат; None — порядок не важен"""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user is not None:
+        return ("user", update.effective_user.id)
+    if update.effective_chat is not None:
+        return ("chat", update.effective_chat.id)
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """BaseUpdateProcessor с очередью (asyncio.Lock) на каждого пользователя.
+
+    asyncio.Lock отдаёт управление ожидающим строго по очереди (FIFO),
+    а PTB запускает задачи апдейтов в порядке получения — так порядок
+    внутри одного пользователя сохраняется. Общий слот (max_concurrent_updates)
+    берётся уже после замка пользователя: апдейты, ждущие своей очереди, слотов
+    не занимают, и один пользователь, жмущий кнопки во время долгого запроса
+    к GPT, не забивает пул остальным.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._locks = {}     # ключ -> asyncio.Lock
+        self._waiting = {}   # ключ -> сколько апдейтов держат/ждут замок
+
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = _ordering_key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._waiting[key] = self._waiting.get(key, 0) + 1
+        try:
+            async with lock:
+                # общий семафор — внутри process_update базового класса
+                await super().process_update(update, coroutine)
+        finally:
+            # замок больше никому не нужен — удаляем, чтобы словарь не рос
+            self._waiting[key] -= 1
+            if self._waiting[key] == 0:
+                del self._waiting[key]
+                del self._locks[key]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        logger.info(f"Per-user update processor started (max {self.max_concurrent_updates} concurrent updates)")
+
+    async def shutdown(self) -> None:
+        if self._waiting:
+            logger.warning(f"Update processor shutting down with {len(self._waiting)} users still queued")
+
+
+def timed_handler(callback):
+    """Обёртка колбэка: событие "handler" с latency_ms; user_id и handler попадают во все события внутри.
+
+    Быстрые успешные вызовы пишутся с долей LOG_SAMPLE_RATE, медленные и упавшие — всегда.
+    """
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context, *args):
+        user = getattr(update, "effective_user", None)
+        token = bind_log_context(user_id=user.id if user else None, handler=name)
+        started = time.perf_counter()
+        ok = False
+        try:
+            result = await callback(update, context, *args)
+            ok = True
+            return result
+        finally:
+            latency_ms = round((time.perf_counter() - started) * 1000, 1)
+            sample = 1.0 if not ok or latency_ms >= LOG_SLOW_HANDLER_MS else LOG_SAMPLE_RATE
+            log_event("handler", sample_rate=sample, latency_ms=latency_ms, ok=ok)
+            reset_log_context(token)
+
+    wrapper.timed = True
+    return wrapper
+
+
+def _instrument(handler):
+    if isinstance(handler, ConversationHandler):
+        for inner in handler.entry_points + handler.fallbacks:
+            _instrument(inner)
+        for state_handlers in handler.states.values():
+            for inner in state_handlers:
+                _instrument(inner)
+        return
+    callback = getattr(handler, "callback", None)
+    if callback is None or getattr(callback, "timed", False):
+        return
+    router = getattr(callback, "__self__", None)
+    if isinstance(router, CallbackRouter):
+        # замеряем конкретные маршруты, а не общий диспетчер
+        router.wrap_callbacks(timed_handler)
+        return
+    handler.callback = timed_handler(callback)
+
+
+def instrument_handlers(application):
+    """Оборачивает колбэки всех зарегистрированных обработчиков (служебные группы < 0 — нет)"""
+    for group, handlers in application.handlers.items():
+        if group < 0:
+            continue
+        for handler in handlers:
+            _instrument(handler)
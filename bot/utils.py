@@ -1,8 +1,7 @@
-import aiohttp
 import json
-import matplotlib.pyplot as plt
 import os
 from logger_config import logger
+from config.config import MENU_IMAGE_FORMAT, MENU_PNG_COMPRESS_LEVEL
 
 def get_main_menu():
     from telegram import ReplyKeyboardMarkup
@@ -38,10 +37,120 @@ def render_progress_bar(current, total, length=20):
     empty = length - filled
     return f"[{'▓' * filled}{'▒' * empty}] {current}/{total}"
 
-def render_menu_to_image(menu_data: dict, user_id: int) -> str:
-    from PIL import Image, ImageDraw, ImageFont
-    import os, textwrap, logging, math
-    logger = logging.getLogger(__name__)
+# --- Шрифты и ширины текста для картинки меню ---
+# Пробуем несколько часто встречающихся путей/имён (без требования установки);
+# если ничего нет — fallback load_default(). Путь ищем один раз на процесс.
+MENU_FONT_CANDIDATES = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/noto/NotoSans-Regular.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+    "/usr/share/fonts/truetype/freefont/FreeSans.ttf",
+    "/Library/Fonts/Arial Unicode.ttf",
+    "DejaVuSans.ttf",
+    "NotoSans-Regular.ttf",
+    "Arial.ttf",
+    "LiberationSans-Regular.ttf",
+    "FreeSans.ttf",
+]
+_MISSING = object()
+_menu_font_path = _MISSING
+_menu_fonts = {}        # размер -> ImageFont
+_word_widths = {}       # (id шрифта, слово) -> ширина в пикселях
+_WORD_WIDTHS_MAX = 50000
+
+
+def _resolve_menu_font_path():
+    global _menu_font_path
+    if _menu_font_path is _MISSING:
+        from PIL import ImageFont
+        _menu_font_path = None
+        for p in MENU_FONT_CANDIDATES:
+            try:
+                ImageFont.truetype(p, 16)
+                _menu_font_path = p
+                break
+            except Exception:
+                continue
+        if _menu_font_path is None:
+            logger.warning("No TrueType font found for menu image, using default bitmap font")
+    return _menu_font_path
+
+
+def get_menu_font(size: int):
+    """Шрифт для картинки меню; загружается один раз на размер"""
+    fnt = _menu_fonts.get(size)
+    if fnt is None:
+        from PIL import ImageFont
+        path = _resolve_menu_font_path()
+        fnt = ImageFont.truetype(path, size) if path else ImageFont.load_default()
+        _menu_fonts[size] = fnt
+    return fnt
+
+
+def text_width(txt: str, fnt) -> float:
+    """Ширина строки (advance) с мемоизацией по шрифту и слову"""
+    key = (id(fnt), txt)
+    w = _word_widths.get(key)
+    if w is None:
+        if len(_word_widths) >= _WORD_WIDTHS_MAX:
+            _word_widths.clear()
+        w = fnt.getlength(txt)
+        _word_widths[key] = w
+    return w
+
+
+def wrap_text_to_width(text, fnt, max_width) -> list:
+    """Перенос по словам за один проход: ширину строки накапливаем из ширин слов.
+
+    Слово длиннее max_width режется по символам (ширины символов тоже
+    берутся из кэша), так что стоимость линейна по длине текста.
+    """
+    lines = []
+    space_w = text_width(" ", fnt)
+    for paragraph in str(text).split("\n"):
+        cur = []
+        cur_w = 0.0
+        # split() без аргумента: подряд идущие пробелы не дают пустых "слов" (и пробела в начале строки)
+        for w in paragraph.split():
+            w_w = text_width(w, fnt)
+            test_w = cur_w + space_w + w_w if cur else w_w
+            if test_w <= max_width:
+                cur.append(w)
+                cur_w = test_w
+                continue
+
+            line = " ".join(cur)
+            if line:
+                lines.append(line)
+            if w_w > max_width:
+                part, part_w = "", 0.0
+                for ch in w:
+                    ch_w = text_width(ch, fnt)
+                    if part_w + ch_w <= max_width:
+                        part += ch
+                        part_w += ch_w
+                    else:
+                        if part:
+                            lines.append(part)
+                        part, part_w = ch, ch_w
+                cur, cur_w = ([part], part_w) if part else ([], 0.0)
+            else:
+                cur, cur_w = [w], w_w
+        line = " ".join(cur)
+        if line:
+            lines.append(line)
+    if not lines:
+        return [""]
+    return lines
+
+
+def render_menu_to_image(menu_data: dict, user_id: int) -> bytes:
+    """Рисует меню таблицей и возвращает картинку в байтах (без записи на диск).
+
+    Синхронная и CPU-нагруженная — из хендлеров вызывать через run_in_executor.
+    """
+    from PIL import Image, ImageDraw
+    import io
 
     meals = menu_data.get("meals", []) or []
     totals = menu_data.get("totals", {}) or {}
@@ -57,77 +166,13 @@ def render_menu_to_image(menu_data: dict, user_id: int) -> str:
     inner_width = width - 2 * padding_x
     col_widths = [int(inner_width * r) for r in col_ratios]
 
-    # Попробуем надёжно подобрать шрифт (без требовать установки):
-    # пробуем несколько часто встречающихся путей/имён; если ничего нет — fallback load_default()
-    font_candidates = [
-        "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
-        "/usr/share/fonts/truetype/noto/NotoSans-Regular.ttf",
-        "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
-        "/usr/share/fonts/truetype/freefont/FreeSans.ttf",
-        "/Library/Fonts/Arial Unicode.ttf",
-        "DejaVuSans.ttf",
-        "NotoSans-Regular.ttf",
-        "Arial.ttf",
-        "LiberationSans-Regular.ttf",
-        "FreeSans.ttf",
-    ]
-    font = None
-    font_bold = None
-    for p in font_candidates:
-        try:
-            font = ImageFont.truetype(p, 16)
-            font_bold = ImageFont.truetype(p, 18)
-            break
-        except Exception:
-            font = None
-    if font is None:
-        font = ImageFont.load_default()
-        font_bold = font
-
-    # измерения
+    font = get_menu_font(16)
+    font_bold = get_menu_font(18)
+
     def text_size(txt, fnt):
         bbox = fnt.getbbox(str(txt))
         return (bbox[2] - bbox[0], bbox[3] - bbox[1])
 
-    def text_width(txt, fnt):
-        return text_size(txt, fnt)[0]
-
-    def wrap_text_to_width(text, fnt, max_width):
-        lines = []
-        for paragraph in str(text).split("\n"):
-            words = paragraph.split(" ")
-            cur = ""
-            for w in words:
-                if cur == "":
-                    test = w
-                else:
-                    test = cur + " " + w
-                if text_width(test, fnt) <= max_width:
-                    cur = test
-                else:
-                    if cur:
-                        lines.append(cur)
-                    if text_width(w, fnt) > max_width:
-                        part = ""
-                        for ch in w:
-                            if text_width(part + ch, fnt) <= max_width:
-                                part += ch
-                            else:
-                                if part:
-                                    lines.append(part)
-                                part = ch
-                        if part:
-                            cur = part
-                        else:
-                            cur = ""
-                    else:
-                        cur = w
-            if cur:
-                lines.append(cur)
-        if not lines:
-            return [""]
-        return lines
-
     # собираем строки
     rows = []
     computed_totals = {"calories": 0.0, "protein": 0.0, "fat": 0.0, "carbs": 0.0}
@@ -305,14 +350,12 @@ def render_menu_to_image(menu_data: dict, user_id: int) -> str:
     macros_tot = f"Б {int(round(totals.get('protein',0)))} г  Ж {int(round(totals.get('fat',0)))} г  У {int(round(totals.get('carbs',0)))} г"
     draw.text((x3 + table_padding, y + cell_pad), macros_tot, font=header_font, fill=(20, 20, 20))
 
-    # сохранить
-    os.makedirs("generated", exist_ok=True)
-    image_path = f"generated/menu_{user_id}.png"
-    try:
-        img.save(image_path, format="PNG")
-        logger.info(f"Menu image saved to {image_path}")
-    except Exception as e:
-        logger.exception("Failed to save menu image")
-        raise
-
-    return image_path
+    # кодируем в память: PNG с умеренным сжатием (таблица из плоских цветов
+    # почти не выигрывает от уровня 9) или lossless WebP, если включен
+    buf = io.BytesIO()
+    if MENU_IMAGE_FORMAT == "WEBP":
+        img.save(buf, format="WEBP", lossless=True, method=4)
+    else:
+        img.save(buf, format="PNG", compress_level=MENU_PNG_COMPRESS_LEVEL)
+    logger.info(f"Menu image rendered for user {user_id}: {MENU_IMAGE_FORMAT}, {buf.tell() // 1024} KB")
+    return buf.getvalue()
@@ -0,0 +1,132 @@
+"""Приём апдейтов через webhook на встроенном aiohttp-сервере.
+
+POST {WEBHOOK_PATH} — апдейт от Telegram (или от соседнего воркера).
+Проверяем secret token, определяем шард пользователя и либо кладём апдейт
+в update_queue приложения, либо пересылаем воркеру-владельцу — так
+состояние диалогов и кэши пользователя живут в одном процессе.
+GET /healthz — для балансировщика.
+"""
+import asyncio
+import hmac
+import signal
+
+import aiohttp
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+from bot.sharding import shard_for_update
+from config.config import (
+    WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_URL, WEBHOOK_SECRET,
+    SHARD_COUNT, SHARD_INDEX, SHARD_PEERS,
+)
+from logger_config import logger
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+FORWARDED_HEADER = "X-Bot-Shard-Forwarded"
+FORWARD_TIMEOUT = 10
+
+
+async def forward_update(session: aiohttp.ClientSession, peer_url: str, data: dict) -> bool:
+    """Пересылает сырой апдейт воркеру-владельцу; False — пусть Telegram повторит"""
+    try:
+        async with session.post(
+            peer_url.rstrip("/") + WEBHOOK_PATH,
+            json=data,
+            headers={SECRET_HEADER: WEBHOOK_SECRET, FORWARDED_HEADER: "1"},
+            timeout=aiohttp.ClientTimeout(total=FORWARD_TIMEOUT),
+        ) as resp:
+            return resp.status == 200
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.warning(f"Failed to forward update {data.get('update_id')} to {peer_url}: {e}")
+        return False
+
+
+def create_webhook_app(application: Application) -> web.Application:
+    web_app = web.Application()
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), WEBHOOK_SECRET):
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+
+        shard = shard_for_update(data, SHARD_COUNT)
+        if shard != SHARD_INDEX:
+            if request.headers.get(FORWARDED_HEADER):
+                # уже пересланный апдейт не гоняем дальше — обработаем сами
+                logger.warning(f"Update {data.get('update_id')} forwarded to wrong shard {SHARD_INDEX} (owner {shard})")
+            else:
+                ok = await forward_update(web_app["session"], SHARD_PEERS[shard], data)
+                return web.Response(status=200 if ok else 503)
+
+        await application.update_queue.put(Update.de_json(data, application.bot))
+        return web.Response()
+
+    async def healthz(request: web.Request) -> web.Response:
+        return web.json_response({
+            "shard": SHARD_INDEX,
+            "shards": SHARD_COUNT,
+            "queued": application.update_queue.qsize(),
+        })
+
+    async def on_startup(app: web.Application):
+        app["session"] = aiohttp.ClientSession()
+
+    async def on_cleanup(app: web.Application):
+        await app["session"].close()
+
+    web_app.router.add_post(WEBHOOK_PATH, handle_update)
+    web_app.router.add_get("/healthz", healthz)
+    web_app.on_startup.append(on_startup)
+    web_app.on_cleanup.append(on_cleanup)
+    return web_app
+
+
+def _check_webhook_config():
+    if not WEBHOOK_SECRET:
+        raise RuntimeError("WEBHOOK_SECRET не установлен")
+    if not 0 <= SHARD_INDEX < SHARD_COUNT:
+        raise RuntimeError(f"SHARD_INDEX={SHARD_INDEX} вне диапазона 0..{SHARD_COUNT - 1}")
+    if SHARD_COUNT > 1 and len(SHARD_PEERS) != SHARD_COUNT:
+        raise RuntimeError(f"SHARD_PEERS должен содержать {SHARD_COUNT} адресов, задано {len(SHARD_PEERS)}")
+
+
+async def serve_webhook(application: Application, register_webhook: bool = True):
+    """Запускает приложение и HTTP-сервер; работает до SIGINT/SIGTERM"""
+    _check_webhook_config()
+    runner = web.AppRunner(create_webhook_app(application), access_log=None)
+
+    async with application:
+        # post_init PTB вызывает только из run_polling/run_webhook — здесь, как и там, между initialize и start
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        # webhook у Telegram один на бота — регистрирует его только шард 0
+        if register_webhook and WEBHOOK_URL and SHARD_INDEX == 0:
+            await application.bot.set_webhook(
+                url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES,
+            )
+            logger.info(f"Webhook registered at {WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH}")
+
+        await runner.setup()
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        logger.info(f"Webhook server listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH} (shard {SHARD_INDEX}/{SHARD_COUNT})")
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await stop.wait()
+
+        logger.info("Webhook server stopping...")
+        await runner.cleanup()
+        await application.stop()
+
+
+def run_webhook(application: Application):
+    asyncio.run(serve_webhook(application))
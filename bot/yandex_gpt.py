@@ -1,9 +1,24 @@
-import aiohttp
 import json
-from logger_config import logger
+import time
+from logger_config import logger, truncate, Payload, log_event
 import math
 import re
 
+
+def _client_session():
+    """aiohttp импортируется при первом запросе к GPT (в фоне его заранее грузит prewarm в main.py)"""
+    import aiohttp
+    return aiohttp.ClientSession()
+
+
+def _gpt_tokens(response: dict):
+    """totalTokens из ответа YandexGPT (строка в API) или None"""
+    try:
+        return int(response["result"]["usage"]["totalTokens"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
 async def analyze_food_with_gpt(food_text: str, api_key: str, folder_id: str) -> dict:
     url = "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
     headers = {
@@ -46,21 +61,25 @@ async def analyze_food_with_gpt(food_text: str, api_key: str, folder_id: str) ->
         "messages": [{"role": "user", "text": prompt}]
     }
 
-    logger.info(f"Send YandexGPT: {food_text}")
-    async with aiohttp.ClientSession() as session:
+    logger.debug(f"Send YandexGPT: {food_text}")
+    started = time.perf_counter()
+    async with _client_session() as session:
         async with session.post(url, json=payload, headers=headers) as resp:
-            logger.info(f"Response status YandexGPT: {resp.status}")
             if resp.status != 200:
                 text = await resp.text()
-                logger.error(f"Error GPT: {text}")
-                raise Exception(f"GPT error {resp.status}: {text}")
+                log_event("gpt", call="food", status=resp.status,
+                          latency_ms=round((time.perf_counter() - started) * 1000, 1))
+                logger.error(f"Error GPT: {truncate(text)}")
+                raise Exception(f"GPT error {resp.status}: {truncate(text)}")
 
             result = await resp.json()
-            logger.info(f"Response YandexGPT: {result}")
+            log_event("gpt", call="food", status=resp.status, gpt_tokens=_gpt_tokens(result),
+                      latency_ms=round((time.perf_counter() - started) * 1000, 1))
+            logger.debug("Response YandexGPT: %s", Payload(result))
 
     try:
         text = result['result']['alternatives'][0]['message']['text'].strip()
-        print(f"📝 Исходный текст от GPT: {repr(text)}")
+        logger.debug("GPT raw text: %s", Payload(text))
 
         # 🔧 Удаляем Markdown-обёртку ``` и языки
         if text.startswith('```'):
@@ -73,7 +92,7 @@ async def analyze_food_with_gpt(food_text: str, api_key: str, folder_id: str) ->
             if text.endswith('```'):
                 text = text[:-3].strip()
 
-        print(f"📝 Очищенный текст: {text}")
+        logger.debug("GPT cleaned text: %s", Payload(text))
 
         # Парсим JSON
         data = json.loads(text)
@@ -99,15 +118,14 @@ async def analyze_food_with_gpt(food_text: str, api_key: str, folder_id: str) ->
         if not isinstance(data.get("items"), list):
             data["items"] = []
 
-        print(f"✅ Успешно распарсили: {data}")
+        logger.debug("GPT parsed: %s", Payload(data))
         return data
 
     except json.JSONDecodeError as e:
-        print(f"❌ Ошибка парсинга JSON: {e}")
-        print(f"Текст, который не удалось распарсить: {text}")
+        logger.error(f"GPT JSON parse error: {e}; text: {truncate(text)}")
         raise Exception("GPT вернул не-JSON")
     except Exception as e:
-        print(f"❌ Ошибка обработки ответа: {e}")
+        logger.error(f"GPT response processing error: {e}")
         raise
 
 # --- GPT запрос и анализ меню (пересобранная версия) ---
@@ -176,19 +194,22 @@ async def analyze_menu_with_gpt(
                "messages": [{"role": "user", "text": prompt}]}
 
     async def send_request(pl, note=""):
-        logger.info(f"Отправка запроса к GPT {note}...")
-        async with aiohttp.ClientSession() as session:
+        started = time.perf_counter()
+        async with _client_session() as session:
             async with session.post(url, json=pl, headers=headers, timeout=60) as resp:
                 txt = await resp.text()
                 if resp.status != 200:
-                    logger.error(f"GPT error {resp.status}: {txt}")
-                    raise RuntimeError(f"GPT error {resp.status}: {txt}")
+                    log_event("gpt", call="menu", note=note, status=resp.status,
+                              latency_ms=round((time.perf_counter() - started) * 1000, 1))
+                    logger.error(f"GPT error {resp.status}: {truncate(txt)}")
+                    raise RuntimeError(f"GPT error {resp.status}: {truncate(txt)}")
                 js = await resp.json()
                 try:
                     result_txt = js["result"]["alternatives"][0]["message"]["text"]
                 except Exception:
                     result_txt = txt
-                logger.info(f"Получен ответ от GPT ({note}), длина текста: {len(result_txt)}")
+                log_event("gpt", call="menu", note=note, status=resp.status, gpt_tokens=_gpt_tokens(js),
+                          latency_ms=round((time.perf_counter() - started) * 1000, 1), chars=len(result_txt))
                 return result_txt
 
     def extract_json_substring(text: str):
@@ -1,4 +1,3 @@
-import requests
 from config.config import YANDEX_SPEECH_API_KEY
 
 SPEECHKIT_URL = "https://stt.api.cloud.yandex.net/speech/v1/stt:recognize"
@@ -26,6 +25,8 @@ class YandexSpeechToText:
 
         params = {"lang": lang}
 
+        import requests  # нужен только для голосовых — не тянем его при старте бота
+
         response = requests.post(
             SPEECHKIT_URL,
             params=params,
@@ -14,9 +14,107 @@ YANDEX_GPT_API_KEY = os.getenv("YANDEX_GPT_API_KEY")
 YANDEX_GPT_FOLDER_ID = os.getenv("YANDEX_GPT_FOLDER_ID")
 YANDEX_SPEECH_API_KEY = os.getenv("YANDEX_SPEECH_API_KEY")
 
+# Каталог логов — от корня проекта, а не от текущей папки: его же читает tools/log_stats.py
+LOG_DIR = os.getenv("LOG_DIR", os.path.join(BASE_DIR, "logs"))
+LOG_FILE = os.getenv("BOT_LOG_FILE", "bot.log")   # у воркеров шардов свои файлы (bot.shard{i}.log)
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# Уровни для отдельных модулей поверх LOG_LEVEL (имя файла без .py), например
+# "yandex_gpt=DEBUG,broadcast=WARNING"
+LOG_MODULE_LEVELS = dict(
+    part.strip().split("=", 1) for part in os.getenv("LOG_MODULE_LEVELS", "").split(",") if "=" in part
+)
+LOG_PAYLOAD_CHARS = int(os.getenv("LOG_PAYLOAD_CHARS", "500"))         # тела запросов/ответов в логе обрезаются
+LOG_MAX_MESSAGE_CHARS = int(os.getenv("LOG_MAX_MESSAGE_CHARS", "4000"))  # жёсткий предел длины любой записи
+LOG_FILE_FORMAT = os.getenv("LOG_FILE_FORMAT", "json")   # "json" (по строке на запись) или "text"; консоль всегда текстом
+# Доля пишущихся частых событий (время обработчиков и т.п.); медленные и с ошибкой пишутся всегда
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))
+LOG_SLOW_HANDLER_MS = float(os.getenv("LOG_SLOW_HANDLER_MS", "1000"))
+
+# Сколько апдейтов обрабатывается одновременно (порядок внутри пользователя сохраняется).
+# Ожидающие своей очереди апдейты почти ничего не стоят, реальную нагрузку ограничивают
+# лимитеры GPT и пул графиков
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "256"))
+
+# Сохранение context.user_data и состояний диалогов в SQLite: как часто (сек) сбрасывать изменения.
+# При штатной остановке сохраняется всё; при падении теряется не больше этого интервала
+PERSISTENCE_UPDATE_INTERVAL = float(os.getenv("PERSISTENCE_UPDATE_INTERVAL", "10"))
+
+# Цель по холодному старту: от запуска процесса до готовности принимать апдейты (сек); дольше — warning в логе
+STARTUP_TARGET_SECONDS = float(os.getenv("STARTUP_TARGET_SECONDS", "1.5"))
 
 # RateLimiter Config
 MAX_REQUESTS_PER_MINUTE = 2      # <-- 3 запроса в минуту на пользователя
 WINDOW_SECONDS = 60              # окно в секундах для подсчёта
-CONCURRENT_GPT = 10              # <-- глобальный лимит одновременных запросов к GPT
+# Где хранить окна лимитов: "memory" — в процессе, "sqlite" — общая таблица для нескольких процессов бота
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+# сек ожидания записи в SQLite для лимита; не дождались — пропускаем запрос без лимита (fail open)
+RATE_LIMIT_DB_TIMEOUT = float(os.getenv("RATE_LIMIT_DB_TIMEOUT", "0.25"))
+CONCURRENT_GPT = 10              # <-- стартовый глобальный лимит одновременных запросов к GPT
+
+# Адаптивный лимит параллельных запросов к GPT (AIMD)
+CONCURRENT_GPT_MIN = int(os.getenv("CONCURRENT_GPT_MIN", "2"))        # нижняя граница лимита
+CONCURRENT_GPT_MAX = int(os.getenv("CONCURRENT_GPT_MAX", "40"))       # верхняя граница лимита
+GPT_LATENCY_TARGET = float(os.getenv("GPT_LATENCY_TARGET", "8.0"))    # сек, выше — считаем перегрузкой
+GPT_LIMIT_BACKOFF = 0.75                                               # множитель уменьшения лимита
+
+# Рассылки (напоминания): Telegram допускает ~30 сообщений/сек на бота
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "8"))                     # параллельных отправителей
+BROADCAST_RATE_PER_SECOND = float(os.getenv("BROADCAST_RATE_PER_SECOND", "25"))  # глобальный лимит, с запасом
+BROADCAST_BURST = float(os.getenv("BROADCAST_BURST", "3"))                      # сколько сообщений можно отправить разом
+BROADCAST_MAX_RETRIES = 3                                                        # повторов на сетевые ошибки
+BROADCAST_PROGRESS_EVERY = 500                                                   # как часто логировать прогресс
+
+# Outbox уведомлений: очередь в БД, которую воркеры разбирают батчами
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))   # сколько строк забирает воркер за раз
+OUTBOX_DRAIN_INTERVAL = 30                                        # сек, как часто проверять очередь
+OUTBOX_CLAIM_TIMEOUT = 300                                        # сек, после которых "зависший" батч забирается снова
+OUTBOX_KEEP_DAYS = 7                                              # сколько хранить обработанные строки
+OUTBOX_DB_TIMEOUT = float(os.getenv("OUTBOX_DB_TIMEOUT", "1"))    # сек ожидания записи в SQLite для outbox
+OUTBOX_DB_ATTEMPTS = 3                                            # попыток записи, прежде чем сдаться до следующего разбора
+
+# Ежедневное напоминание: "spike" — всем в 10:00 МСК, "spread" — по слотам в окне от 10:00
+DAILY_REMINDER_MODE = os.getenv("DAILY_REMINDER_MODE", "spike")
+DAILY_REMINDER_WINDOW_MINUTES = int(os.getenv("DAILY_REMINDER_WINDOW_MINUTES", "120"))  # ширина окна
+DAILY_REMINDER_SLOT_MINUTES = int(os.getenv("DAILY_REMINDER_SLOT_MINUTES", "5"))        # шаг слота
+# "spread": не больше стольких пользователей за слот, остальные переходят в следующий слот (0 — без ограничения)
+DAILY_REMINDER_SLOT_MAX_USERS = int(os.getenv("DAILY_REMINDER_SLOT_MAX_USERS", "0"))
+
+# Напоминания о приёмах пищи
+DEFAULT_TIMEZONE = "Europe/Moscow"   # часовой пояс пользователя по умолчанию
+REMINDER_CATCHUP_SECONDS = 15 * 60   # пропущенные (простой/рестарт) напоминания досылаем, если опоздали не больше чем на это
+
+# Отрисовка графиков (matplotlib) в отдельном пуле
+CHART_EXECUTOR = os.getenv("CHART_EXECUTOR", "process")       # "process" или "thread" (без pyplot потоки безопасны)
+CHART_WORKERS = int(os.getenv("CHART_WORKERS", "2"))           # воркеров в пуле
+CHART_MAX_PENDING = int(os.getenv("CHART_MAX_PENDING", "8"))   # больше в очереди — отвечаем без графика
+CHART_MONTHLY_RENDERER = os.getenv("CHART_MONTHLY_RENDERER", "matplotlib")  # "matplotlib" или "pillow"
+
+# Кэш готовых графиков (ключ — хэш отрисованных данных)
+CHART_CACHE_MAX_BYTES = int(os.getenv("CHART_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))  # лимит LRU в памяти
+CHART_CACHE_DIR = os.getenv("CHART_CACHE_DIR", "")                                     # пусто — без диска
+CHART_CACHE_DISK_DAYS = 2                                                               # сколько хранить файлы на диске
+
+# Картинка меню: "PNG" или "WEBP" (lossless, в ~3 раза меньше, но дольше кодируется)
+MENU_IMAGE_FORMAT = os.getenv("MENU_IMAGE_FORMAT", "PNG").upper()
+MENU_PNG_COMPRESS_LEVEL = 3   # 3 почти не уступает 6-9 по размеру и кодируется вдвое быстрее
+
+# Режим получения апдейтов: "polling" или "webhook" (встроенный aiohttp-сервер)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")          # публичный адрес (https://...), по нему регистрируем webhook
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")    # secret_token, Telegram присылает его в заголовке
+
+# Шардирование по user_id: несколько воркеров за балансировщиком, каждый
+# обрабатывает свою часть пользователей, чужие апдейты пересылает владельцу
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "1"))
+SHARD_INDEX = int(os.getenv("SHARD_INDEX", "0"))
+# Базовые адреса воркеров по номеру шарда через запятую, например
+# "http://10.0.0.1:8080,http://10.0.0.2:8080"
+SHARD_PEERS = [p.strip() for p in os.getenv("SHARD_PEERS", "").split(",") if p.strip()]
+
+# Режим BOT_MODE=sharded: супервизор запускает SHARD_COUNT процессов-воркеров на
+# 127.0.0.1:SHARD_BASE_PORT+i, сам принимает webhook на WEBHOOK_PORT и раздаёт апдейты по user_id
+SHARD_BASE_PORT = int(os.getenv("SHARD_BASE_PORT", "8081"))
+SHARD_RESTART_DELAY = 5   # сек до перезапуска упавшего воркера
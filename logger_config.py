@@ -1,25 +1,148 @@
+import atexit
+import contextvars
+import json
 import logging
-from logging.handlers import RotatingFileHandler
 import os
+import queue
+import random
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from config.config import (
+    LOG_DIR, LOG_FILE, LOG_LEVEL, LOG_MODULE_LEVELS, LOG_PAYLOAD_CHARS, LOG_MAX_MESSAGE_CHARS, LOG_FILE_FORMAT,
+)
+
+os.makedirs(LOG_DIR, exist_ok=True)
+
+
+def _level(name: str) -> int:
+    level = logging.getLevelName(str(name).upper())
+    return level if isinstance(level, int) else logging.INFO
+
+
+def truncate(text, limit: int = LOG_PAYLOAD_CHARS) -> str:
+    """Обрезает длинное тело для лога, сохраняя длину оригинала"""
+    text = str(text)
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}… (+{len(text) - limit} chars)"
+
+
+class Payload:
+    """Ленивая обрезка для logger.debug("...: %s", Payload(obj)) — str(obj) считается, только если запись пишется"""
+    __slots__ = ("obj", "limit")
+
+    def __init__(self, obj, limit: int = LOG_PAYLOAD_CHARS):
+        self.obj = obj
+        self.limit = limit
+
+    def __str__(self):
+        return truncate(self.obj, self.limit)
+
+
+class ModuleLevelFilter(logging.Filter):
+    """Уровни по модулям (record.module — имя файла), остальным — LOG_LEVEL"""
+
+    def __init__(self, default: int, levels: dict):
+        super().__init__()
+        self.default = default
+        self.levels = levels
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= self.levels.get(record.module, self.default)
+
+
+class TruncatingQueueHandler(QueueHandler):
+    """Кладёт запись в очередь уже отформатированной и не длиннее LOG_MAX_MESSAGE_CHARS"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = super().prepare(record)
+        if len(record.msg) > LOG_MAX_MESSAGE_CHARS:
+            record.msg = record.message = truncate(record.msg, LOG_MAX_MESSAGE_CHARS)
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись — одна JSON-строка; у структурных событий (log_event) поля лежат на верхнем уровне"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "module": record.module,
+        }
+        event = getattr(record, "event", None)
+        if event is not None:
+            data["event"] = event
+            data.update(record.fields)
+        else:
+            data["msg"] = record.getMessage()
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class _KeyValues:
+    """Поля события для текстового лога: "k=v k=v" (строится, только если запись пишется)"""
+    __slots__ = ("fields",)
+
+    def __init__(self, fields: dict):
+        self.fields = fields
+
+    def __str__(self):
+        return " ".join(f"{k}={v}" for k, v in self.fields.items())
+
+
+# Поля, которые добавляются ко всем событиям текущей задачи (user_id, handler — см. bot/update_processor.py)
+_log_context = contextvars.ContextVar("log_context", default={})
+
+
+def bind_log_context(**fields):
+    return _log_context.set({**_log_context.get(), **fields})
+
+
+def reset_log_context(token):
+    _log_context.reset(token)
+
+
+def log_event(event: str, level: int = logging.INFO, sample_rate: float = 1.0, **fields):
+    """
+    Структурное событие со стабильными полями (user_id, handler, latency_ms, gpt_tokens, cache_hit...).
+    sample_rate < 1 — пишется только такая доля событий (WARNING и выше — всегда);
+    в запись попадает sample_rate, чтобы при анализе восстановить настоящие количества.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    if sample_rate < 1.0 and level < logging.WARNING:
+        if random.random() >= sample_rate:
+            return
+        fields["sample_rate"] = sample_rate
+    fields = {**_log_context.get(), **fields}
+    # stacklevel=2: record.module — модуль, откуда вызвали log_event (для LOG_MODULE_LEVELS)
+    logger.log(level, "%s %s", event, _KeyValues(fields),
+               extra={"event": event, "fields": fields}, stacklevel=2)
 
-LOG_DIR = "logs"
-if not os.path.exists(LOG_DIR):
-    os.makedirs(LOG_DIR)
 
 # Настройка логирования
 logger = logging.getLogger("calorie_bot")
-logger.setLevel(logging.DEBUG)  # DEBUG — максимально подробное логирование
+_default_level = _level(LOG_LEVEL)
+_module_levels = {module: _level(level) for module, level in LOG_MODULE_LEVELS.items()}
+# у логгера — самый подробный из уровней, лишнее отсекает фильтр до форматирования
+logger.setLevel(min([_default_level, *_module_levels.values()]))
+logger.addFilter(ModuleLevelFilter(_default_level, _module_levels))
 
 # Лог в файл с ротацией
 file_handler = RotatingFileHandler(
-    os.path.join(LOG_DIR, "bot.log"),
+    # у воркеров шардов свои файлы: ротация одного файла из нескольких процессов ломается
+    os.path.join(LOG_DIR, LOG_FILE),
     maxBytes=5*1024*1024,  # 5 МБ на файл
     backupCount=5,          # храним 5 старых файлов
     encoding="utf-8"
 )
-file_formatter = logging.Formatter(
-    "%(asctime)s | %(levelname)s | %(name)s | %(message)s"
-)
+if LOG_FILE_FORMAT == "json":
+    file_formatter = JsonFormatter()
+else:
+    file_formatter = logging.Formatter(
+        "%(asctime)s | %(levelname)s | %(name)s | %(message)s"
+    )
 file_handler.setFormatter(file_formatter)
 
 # Лог в консоль
@@ -27,5 +150,10 @@ console_handler = logging.StreamHandler()
 console_formatter = logging.Formatter("%(asctime)s | %(levelname)s | %(message)s")
 console_handler.setFormatter(console_formatter)
 
-logger.addHandler(file_handler)
-logger.addHandler(console_handler)
+# Запись в файл и консоль — в отдельном потоке: event loop только кладёт запись в очередь
+_log_queue = queue.SimpleQueue()
+_listener = QueueListener(_log_queue, file_handler, console_handler, respect_handler_level=True)
+_listener.start()
+atexit.register(_listener.stop)   # дописывает очередь при выходе
+
+logger.addHandler(TruncatingQueueHandler(_log_queue))
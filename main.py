@@ -1,52 +1,75 @@
+import time
+
+# Отсчёт времени старта: до тяжёлых импортов
+_STARTED_AT = time.perf_counter()
+
+import asyncio
 from logger_config import logger
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackQueryHandler, ConversationHandler
-from config.config import TELEGRAM_TOKEN
+from telegram import Update
+from telegram.ext import Application, MessageHandler, filters, TypeHandler
+from config.config import TELEGRAM_TOKEN, MAX_CONCURRENT_UPDATES, BOT_MODE, STARTUP_TARGET_SECONDS
 from bot.reminder_scheduler import setup_scheduler
 from bot.database import init_db
+from bot.rate_limiter import warm_menu_rate_limit_cache
+from bot.charts import warm_chart_pool, shutdown_chart_pool
+from bot.update_processor import PerUserUpdateProcessor, instrument_handlers
+from bot.persistence import SQLitePersistence
 from bot.handlers import (
     conv_handler,
     profile_handler,
     meal_conv_handler,
     stats_handler,
-    confirm_handler,
-    retry_handler,
-    last_7_days_handler,
-    clear_today_handler,
     fallback_handler,
-    edit_profile_handler,
-    edit_name_handler,
-    edit_weight_handler,
-    edit_height_handler,
-    edit_age_handler,
-    edit_gender_handler,
-    edit_activity_handler,
-    edit_goal_handler,
-    set_gender_male_handler,
-    set_gender_female_handler,
-    set_activity_none_handler,
-    set_activity_low_handler,
-    set_activity_medium_handler,
-    set_activity_high_handler,
-    set_goal_maintain_handler,
-    set_goal_lose_handler,
-    set_goal_gain_handler,
-    set_rate_lose_slow_handler,
-    set_rate_lose_medium_handler,
-    set_rate_lose_fast_handler,
-    set_rate_gain_slow_handler,
-    set_rate_gain_medium_handler,
-    set_rate_gain_fast_handler,
     handle_all_text_input,
-    show_goal_chart,
-    show_current_progress,
     voice_message_handler,
-    toggle_notifications_handler,
     settings_handler,
     generate_menu_conv,
     meal_reminders_conv,
+    callback_router_handler,
 )
 
 
+_IMPORTED_AT = time.perf_counter()
+_first_update_seen = False
+
+
+def _since_start() -> float:
+    return time.perf_counter() - _STARTED_AT
+
+
+async def log_first_update(update, context):
+    """Время от запуска процесса до первого апдейта (группа -1, дальше апдейт идёт как обычно)"""
+    global _first_update_seen
+    if not _first_update_seen:
+        _first_update_seen = True
+        logger.info(f"Startup: first update {update.update_id} received {_since_start():.2f}s after start")
+
+
+async def post_init(application):
+    ready = _since_start()
+    logger.info(f"Startup: imports {_IMPORTED_AT - _STARTED_AT:.2f}s, ready for updates {ready:.2f}s after start")
+    if ready > STARTUP_TARGET_SECONDS:
+        logger.warning(f"Startup took {ready:.2f}s, target is {STARTUP_TARGET_SECONDS:.1f}s")
+    # Тяжёлое (пул графиков с matplotlib, Pillow и шрифты меню) поднимаем в фоне, уже принимая апдейты
+    application.job_queue.run_once(prewarm, when=0, name="prewarm")
+
+
+def _prewarm_imports():
+    from bot.utils import get_menu_font
+    get_menu_font(16)
+    get_menu_font(18)
+    import numpy  # noqa: F401
+    import aiohttp  # noqa: F401  (клиент YandexGPT)
+
+
+async def prewarm(context):
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, warm_chart_pool)
+    await loop.run_in_executor(None, _prewarm_imports)
+    logger.info(f"Startup: background prewarm done in {time.perf_counter() - started:.2f}s")
+
+
 # Глобальный обработчик ошибок
 async def error_handler(update, context):
     logger.error(f"Error: {context.error}")
@@ -58,10 +81,28 @@ def main():
     # Инициализация базы
     init_db()
 
+    if BOT_MODE == "sharded":
+        # Супервизор: сам апдейты не обрабатывает, запускает воркеры-шарды (main.py в режиме webhook)
+        from bot.supervisor import run_supervisor
+        run_supervisor()
+        return
+
+    warm_menu_rate_limit_cache()
+
     # Создаём приложение
-    app = Application.builder().token(TELEGRAM_TOKEN).build()
+    # Апдейты разных пользователей — параллельно, одного пользователя — по порядку
+    app = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .concurrent_updates(PerUserUpdateProcessor(MAX_CONCURRENT_UPDATES))
+        # user_data и состояния диалогов переживают рестарт (незавершённые подтверждения еды и т.п.)
+        .persistence(SQLitePersistence())
+        .post_init(post_init)
+        .build()
+    )
 
     # Регистрация всех обработчиков (ВАЖЕН ПОРЯДОК!)
+    app.add_handler(TypeHandler(Update, log_first_update), group=-1)
     
     # 1. Сначала ConversationHandler'ы
     app.add_handler(conv_handler)          # регистрация
@@ -70,58 +111,37 @@ def main():
     # 2. Потом обычные обработчики
     app.add_handler(profile_handler)       # просмотр профиля
     app.add_handler(stats_handler)         # статистика
-    
-    # 3. Обработчики редактирования профиля
-    app.add_handler(edit_profile_handler)
-    app.add_handler(edit_name_handler)
-    app.add_handler(edit_weight_handler)
-    app.add_handler(edit_height_handler)
-    app.add_handler(edit_age_handler)
-    app.add_handler(edit_gender_handler)
-    app.add_handler(edit_activity_handler)
-    app.add_handler(edit_goal_handler)
-    
-    # 4. Обработчики кнопок
-    app.add_handler(set_gender_male_handler)
-    app.add_handler(set_gender_female_handler)
-    app.add_handler(set_activity_none_handler)
-    app.add_handler(set_activity_low_handler)
-    app.add_handler(set_activity_medium_handler)
-    app.add_handler(set_activity_high_handler)
-    app.add_handler(set_goal_maintain_handler)
-    app.add_handler(set_goal_lose_handler)
-    app.add_handler(set_goal_gain_handler)
-    app.add_handler(set_rate_lose_slow_handler)
-    app.add_handler(set_rate_lose_medium_handler)
-    app.add_handler(set_rate_lose_fast_handler)
-    app.add_handler(set_rate_gain_slow_handler)
-    app.add_handler(set_rate_gain_medium_handler)
-    app.add_handler(set_rate_gain_fast_handler)
-    app.add_handler(toggle_notifications_handler)
+
+    # 3. Inline-кнопки профиля, статистики и настроек — один роутер.
+    # Стоит там же, где раньше были их отдельные обработчики: до диалогов меню и
+    # напоминаний, иначе их "ловушки" (choose_meals без pattern, ".*") перехватывают эти кнопки
+    app.add_handler(callback_router_handler)
+
     app.add_handler(settings_handler)
     app.add_handler(generate_menu_conv)
     app.add_handler(meal_reminders_conv)
 
-    # 5. Обработчики графиков
-    app.add_handler(CallbackQueryHandler(show_goal_chart, pattern="goal_chart"))
-    app.add_handler(CallbackQueryHandler(show_current_progress, pattern="current_progress"))
-    
-    # 6. Остальные обработчики
-    app.add_handler(confirm_handler)
-    app.add_handler(retry_handler)
-    app.add_handler(last_7_days_handler)
-    app.add_handler(clear_today_handler)
+    # 4. Остальные обработчики
     app.add_handler(voice_message_handler)
 
-    # 7. Обработчики текста (В САМОМ КОНЦЕ!)
+    # 5. Обработчики текста (В САМОМ КОНЦЕ!)
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_all_text_input))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, fallback_handler))
 
-    # 8. Обработчик ошибок
+    # 6. Обработчик ошибок
     app.add_error_handler(error_handler)
+    # Время каждого обработчика — в структурный лог (событие "handler")
+    instrument_handlers(app)
     setup_scheduler(app)
 
-    logger.info("Handlers registered, bot running...")
-    app.run_polling()
+    logger.info(f"Handlers registered, bot running ({BOT_MODE})...")
+    try:
+        if BOT_MODE == "webhook":
+            from bot.webhook import run_webhook
+            run_webhook(app)
+        else:
+            app.run_polling()
+    finally:
+        shutdown_chart_pool()
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,99 @@
+"""Сравнение поиска обработчика inline-кнопки: ~30 CallbackQueryHandler с регулярками против CallbackRouter.
+
+Запуск из корня репозитория:
+    python tools/callback_dispatch_bench.py
+    python tools/callback_dispatch_bench.py --rounds 50000
+
+Меряется только выбор обработчика (check_update, как это делает Application
+для группы 0), без вызова самих callback'ов и без сети.
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# config.config требует токен при импорте; в Telegram никто не ходит
+os.environ.setdefault("TELEGRAM_TOKEN", "0:bench")
+
+from telegram import CallbackQuery, Update, User  # noqa: E402
+from telegram.ext import CallbackQueryHandler  # noqa: E402
+
+from bot.handlers import callback_router  # noqa: E402
+
+# Обработчики кнопок вне диалогов в порядке регистрации до роутера
+LEGACY_PATTERNS = [
+    "edit_profile", "edit_name", "edit_weight", "edit_height", "edit_age",
+    "edit_gender", "edit_activity", "edit_goal",
+    "set_gender_male", "set_gender_female",
+    "set_activity_none", "set_activity_low", "set_activity_medium", "set_activity_high",
+    "set_goal_maintain", "set_goal_lose", "set_goal_gain",
+    "set_rate_lose_slow", "set_rate_lose_medium", "set_rate_lose_fast",
+    "set_rate_gain_slow", "set_rate_gain_medium", "set_rate_gain_fast",
+    "toggle_notifications", "goal_chart", "current_progress",
+    "^confirm_meal$", "^retry_meal$", "^last_7_days$", "^clear_today$",
+]
+
+# (старая callback_data, новая) — от первых обработчиков в списке до последних
+SAMPLES = [
+    ("edit_profile", "profile:edit"),
+    ("set_gender_female", "profile:set_gender:female"),
+    ("set_rate_gain_fast", "profile:set_rate:gain_fast"),
+    ("toggle_notifications", "settings:notifications"),
+    ("last_7_days", "stats:week"),
+    ("clear_today", "stats:clear_today"),
+]
+
+
+async def _noop(update, context):
+    pass
+
+
+def _update(data: str) -> Update:
+    user = User(id=1, first_name="bench", is_bot=False)
+    return Update(update_id=1, callback_query=CallbackQuery(id="1", from_user=user, chat_instance="1", data=data))
+
+
+def _first_match(handlers, update):
+    for handler in handlers:
+        check = handler.check_update(update)
+        if check is not None and check is not False:
+            return handler
+    return None
+
+
+def bench(handlers, updates, rounds: int) -> float:
+    """Среднее время выбора обработчика на один апдейт, мкс"""
+    for update in updates:
+        assert _first_match(handlers, update) is not None, update.callback_query.data
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for update in updates:
+            _first_match(handlers, update)
+    return (time.perf_counter() - started) / (rounds * len(updates)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=20000)
+    args = parser.parse_args()
+
+    legacy = [CallbackQueryHandler(_noop, pattern=p) for p in LEGACY_PATTERNS]
+    router = [callback_router.handler()]
+
+    print(f"{len(legacy)} regex handlers vs 1 router handler, {args.rounds} rounds x {len(SAMPLES)} buttons\n")
+    print(f"  {'callback_data':<30}{'regex':>10}{'router':>10}   (us per update)")
+    for old, new in SAMPLES:
+        regex_us = bench(legacy, [_update(old)], args.rounds)
+        router_us = bench(router, [_update(new)], args.rounds)
+        alias_us = bench(router, [_update(old)], args.rounds)
+        print(f"  {old:<30}{regex_us:>10.2f}{router_us:>10.2f}   (old data via alias: {alias_us:.2f})")
+
+    regex_us = bench(legacy, [_update(old) for old, _ in SAMPLES], args.rounds)
+    router_us = bench(router, [_update(new) for _, new in SAMPLES], args.rounds)
+    print(f"\n  {'mean':<30}{regex_us:>10.2f}{router_us:>10.2f}   x{regex_us / router_us:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Подготовка данных месячного графика: построчные словари + strptime против колонок SQL + numpy.bincount.
+
+Запуск из корня репозитория:
+    python tools/chart_data_bench.py
+    python tools/chart_data_bench.py --meals-per-day 5 20 100 --repeat 50
+
+База временная (копия схемы из init_db); данные — один пользователь с
+meals-per-day приёмами пищи в каждый из последних 30 дней.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# config.config требует токен при импорте; в Telegram никто не ходит
+os.environ.setdefault("TELEGRAM_TOKEN", "0:bench")
+
+from bot import database  # noqa: E402
+from bot.charts import daily_calories  # noqa: E402
+
+USER_ID = 1
+
+
+def before(user_id: int, start_date) -> list:
+    """Прежний путь: get_meals_last_30_days, группировка словарём с разбором даты каждой строки"""
+    totals = {}
+    for meal in database.get_meals_last_30_days(user_id):
+        day = datetime.strptime(meal['timestamp'].split()[0], "%Y-%m-%d").date()
+        totals[day] = totals.get(day, 0) + meal['calories']
+    return [totals.get(start_date + timedelta(days=i), 0) for i in range(30)]
+
+
+def fill(meals_per_day: int):
+    conn = sqlite3.connect(database.DATABASE_PATH)
+    conn.execute("DELETE FROM meals")
+    now = datetime.now()
+    rows = []
+    for day in range(30):
+        for _ in range(meals_per_day):
+            ts = (now - timedelta(days=day, minutes=random.randint(0, 600))).strftime("%Y-%m-%d %H:%M:%S")
+            rows.append((USER_ID, "еда", round(random.uniform(50, 900), 1), ts))
+    conn.executemany("INSERT INTO meals (user_id, food_text, calories, timestamp) VALUES (?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+
+def timed(fn, repeat: int) -> float:
+    """Медиана, мс"""
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - started) * 1000)
+    times.sort()
+    return times[len(times) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--meals-per-day", type=int, nargs="+", default=[5, 20, 100])
+    parser.add_argument("--repeat", type=int, default=30)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DATABASE_PATH = os.path.join(tmp, "bench.db")
+        database.init_db()
+        start_date = datetime.now().date() - timedelta(days=29)
+
+        print(f"{'meals/day':>10}{'rows':>8}{'before':>11}{'after':>11}{'speedup':>9}")
+        for per_day in args.meals_per_day:
+            fill(per_day)
+            old = before(USER_ID, start_date)
+            new = daily_calories(USER_ID, start_date)
+            # прежний запрос берёт окно date('now', '-30 days') в UTC — сравниваем только общие дни
+            assert all(abs(a - b) < 1e-6 for a, b in zip(old[1:-1], new[1:-1])), "results differ"
+            old_ms = timed(lambda: before(USER_ID, start_date), args.repeat)
+            new_ms = timed(lambda: daily_calories(USER_ID, start_date), args.repeat)
+            print(f"{per_day:>10}{per_day * 30:>8}{old_ms:>9.2f}ms{new_ms:>9.2f}ms{old_ms / new_ms:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Сравнение рендереров месячного графика: matplotlib против Pillow (CHART_MONTHLY_RENDERER).
+
+Запуск из корня репозитория:
+    python tools/chart_renderer_bench.py
+    python tools/chart_renderer_bench.py --renders 50
+
+Каждый рендерер меряется в отдельном чистом процессе, как воркер пула:
+импорт модуля, первый график, медиана повторных и пиковая память процесса.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RENDERERS = {
+    "matplotlib": "bot.chart_render.render_monthly_chart",
+    "pillow": "bot.chart_render_pil.render_monthly_chart",
+}
+
+
+def child(renderer: str, renders: int):
+    """Замер внутри отдельного процесса; результат — JSON в stdout"""
+    sys.path.insert(0, ROOT)
+
+    started = time.perf_counter()
+    from bot.chart_worker import init_worker, render
+    init_worker(renderer)
+    import_ms = (time.perf_counter() - started) * 1000
+
+    start = date.today() - timedelta(days=29)
+    dates = [start + timedelta(days=i) for i in range(30)]
+    times, size = [], 0
+    for _ in range(renders + 1):
+        calories = [random.uniform(1200, 3200) for _ in dates]
+        started = time.perf_counter()
+        size = len(render(renderer, dates, calories))
+        times.append((time.perf_counter() - started) * 1000)
+
+    print(json.dumps({
+        "import_ms": import_ms,
+        "first_ms": times[0],
+        "median_ms": statistics.median(times[1:]),
+        "png_kb": size / 1024,
+        "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "matplotlib_loaded": "matplotlib" in sys.modules,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--renders", type=int, default=20)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.renders)
+        return
+
+    print(f"{'renderer':<12}{'import':>10}{'first':>10}{'median':>10}{'png':>9}{'peak RSS':>11}  matplotlib loaded")
+    for name, renderer in RENDERERS.items():
+        proc = subprocess.run(
+            [sys.executable, __file__, "--child", renderer, "--renders", str(args.renders)],
+            cwd=ROOT, capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            raise SystemExit(f"{name} failed:\n{proc.stderr}")
+        r = json.loads(proc.stdout.strip().splitlines()[-1])
+        print(f"{name:<12}{r['import_ms']:>8.0f}ms{r['first_ms']:>8.0f}ms{r['median_ms']:>8.1f}ms"
+              f"{r['png_kb']:>7.0f}KB{r['rss_mb']:>9.0f}MB  {r['matplotlib_loaded']}")
+
+
+if __name__ == "__main__":
+    main()
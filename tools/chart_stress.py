@@ -0,0 +1,129 @@
+"""Стресс-тест пула отрисовки графиков: сотни графиков параллельно, с замером памяти.
+
+Запуск из корня репозитория (Linux: память читается из /proc):
+    python tools/chart_stress.py
+    python tools/chart_stress.py --charts 500 --rounds 5 --kind goal
+    python tools/chart_stress.py --max-pending 50      # проверить отказ при переполнении очереди
+    CHART_EXECUTOR=thread CHART_WORKERS=4 python tools/chart_stress.py
+
+Графики идут через bot.charts._render, как из обработчиков, с кэшем PNG,
+поэтому данные у каждого графика свои — кэш не срабатывает. Очередь
+CHART_MAX_PENDING на время теста поднимается до --charts, чтобы отрисовались
+все графики; отказы ChartRendererBusy считаются ошибкой (код выхода 1). После каждого раунда
+печатается RSS основного процесса и воркеров: рост от раунда к раунду
+означает утечку (например, незакрытые фигуры matplotlib).
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# config.config требует токен при импорте; в Telegram никто не ходит
+os.environ.setdefault("TELEGRAM_TOKEN", "0:stress")
+# событие "chart" на каждый график — сотни строк в консоли; итог печатаем сами
+os.environ.setdefault("LOG_MODULE_LEVELS", "charts=WARNING")
+PAGE_MB = os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+
+def rss_mb(pid: int) -> float:
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * PAGE_MB
+    except OSError:
+        return 0.0
+
+
+def memory(charts) -> tuple:
+    """(RSS основного процесса, сумма RSS воркеров пула) в МБ"""
+    pool = charts._pool
+    workers = getattr(pool, "_processes", None) or {}
+    return rss_mb(os.getpid()), sum(rss_mb(pid) for pid in workers)
+
+
+def chart_args(charts, kind: str):
+    if kind == "goal":
+        start = date.today()
+        weights = [90 - 0.5 * i + random.random() for i in range(40)]
+        return charts.GOAL_PROGRESS_CHART, [start + timedelta(weeks=i) for i in range(40)], weights, 90.0, 70.0, "lose"
+    start = date.today() - timedelta(days=29)
+    renderer = charts.MONTHLY_CHART_PIL if kind == "pillow" else charts.MONTHLY_CHART
+    return renderer, [start + timedelta(days=i) for i in range(30)], [random.uniform(1200, 3200) for _ in range(30)]
+
+
+async def run_round(charts, count: int, kind: str):
+    peak = [0.0, 0.0]
+
+    async def sampler():
+        while True:
+            main_mb, workers_mb = memory(charts)
+            peak[0], peak[1] = max(peak[0], main_mb), max(peak[1], workers_mb)
+            await asyncio.sleep(0.05)
+
+    async def one():
+        started = time.perf_counter()
+        try:
+            await charts._render(*chart_args(charts, kind))
+        except charts.ChartRendererBusy:
+            return None
+        return time.perf_counter() - started
+
+    sampling = asyncio.create_task(sampler())
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one() for _ in range(count)))
+    elapsed = time.perf_counter() - started
+    sampling.cancel()
+
+    latencies = sorted(r for r in results if r is not None)
+    busy = count - len(latencies)
+    p = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))] if latencies else 0.0
+    main_mb, workers_mb = memory(charts)
+    print(f"  {len(latencies):4d} rendered, {elapsed:6.2f}s, "
+          f"{len(latencies) / elapsed:5.1f} charts/s, p50 {p(0.5):5.2f}s p99 {p(0.99):5.2f}s | "
+          f"RSS main {main_mb:5.0f}MB (peak {peak[0]:4.0f}), workers {workers_mb:5.0f}MB (peak {peak[1]:4.0f})")
+    if busy:
+        print(f"  FAIL {busy} charts rejected with ChartRendererBusy")
+    return busy
+
+
+async def main_async(args):
+    from bot import charts
+    from config.config import CHART_EXECUTOR, CHART_MAX_PENDING, CHART_WORKERS
+
+    print(f"{args.charts} x {args.kind} charts per round, {CHART_WORKERS} {CHART_EXECUTOR} workers, "
+          f"max pending {CHART_MAX_PENDING}")
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, charts.warm_chart_pool)
+    await asyncio.sleep(1)
+    main_mb, workers_mb = memory(charts)
+    print(f"  warm pool: RSS main {main_mb:.0f}MB, workers {workers_mb:.0f}MB")
+    busy = 0
+    try:
+        for _ in range(args.rounds):
+            busy += await run_round(charts, args.charts, args.kind)
+    finally:
+        charts.shutdown_chart_pool()
+    return busy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--charts", type=int, default=200, help="графиков за раунд, запускаются одновременно")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--kind", choices=("monthly", "pillow", "goal"), default="monthly")
+    parser.add_argument("--max-pending", type=int,
+                        help="CHART_MAX_PENDING на время теста (по умолчанию — не меньше --charts)")
+    args = parser.parse_args()
+    if args.max_pending is None:
+        args.max_pending = max(args.charts, int(os.environ.get("CHART_MAX_PENDING", "0")))
+    os.environ["CHART_MAX_PENDING"] = str(args.max_pending)
+    busy = asyncio.run(main_async(args))
+    sys.exit(1 if busy else 0)
+
+
+if __name__ == "__main__":
+    main()
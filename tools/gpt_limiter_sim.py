@@ -0,0 +1,112 @@
+"""Симуляция адаптивного лимита GPT (AdaptiveConcurrencyLimiter) против бэкенда с переменной задержкой.
+
+Запуск из корня репозитория:
+    python tools/gpt_limiter_sim.py
+    python tools/gpt_limiter_sim.py --clients 60 --capacity 15 --duration 20
+
+Время ужато: цель задержки и задержки бэкенда — доли секунды, пропорции
+как у настоящего YandexGPT (цель GPT_LATENCY_TARGET, ответ ~ в пару раз быстрее).
+
+Сценарии:
+  burst — limit запросов одновременно чуть медленнее цели (одно окно перегрузки):
+          лимит должен снизиться один раз, а не по разу на каждый ответ;
+  load  — clients клиентов шлют запросы без пауз; бэкенд держит capacity
+          одновременных запросов, сверх этого задержка растёт линейно.
+          Печатается лимит по времени, пропускная способность и перцентили задержки.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# config.config требует токен при импорте; в Telegram никто не ходит
+os.environ.setdefault("TELEGRAM_TOKEN", "0:sim")
+
+from bot.rate_limiter import AdaptiveConcurrencyLimiter  # noqa: E402
+from config.config import CONCURRENT_GPT_MIN, CONCURRENT_GPT_MAX, GPT_LIMIT_BACKOFF  # noqa: E402
+
+
+def _limiter(initial: int, target: float) -> AdaptiveConcurrencyLimiter:
+    return AdaptiveConcurrencyLimiter(
+        initial=initial, min_limit=CONCURRENT_GPT_MIN, max_limit=CONCURRENT_GPT_MAX,
+        latency_target=target, backoff=GPT_LIMIT_BACKOFF,
+    )
+
+
+async def burst(initial: int, target: float):
+    limiter = _limiter(initial, target)
+
+    async def call():
+        async with limiter.slot():
+            await asyncio.sleep(target * 1.05)
+
+    await asyncio.gather(*(call() for _ in range(initial)))
+    print(f"burst: {initial} concurrent calls at 1.05 x target -> limit {initial} -> {int(limiter.limit)}")
+
+
+async def load(clients: int, capacity: int, initial: int, target: float, duration: float):
+    limiter = _limiter(initial, target)
+    base = target / 2
+    backend = {"in_flight": 0}
+    latencies, errors = [], 0
+    deadline = time.monotonic() + duration
+
+    async def backend_call():
+        backend["in_flight"] += 1
+        try:
+            overload = max(0, backend["in_flight"] - capacity) / capacity
+            await asyncio.sleep(base * (1 + 2 * overload) * random.uniform(0.8, 1.2))
+            if overload > 1 and random.random() < 0.2:
+                raise RuntimeError("backend overloaded")
+        finally:
+            backend["in_flight"] -= 1
+
+    async def client():
+        nonlocal errors
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            try:
+                async with limiter.slot():
+                    await backend_call()
+            except RuntimeError:
+                errors += 1
+            latencies.append(time.monotonic() - started)
+
+    async def monitor():
+        step = duration / 10
+        while time.monotonic() < deadline:
+            await asyncio.sleep(step)
+            print(f"  t={duration - (deadline - time.monotonic()):5.1f}s  limit={int(limiter.limit):3d}  "
+                  f"in_flight={limiter.in_flight:3d}  backend={backend['in_flight']:3d}")
+
+    print(f"load: {clients} clients, backend capacity {capacity}, target {target:.2f}s, initial limit {initial}")
+    await asyncio.gather(monitor(), *(client() for _ in range(clients)))
+    latencies.sort()
+    p = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))]
+    print(f"  {len(latencies) / duration:.0f} req/s, errors {errors}, "
+          f"latency p50 {p(0.5):.3f}s p95 {p(0.95):.3f}s (incl. queueing), final limit {int(limiter.limit)}")
+
+
+async def run(args):
+    await burst(args.initial, args.target)
+    print()
+    await load(args.clients, args.capacity, args.initial, args.target, args.duration)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--capacity", type=int, default=12, help="одновременных запросов без деградации бэкенда")
+    parser.add_argument("--initial", type=int, default=20)
+    parser.add_argument("--target", type=float, default=0.2, help="цель задержки, сек (ужатое время)")
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Отчёт по времени импорта модулей бота (разбор вывода `python -X importtime`).
+
+Запуск из корня репозитория:
+    python tools/importtime_report.py                 # import main, топ-25
+    python tools/importtime_report.py bot.handlers --top 40 --repeat 5
+
+Импорт выполняется в отдельном процессе несколько раз; для каждого модуля
+берётся минимум по запускам (первый запуск обычно включает компиляцию .pyc).
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+LINE_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_importtime(module: str) -> dict:
+    """{модуль: (self мкс, cumulative мкс, глубина)} для одного запуска"""
+    env = dict(os.environ)
+    # config.config требует токен при импорте; в Telegram при импорте никто не ходит
+    env.setdefault("TELEGRAM_TOKEN", "0:importtime")
+    env["PYTHONPATH"] = os.pathsep.join(p for p in (ROOT, env.get("PYTHONPATH")) if p)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        tail = "\n".join(l for l in proc.stderr.splitlines() if not l.startswith("import time:"))
+        raise SystemExit(f"import {module} failed:\n{tail}")
+
+    result = {}
+    for line in proc.stderr.splitlines():
+        m = LINE_RE.match(line)
+        if m:
+            self_us, cumulative_us, indent, name = m.groups()
+            result[name] = (int(self_us), int(cumulative_us), len(indent) // 2)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("module", nargs="?", default="main")
+    parser.add_argument("--top", type=int, default=25)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    runs = [run_importtime(args.module) for _ in range(max(1, args.repeat))]
+    best = {}
+    for name in runs[-1]:
+        samples = [r[name] for r in runs if name in r]
+        best[name] = (min(s[0] for s in samples), min(s[1] for s in samples), samples[0][2])
+
+    total = best.get(args.module, (0, 0, 0))[1]
+    print(f"import {args.module}: {total / 1000:.0f} ms (min of {len(runs)} runs, {len(best)} modules)\n")
+
+    print(f"Top {args.top} by cumulative time:")
+    for name, (self_us, cum_us, depth) in sorted(best.items(), key=lambda kv: -kv[1][1])[:args.top]:
+        print(f"  {cum_us / 1000:8.1f} ms  {self_us / 1000:7.1f} ms self  {'  ' * min(depth, 6)}{name}")
+
+    packages = defaultdict(int)
+    for name, (self_us, _, _) in best.items():
+        packages[name.split(".")[0]] += self_us
+    print(f"\nTop {args.top} packages by own import time:")
+    for package, self_us in sorted(packages.items(), key=lambda kv: -kv[1])[:args.top]:
+        print(f"  {self_us / 1000:8.1f} ms  {package}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Сводка по структурным (JSON) логам бота: перцентили времени обработчиков, GPT, кэш графиков.
+
+Запуск из корня репозитория:
+    python tools/log_stats.py                       # LOG_DIR/bot*.log* (включая логи шардов)
+    python tools/log_stats.py logs/bot.shard*.log --since 2025-01-01T10:00
+
+События с sample_rate < 1 учитываются с весом 1/sample_rate, поэтому
+количества и перцентили не искажаются выборкой (медленные и упавшие
+вызовы пишутся всегда, быстрые — долей LOG_SAMPLE_RATE).
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# config.config требует токен при импорте; в Telegram никто не ходит
+os.environ.setdefault("TELEGRAM_TOKEN", "0:log-stats")
+
+from config.config import LOG_DIR  # noqa: E402
+
+PERCENTILES = (50, 90, 99)
+
+
+def read_events(paths, since: str = None):
+    """JSON-строки логов; текстовые строки (LOG_FILE_FORMAT=text, старые логи) пропускаются"""
+    for path in paths:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                if not line.startswith("{"):
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if "event" not in record or (since and record.get("ts", "") < since):
+                    continue
+                yield record
+
+
+def weighted_percentiles(samples, percentiles=PERCENTILES):
+    """samples — [(значение, вес)]"""
+    samples = sorted(samples)
+    total = sum(w for _, w in samples)
+    result = []
+    for p in percentiles:
+        threshold = total * p / 100
+        acc = 0.0
+        for value, weight in samples:
+            acc += weight
+            if acc >= threshold:
+                result.append(value)
+                break
+    return result
+
+
+def _weight(record) -> float:
+    rate = record.get("sample_rate") or 1.0
+    return 1.0 / rate if rate > 0 else 1.0
+
+
+def _latency_table(title: str, groups: dict, errors: dict):
+    if not groups:
+        return
+    header = "".join(f"{'p' + str(p):>9}" for p in PERCENTILES)
+    print(f"\n{title}")
+    print(f"  {'name':<32}{'count':>9}{'errors':>8}{header}{'max':>9}   (ms)")
+    rows = sorted(groups.items(), key=lambda kv: -sum(w for _, w in kv[1]))
+    for name, samples in rows:
+        count = sum(w for _, w in samples)
+        values = "".join(f"{v:>9.0f}" for v in weighted_percentiles(samples))
+        print(f"  {str(name)[:32]:<32}{count:>9.0f}{errors.get(name, 0):>8.0f}{values}{max(v for v, _ in samples):>9.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="*", help="файлы логов (по умолчанию LOG_DIR/bot*.log*)")
+    parser.add_argument("--since", help="только записи не раньше этого времени (ISO, как поле ts)")
+    args = parser.parse_args()
+
+    paths = args.paths or sorted(glob.glob(os.path.join(LOG_DIR, "bot*.log*")), reverse=True)
+    if not paths:
+        raise SystemExit("Нет файлов логов")
+
+    handlers, handler_errors = defaultdict(list), defaultdict(float)
+    gpt, gpt_errors, gpt_tokens = defaultdict(list), defaultdict(float), defaultdict(int)
+    charts = defaultdict(lambda: defaultdict(float))
+    events = 0
+    for record in read_events(paths, args.since):
+        events += 1
+        event, weight = record["event"], _weight(record)
+        latency = record.get("latency_ms")
+        if event == "handler" and latency is not None:
+            name = record.get("handler", "?")
+            handlers[name].append((latency, weight))
+            if not record.get("ok", True):
+                handler_errors[name] += weight
+        elif event == "gpt" and latency is not None:
+            name = record.get("call", "?")
+            gpt[name].append((latency, weight))
+            if record.get("status") != 200:
+                gpt_errors[name] += weight
+            gpt_tokens[name] += (record.get("gpt_tokens") or 0) * weight
+        elif event == "chart":
+            charts[record.get("chart", "?")][str(record.get("cache_hit"))] += weight
+
+    print(f"{events} events from {len(paths)} files")
+    _latency_table("Handlers", handlers, handler_errors)
+    _latency_table("YandexGPT calls", gpt, gpt_errors)
+    if gpt_tokens:
+        print("  tokens: " + ", ".join(f"{name}={tokens:.0f}" for name, tokens in sorted(gpt_tokens.items())))
+    if charts:
+        print("\nCharts (cache_hit: count)")
+        for name, hits in sorted(charts.items()):
+            total = sum(hits.values())
+            cached = total - hits.get("False", 0)
+            summary = ", ".join(f"{k}={v:.0f}" for k, v in sorted(hits.items()))
+            print(f"  {name:<32} {summary}  (hit rate {cached / total:.0%})")
+
+
+if __name__ == "__main__":
+    main()
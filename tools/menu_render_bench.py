@@ -0,0 +1,116 @@
+"""Отрисовка картинки меню: прежний перенос строк (замер всей строки на каждое слово) против текущего.
+
+Запуск из корня репозитория:
+    python tools/menu_render_bench.py
+    python tools/menu_render_bench.py --repeat 50
+
+Меряется перенос текста ячеек разной длины и вся отрисовка
+render_menu_to_image (без кэша ширин слов и с ним).
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# config.config требует токен при импорте; в Telegram никто не ходит
+os.environ.setdefault("TELEGRAM_TOKEN", "0:bench")
+# строка в лог на каждую картинку — в консоли только итог
+os.environ.setdefault("LOG_MODULE_LEVELS", "utils=WARNING")
+
+from bot import utils  # noqa: E402
+
+WORDS = ("гречка", "отварная", "куриное", "филе", "на", "пару", "с", "овощами", "и", "соусом",
+         "творог", "5%", "ягоды", "овсянка", "на", "молоке", "банан", "цельнозерновой", "хлеб")
+
+
+def wrap_before(text, fnt, max_width):
+    """Прежний перенос: ширина всей накопленной строки через getbbox на каждое слово"""
+    def text_width(txt):
+        bbox = fnt.getbbox(str(txt))
+        return bbox[2] - bbox[0]
+
+    lines = []
+    for paragraph in str(text).split("\n"):
+        cur = ""
+        for w in paragraph.split(" "):
+            test = w if cur == "" else cur + " " + w
+            if text_width(test) <= max_width:
+                cur = test
+            else:
+                if cur:
+                    lines.append(cur)
+                if text_width(w) > max_width:
+                    part = ""
+                    for ch in w:
+                        if text_width(part + ch) <= max_width:
+                            part += ch
+                        else:
+                            if part:
+                                lines.append(part)
+                            part = ch
+                    cur = part
+                else:
+                    cur = w
+        if cur:
+            lines.append(cur)
+    return lines or [""]
+
+
+def sample_text(words: int) -> str:
+    return " ".join(random.choice(WORDS) for _ in range(words))
+
+
+def sample_menu(meals: int = 5, items: int = 4) -> dict:
+    return {"meals": [
+        {"name": f"Приём {m + 1}", "items": [
+            {"product": sample_text(random.randint(2, 12)), "quantity": f"{random.randint(50, 300)} г",
+             "calories": random.randint(50, 500), "protein": 10, "fat": 5, "carbs": 20}
+            for _ in range(items)
+        ]}
+        for m in range(meals)
+    ]}
+
+
+def timed(fn, repeat: int) -> float:
+    """Медиана, мс"""
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - started) * 1000)
+    times.sort()
+    return times[len(times) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=30)
+    args = parser.parse_args()
+
+    font = utils.get_menu_font(16)
+    width = 480   # колонка "Продукт" при ширине картинки 1000
+
+    print(f"{'words':>7}{'before':>11}{'after':>11}{'speedup':>9}   (wrap one cell)")
+    for words in (10, 50, 200, 1000):
+        text = sample_text(words)
+        assert wrap_before(text, font, width) == utils.wrap_text_to_width(text, font, width), "wrapping differs"
+        old_ms = timed(lambda: wrap_before(text, font, width), args.repeat)
+        new_ms = timed(lambda: utils.wrap_text_to_width(text, font, width), args.repeat)
+        print(f"{words:>7}{old_ms:>9.3f}ms{new_ms:>9.3f}ms{old_ms / new_ms:>8.1f}x")
+
+    menu = sample_menu()
+
+    def cold():
+        utils._word_widths.clear()
+        utils.render_menu_to_image(menu, 0)
+
+    print(f"\nrender_menu_to_image (5 meals x 4 items): "
+          f"cold width cache {timed(cold, args.repeat):.1f}ms, "
+          f"warm {timed(lambda: utils.render_menu_to_image(menu, 0), args.repeat):.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
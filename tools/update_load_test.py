@@ -0,0 +1,106 @@
+"""Нагрузочная проверка PerUserUpdateProcessor: один «нетерпеливый» пользователь против остальных.
+
+Запуск из корня репозитория:
+    python tools/update_load_test.py
+    python tools/update_load_test.py --slots 16 --spam 100 --users 200
+
+Один пользователь шлёт spam апдейтов подряд, каждый обрабатывается долго
+(как запрос к GPT); одновременно users других пользователей шлют по одному
+быстрому апдейту. Апдейты подаются так же, как это делает Application:
+задача на каждый апдейт в порядке получения. Сравнивается текущий процессор
+с вариантом, где замок пользователя берётся уже внутри общего семафора.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# config.config требует токен при импорте; в Telegram никто не ходит
+os.environ.setdefault("TELEGRAM_TOKEN", "0:loadtest")
+
+from telegram import Chat, Message, Update, User  # noqa: E402
+from telegram.ext import BaseUpdateProcessor  # noqa: E402
+
+from bot.update_processor import PerUserUpdateProcessor  # noqa: E402
+
+
+class LockInsideSemaphore(BaseUpdateProcessor):
+    """Прежний вариант: общий слот занимается ещё до очереди пользователя"""
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._locks = defaultdict(asyncio.Lock)
+
+    async def do_process_update(self, update, coroutine):
+        async with self._locks[update.effective_user.id]:
+            await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+def _update(update_id: int, user_id: int) -> Update:
+    user = User(id=user_id, first_name="load", is_bot=False)
+    chat = Chat(id=user_id, type="private")
+    return Update(update_id=update_id, message=Message(update_id, datetime.now(), chat, from_user=user, text="x"))
+
+
+async def run(processor_cls, slots: int, spam: int, users: int, slow: float, fast: float):
+    processor = processor_cls(slots)
+    started = time.monotonic()
+    latencies = []
+    order = []
+
+    async def handle(update: Update, duration: float):
+        await asyncio.sleep(duration)
+        if update.effective_user.id == 1:
+            order.append(update.update_id)
+        else:
+            latencies.append(time.monotonic() - started)
+
+    tasks = []
+    update_id = 0
+    for _ in range(spam):
+        update_id += 1
+        update = _update(update_id, 1)
+        tasks.append(asyncio.create_task(processor.process_update(update, handle(update, slow))))
+    for user_id in range(2, users + 2):
+        update_id += 1
+        update = _update(update_id, user_id)
+        tasks.append(asyncio.create_task(processor.process_update(update, handle(update, fast))))
+
+    await asyncio.wait_for(asyncio.gather(*tasks), timeout=spam * slow + 30)
+    assert order == sorted(order), "order of one user's updates is broken"
+    latencies.sort()
+    p = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))]
+    print(f"  {processor_cls.__name__:<24} other users: p50 {p(0.5):6.2f}s  p99 {p(0.99):6.2f}s  max {latencies[-1]:6.2f}s")
+
+
+async def main_async(args):
+    print(f"{args.slots} slots, user 1 sends {args.spam} updates x {args.slow}s, "
+          f"{args.users} other users send 1 update x {args.fast}s")
+    for processor_cls in (PerUserUpdateProcessor, LockInsideSemaphore):
+        await run(processor_cls, args.slots, args.spam, args.users, args.slow, args.fast)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--slots", type=int, default=8, help="max_concurrent_updates")
+    parser.add_argument("--spam", type=int, default=20)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--slow", type=float, default=0.2, help="сек на апдейт нетерпеливого пользователя")
+    parser.add_argument("--fast", type=float, default=0.01)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
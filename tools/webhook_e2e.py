@@ -0,0 +1,286 @@
+"""Сквозная проверка webhook-режима на фейковом Bot API: POST апдейта -> обработчик -> ответ.
+
+Запуск из корня репозитория:
+    python tools/webhook_e2e.py
+    python tools/webhook_e2e.py --updates 200
+
+Поднимает фейковый Bot API (aiohttp TestServer) и приложение с
+bot.webhook.create_webhook_app под aiohttp TestClient; обработчик отвечает
+sendMessage. Проверяются секрет (403), битый JSON (400), /healthz, доставка
+каждого апдейта и порядок ответов одному пользователю.
+
+Затем два шарда (SHARD_COUNT=2) в отдельных процессах через serve_webhook:
+все апдейты приходят на шард 0, апдейты пользователей шарда 1 должны
+переслаться и обработаться там ровно один раз; после остановки шарда 1
+его апдейты получают 503, чтобы Telegram повторил. Код выхода 1 при ошибке.
+"""
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# до импорта config.config: свой секрет; основной процесс — один шард,
+# процессы шардов (--shard) получают SHARD_* и адрес сервера от родителя
+os.environ.setdefault("TELEGRAM_TOKEN", "0:e2e")
+os.environ["WEBHOOK_SECRET"] = "e2e-secret"
+if "--shard" not in sys.argv:
+    os.environ["SHARD_COUNT"] = "1"
+    os.environ["SHARD_INDEX"] = "0"
+
+import aiohttp  # noqa: E402
+from aiohttp import web  # noqa: E402
+from aiohttp.test_utils import TestClient, TestServer  # noqa: E402
+from telegram.ext import Application, MessageHandler, filters  # noqa: E402
+
+from bot.sharding import user_bucket  # noqa: E402
+from bot.update_processor import PerUserUpdateProcessor  # noqa: E402
+from bot.webhook import SECRET_HEADER, create_webhook_app, serve_webhook  # noqa: E402
+from config.config import WEBHOOK_PATH  # noqa: E402
+
+SECRET = os.environ["WEBHOOK_SECRET"]
+
+
+def fake_bot_api(sent: list) -> web.Application:
+    async def api(request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        data = await request.json() if request.content_type == "application/json" else dict(await request.post())
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "e2e", "username": "e2e_bot"}
+        elif method == "sendMessage":
+            chat_id = int(data["chat_id"])
+            sent.append((chat_id, data["text"], time.perf_counter()))
+            result = {"message_id": len(sent), "date": 0, "chat": {"id": chat_id, "type": "private"}, "text": data["text"]}
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", api)
+    return app
+
+
+def update(update_id: int, user_id: int, text: str) -> dict:
+    user = {"id": user_id, "is_bot": False, "first_name": "u"}
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": 0, "chat": {"id": user_id, "type": "private"}, "from": user, "text": text,
+    }}
+
+
+def build_application(api_url: str, shard: int = None) -> Application:
+    """Приложение без Updater'а против фейкового Bot API; ответ помечается номером шарда"""
+    async def echo(update, context):
+        suffix = "" if shard is None else f":shard{shard}"
+        await context.bot.send_message(update.effective_chat.id, f"echo:{update.message.text}{suffix}")
+
+    application = (
+        Application.builder()
+        .token("123:e2e")
+        .base_url(api_url)
+        .updater(None)
+        .concurrent_updates(PerUserUpdateProcessor(32))
+        .build()
+    )
+    application.add_handler(MessageHandler(filters.TEXT, echo))
+    return application
+
+
+async def run(updates: int, users: int) -> list:
+    failures = []
+
+    def check(ok: bool, what: str):
+        print(f"  {'ok  ' if ok else 'FAIL'} {what}")
+        if not ok:
+            failures.append(what)
+
+    sent = []
+    async with TestServer(fake_bot_api(sent)) as api_server:
+        application = build_application(str(api_server.make_url("/bot")))
+        async with application:
+            await application.start()
+            async with TestClient(TestServer(create_webhook_app(application))) as client:
+                resp = await client.post("/telegram", json=update(1, 10, "x"), headers={SECRET_HEADER: "wrong"})
+                check(resp.status == 403, f"wrong secret -> {resp.status}")
+                resp = await client.post("/telegram", data="{not json", headers={SECRET_HEADER: SECRET})
+                check(resp.status == 400, f"broken JSON -> {resp.status}")
+                resp = await client.get("/healthz")
+                check(resp.status == 200 and (await resp.json())["shards"] == 1, f"/healthz -> {resp.status}")
+
+                posted = {}
+                started = time.perf_counter()
+                for n in range(updates):
+                    user_id = 1000 + n % users
+                    posted[f"echo:{n}"] = time.perf_counter()
+                    resp = await client.post("/telegram", json=update(100 + n, user_id, str(n)),
+                                             headers={SECRET_HEADER: SECRET})
+                    if resp.status != 200:
+                        check(False, f"update {n} -> {resp.status}")
+                        break
+
+                deadline = time.perf_counter() + 10
+                while len(sent) < updates and time.perf_counter() < deadline:
+                    await asyncio.sleep(0.01)
+                elapsed = time.perf_counter() - started
+            await application.stop()
+
+    check(len(sent) == updates, f"{len(sent)}/{updates} replies delivered")
+    check({text for _, text, _ in sent} == set(posted), "every update answered exactly once")
+    per_user = {}
+    for chat_id, text, _ in sent:
+        per_user.setdefault(chat_id, []).append(int(text.split(":")[1]))
+    check(all(v == sorted(v) for v in per_user.values()), f"replies in order for each of {len(per_user)} users")
+
+    latencies = sorted(ts - posted[text] for _, text, ts in sent if text in posted)
+    if latencies:
+        p = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000
+        print(f"\n  {updates} updates in {elapsed:.2f}s, POST -> sendMessage p50 {p(0.5):.1f}ms p99 {p(0.99):.1f}ms")
+    return failures
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_healthy(session: aiohttp.ClientSession, url: str, timeout: float = 30) -> bool:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            async with session.get(url + "/healthz") as resp:
+                if resp.status == 200:
+                    return True
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    return False
+
+
+async def stop_shard(proc):
+    if proc.returncode is None:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            await asyncio.wait_for(proc.wait(), 10)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+
+
+async def run_sharded(updates: int, users: int) -> list:
+    failures = []
+
+    def check(ok: bool, what: str):
+        print(f"  {'ok  ' if ok else 'FAIL'} {what}")
+        if not ok:
+            failures.append(what)
+
+    # поровну пользователей каждого шарда
+    user_ids, per_shard = [], Counter()
+    candidate = 1000
+    while len(user_ids) < max(2, users):
+        shard = user_bucket(candidate, 2)
+        if per_shard[shard] < (max(2, users) + 1) // 2:
+            user_ids.append(candidate)
+            per_shard[shard] += 1
+        candidate += 1
+    owner = {user_id: user_bucket(user_id, 2) for user_id in user_ids}
+
+    sent = []
+    ports = [free_port(), free_port()]
+    peers = [f"http://127.0.0.1:{port}" for port in ports]
+    async with TestServer(fake_bot_api(sent)) as api_server, aiohttp.ClientSession() as session:
+        procs, logs = [], []
+        for shard, port in enumerate(ports):
+            env = dict(os.environ, SHARD_COUNT="2", SHARD_INDEX=str(shard), SHARD_PEERS=",".join(peers),
+                       WEBHOOK_HOST="127.0.0.1", WEBHOOK_PORT=str(port), WEBHOOK_URL="")
+            log = tempfile.TemporaryFile()
+            logs.append(log)
+            procs.append(await asyncio.create_subprocess_exec(
+                sys.executable, __file__, "--shard", str(shard), "--api-url", str(api_server.make_url("/bot")),
+                env=env, cwd=ROOT, stdout=log, stderr=log,
+            ))
+        try:
+            healthy = [await wait_healthy(session, peer) for peer in peers]
+            check(all(healthy), f"both shards up: {healthy}")
+            if not all(healthy):
+                for shard, log in enumerate(logs):
+                    log.seek(0)
+                    print(f"--- shard {shard} output ---\n{log.read().decode(errors='replace')[-2000:]}")
+                return failures
+
+            posted = {}
+            for n in range(updates):
+                user_id = user_ids[n % len(user_ids)]
+                posted[f"echo:{n}"] = user_id
+                async with session.post(peers[0] + WEBHOOK_PATH, json=update(100 + n, user_id, str(n)),
+                                        headers={SECRET_HEADER: SECRET}) as resp:
+                    if resp.status != 200:
+                        check(False, f"update {n} for shard {owner[user_id]} -> {resp.status}")
+                        break
+
+            deadline = time.perf_counter() + 10
+            while len(sent) < updates and time.perf_counter() < deadline:
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.5)  # дубли пришли бы следом
+
+            replies = Counter(text.rsplit(":", 1)[0] for _, text, _ in sent)
+            check(len(sent) == updates, f"{len(sent)}/{updates} replies delivered")
+            check(set(replies) == set(posted) and set(replies.values()) == {1}, "every update answered exactly once")
+            wrong = [text for _, text, _ in sent
+                     if text.rsplit(":", 1)[1] != f"shard{owner[posted[text.rsplit(':', 1)[0]]]}"]
+            check(not wrong, f"every update handled by its owner shard ({len(wrong)} wrong)")
+            forwarded = sum(1 for _, text, _ in sent if text.endswith(":shard1"))
+            check(forwarded > 0, f"{forwarded} updates forwarded from shard 0 to shard 1")
+            per_user = {}
+            for chat_id, text, _ in sent:
+                per_user.setdefault(chat_id, []).append(int(text.split(":")[1]))
+            check(all(v == sorted(v) for v in per_user.values()), "replies in order for each user")
+
+            await stop_shard(procs[1])
+            peer_user = next(u for u in user_ids if owner[u] == 1)
+            own_user = next(u for u in user_ids if owner[u] == 0)
+            async with session.post(peers[0] + WEBHOOK_PATH, json=update(10_000, peer_user, "down"),
+                                    headers={SECRET_HEADER: SECRET}) as resp:
+                check(resp.status == 503, f"shard 1 down: its update -> {resp.status}")
+            async with session.post(peers[0] + WEBHOOK_PATH, json=update(10_001, own_user, "up"),
+                                    headers={SECRET_HEADER: SECRET}) as resp:
+                check(resp.status == 200, f"shard 1 down: shard 0 update -> {resp.status}")
+        finally:
+            for proc in procs:
+                await stop_shard(proc)
+            for log in logs:
+                log.close()
+    return failures
+
+
+def shard_main(shard: int, api_url: str):
+    """Процесс одного шарда: serve_webhook до SIGTERM"""
+    asyncio.run(serve_webhook(build_application(api_url, shard), register_webhook=False))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=50)
+    parser.add_argument("--users", type=int, default=6)
+    parser.add_argument("--shard", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--api-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.shard is not None:
+        shard_main(args.shard, args.api_url)
+        return
+
+    print("One shard:")
+    failures = asyncio.run(run(args.updates, args.users))
+    print("\nTwo shards:")
+    failures += asyncio.run(run_sharded(args.updates, args.users))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()